@@ -0,0 +1,353 @@
+import hashlib
+import json
+from typing import Callable, Dict, FrozenSet, List, Optional, Sequence
+import torch
+from transformers import LogitsProcessor, PreTrainedTokenizer
+
+States = FrozenSet[int]
+
+
+class CharClass:
+    def __init__(self, name: str, test: Callable[[str], bool]):
+        self.name = name
+        self.test = test
+
+
+# Unescaped JSON string content, and a digit
+FREE = CharClass("free", lambda char: char not in '"\\' and char >= " ")
+DIGIT = CharClass("digit", lambda char: "0" <= char <= "9")
+
+
+# Parts of a grammar, each adding its states between `start` and the state it returns
+class Literal:
+    def __init__(self, text: str):
+        self.text = text
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        for char in self.text:
+            start = grammar.edge(start, char)
+        return start
+
+
+class Choice:
+    """One of many literals, sharing their prefixes like a trie."""
+
+    def __init__(self, texts: Sequence[str]):
+        self.texts = texts
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        end = grammar.state()
+        children: Dict[tuple, int] = {}
+        for text in self.texts:
+            state = start
+            for char in text:
+                if (state, char) not in children:
+                    children[state, char] = grammar.edge(state, char)
+                state = children[state, char]
+            grammar.epsilon(state, end)
+        return end
+
+
+class Seq:
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        for part in self.parts:
+            start = part.build(grammar, start)
+        return start
+
+
+class Alt:
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        end = grammar.state()
+        for part in self.parts:
+            grammar.epsilon(part.build(grammar, start), end)
+        return end
+
+
+class Repeat:
+    """One or more items with a separator between them."""
+
+    def __init__(self, item, separator):
+        self.item = item
+        self.separator = separator
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        item_start = grammar.state()
+        grammar.epsilon(start, item_start)
+        end = self.item.build(grammar, item_start)
+        grammar.epsilon(self.separator.build(grammar, end), item_start)
+        return end
+
+
+class Chars:
+    """One character of a class, or any number of them with `loop`."""
+
+    def __init__(self, char_class: CharClass, loop: bool = False):
+        self.char_class = char_class
+        self.loop = loop
+
+    def build(self, grammar: "Grammar", start: int) -> int:
+        if not self.loop:
+            return grammar.edge(start, self.char_class)
+        state = grammar.state()
+        grammar.epsilon(start, state)
+        grammar.edges[state].append((self.char_class, state))
+        grammar.loops[state] = self.char_class
+        return state
+
+
+def json_string(values: Optional[Sequence[str]] = None):
+    """Any string, or one or more of `values` joined by ", "."""
+    if values is None:
+        return Seq(Literal('"'), Chars(FREE, loop=True), Literal('"'))
+    return Seq(Literal('"'), Repeat(Choice([json.dumps(value)[1:-1] for value in values]), Literal(", ")), Literal('"'))
+
+
+def json_enum(values: Sequence[str]):
+    return Choice([json.dumps(value) for value in values])
+
+
+def json_integer(max_digits: int = 4):
+    return Alt(*[Seq(*[Chars(DIGIT)] * digits) for digits in range(1, max_digits + 1)])
+
+
+def json_list(item):
+    return Seq(Literal("["), Repeat(item, Literal(", ")), Literal("]"))
+
+
+def json_object(fields: Sequence[tuple]):
+    parts = [Literal("{")]
+    for number, (name, value) in enumerate(fields):
+        parts.append(Literal(("" if number == 0 else ", ") + json.dumps(name) + ": "))
+        parts.append(value)
+    parts.append(Literal("}"))
+    return Seq(*parts)
+
+
+def nullable(part):
+    return Alt(Literal("null"), part)
+
+
+class TokenTable:
+    """Text of every token and tries over them, shared by the grammars of a tokenizer."""
+
+    def __init__(self, tokenizer: PreTrainedTokenizer):
+        # Decoded after an anchor token, so leading spaces are kept
+        anchor = tokenizer.encode("a", add_special_tokens=False)[-1:]
+        anchor_text = tokenizer.decode(anchor)
+        self.texts = [text[len(anchor_text):] for text in tokenizer.batch_decode([anchor + [token] for token in range(len(tokenizer))])]
+        self.special = set(tokenizer.all_special_ids)
+        self.eos = tokenizer.eos_token_id
+        # Tokens of string content only, and the few holding a quote, a
+        # backslash or a control character
+        self.plain_trie: Dict = {}
+        self.quoted_trie: Dict = {}
+        for token, text in enumerate(self.texts):
+            if not text or token in self.special:
+                continue
+            node = self.plain_trie if all(FREE.test(char) for char in text) else self.quoted_trie
+            for char in text:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(token)
+        self._class_masks: Dict[str, torch.Tensor] = {}
+
+    def class_mask(self, char_class: CharClass) -> torch.Tensor:
+        """Tokens made only of characters of `char_class`."""
+        if char_class.name not in self._class_masks:
+            mask = torch.zeros(len(self.texts), dtype=torch.bool)
+            mask[[token for token, text in enumerate(self.texts) if text and token not in self.special and all(char_class.test(char) for char in text)]] = True
+            self._class_masks[char_class.name] = mask
+        return self._class_masks[char_class.name]
+
+
+_TOKEN_TABLES: Dict[int, TokenTable] = {}
+
+
+def token_table(tokenizer: PreTrainedTokenizer) -> TokenTable:
+    if id(tokenizer) not in _TOKEN_TABLES:
+        _TOKEN_TABLES[id(tokenizer)] = TokenTable(tokenizer)
+    return _TOKEN_TABLES[id(tokenizer)]
+
+
+class Grammar:
+    """
+    Character automaton of the JSON a prompt may generate, with the tokens
+    allowed after each set of states.
+
+    The allowed tokens are found by walking the token tries along the
+    automaton, cached per state set. Inside a string any content token is
+    valid, so instead of walking the whole vocabulary those come from a
+    precomputed mask and only the tokens holding a quote are walked.
+    """
+
+    def __init__(self, part):
+        self.edges: List[list] = []
+        self.loops: Dict[int, CharClass] = {}
+        start = self.state()
+        self.final = part.build(self, start)
+        self.start = self._closure({start})
+        self._steps: Dict[tuple, States] = {}
+        self._masks: Dict[tuple, torch.Tensor] = {}
+        self._digest: Optional[str] = None
+
+    def digest(self) -> str:
+        """Hash of the automaton, equal for grammars built from equal parts."""
+        if self._digest is None:
+            edges = [[(label.name if isinstance(label, CharClass) else label, target) for label, target in edges] for edges in self.edges]
+            self._digest = hashlib.sha256(json.dumps([edges, self.final]).encode("utf-8")).hexdigest()
+        return self._digest
+
+    def state(self) -> int:
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def edge(self, start: int, label) -> int:
+        end = self.state()
+        self.edges[start].append((label, end))
+        return end
+
+    def epsilon(self, start: int, end: int):
+        self.edges[start].append((None, end))
+
+    def _closure(self, states) -> States:
+        stack, seen = list(states), set(states)
+        while stack:
+            for label, target in self.edges[stack.pop()]:
+                if label is None and target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return frozenset(seen)
+
+    def step(self, states: States, char: str) -> States:
+        key = (states, char)
+        if key not in self._steps:
+            targets = set()
+            for state in states:
+                for label, target in self.edges[state]:
+                    if label == char or (isinstance(label, CharClass) and label.test(char)):
+                        targets.add(target)
+            self._steps[key] = self._closure(targets) if targets else frozenset()
+        return self._steps[key]
+
+    def advance(self, states: States, text: str) -> States:
+        for char in text:
+            states = self.step(states, char)
+            if not states:
+                break
+        return states
+
+    def _walk(self, node: Dict, states: States, tokens: List[int], skip_free: bool):
+        for char, child in node.items():
+            if char is None:
+                continue
+            following = self.step(states, char)
+            if skip_free:
+                following = frozenset(state for state in following if self.loops.get(state) is not FREE)
+            if following:
+                tokens.extend(child.get(None, ()))
+                self._walk(child, following, tokens, skip_free)
+
+    def allowed(self, table: TokenTable, states: States) -> torch.Tensor:
+        """Mask of the tokens that keep the generated text a prefix of the grammar."""
+        key = (id(table), states)
+        if key not in self._masks:
+            mask = torch.zeros(len(table.texts), dtype=torch.bool)
+            for state in states:
+                if state in self.loops:
+                    mask |= table.class_mask(self.loops[state])
+            tokens: List[int] = []
+            self._walk(table.plain_trie, frozenset(state for state in states if self.loops.get(state) is not FREE), tokens, skip_free=True)
+            self._walk(table.quoted_trie, states, tokens, skip_free=False)
+            mask[tokens] = True
+            if self.final in states:
+                mask[table.eos] = True
+            self._masks[key] = mask
+        return self._masks[key]
+
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    """Masks the tokens leaving the grammar of each row, None rows are left free."""
+
+    def __init__(self, tokenizer: PreTrainedTokenizer, grammars: List[Optional[Grammar]], prompt_length: int):
+        self.table = token_table(tokenizer)
+        self.grammars = grammars
+        self.prompt_length = prompt_length
+        # Generated tokens of each row, and the states before and after each of them
+        self.tokens: List[List[int]] = [[] for _ in grammars]
+        self.states = [[grammar.start] if grammar is not None else None for grammar in grammars]
+
+    def _states(self, row: int, grammar: Grammar, generated: List[int]) -> States:
+        tokens, states = self.tokens[row], self.states[row]
+        # Assisted decoding scores draft tokens and then drops the rejected
+        # ones, so a call can rewind instead of adding one token
+        if generated[:len(tokens)] != tokens:
+            shared = 0
+            while shared < min(len(tokens), len(generated)) and tokens[shared] == generated[shared]:
+                shared += 1
+            del tokens[shared:]
+            del states[shared + 1:]
+        for token in generated[len(tokens):]:
+            following = states[-1]
+            if token not in self.table.special and following:
+                following = grammar.advance(following, self.table.texts[token])
+            tokens.append(token)
+            states.append(following)
+        return states[-1]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row, grammar in enumerate(self.grammars):
+            if grammar is None:
+                continue
+            states = self._states(row, grammar, input_ids[row, self.prompt_length:].tolist())
+            if not states:
+                continue
+            mask = grammar.allowed(self.table, states)
+            if not mask.any():
+                # No token of the vocabulary continues the grammar, leave the row free
+                continue
+            mask = mask.to(scores.device)
+            vocabulary = min(len(mask), scores.shape[-1])
+            scores[row, :vocabulary] = scores[row, :vocabulary].masked_fill(~mask[:vocabulary], -float("inf"))
+            scores[row, vocabulary:] = -float("inf")
+        return scores
+
+
+# Actions each DM prompt may return
+DM_ACTIONS = {
+    "DM_recipe_recommendation": ["propose_recipe", "no_recipe_found", "req_info_nationality", "req_info_category", "req_info_ingredients"],
+    "DM_ask_for_ingredients": ["ask_recipe_name", "provide_ingredients"],
+    "DM_ask_for_procedure": ["ask_recipe_name", "provide_procedure"],
+    "DM_ask_for_time": ["ask_recipe_name", "provide_time_needed"],
+}
+DM_ACTIONS["DM"] = list(dict.fromkeys(action for actions in DM_ACTIONS.values() for action in actions))
+
+
+def slot_value(slot: str, vocabularies: Optional[Dict[str, List[str]]]):
+    if slot == "max_time":
+        return nullable(json_integer())
+    if slot == "ingredients_mode":
+        return nullable(json_enum(["pantry"]))
+    values = vocabularies.get(slot) if vocabularies is not None else None
+    # An empty vocabulary (e.g. an empty database) would allow no value at all
+    return nullable(json_string(values or None))
+
+
+def stage_grammar(prompt_key: str, intents: Dict[str, List[str]], vocabularies: Optional[Dict[str, List[str]]] = None) -> Optional[Grammar]:
+    """
+    The grammar of a JSON prompt of PROMPTS, or None for free text. `intents`
+    maps each intent to its slot names; with `vocabularies` slot values are
+    restricted to the known values of the slot.
+    """
+    if prompt_key == "NLU_INTENT":
+        return Grammar(json_object([("intents", json_list(json_enum(list(intents))))]))
+    if prompt_key.startswith("NLU_SLOTS_"):
+        slots = intents[prompt_key[len("NLU_SLOTS_"):]]
+        return Grammar(json_object([("slots", json_object([(slot, slot_value(slot, vocabularies)) for slot in slots]))]))
+    if prompt_key in DM_ACTIONS:
+        return Grammar(json_object([("action_required", json_list(json_enum(DM_ACTIONS[prompt_key])))]))
+    return None
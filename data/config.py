@@ -1,11 +1,38 @@
-# import os
+import os
 # from pathlib import Path
 # from sqlalchemy import create_engine
 
 # API URL
 API_URL = "https://www.themealdb.com/api/json/v1/1/search.php?s="
+API_BASE_URL = "https://www.themealdb.com/api/json/v1/1/"
+
+# Crawl state of data/ingest.py
+INGEST_CHECKPOINT_PATH = "data/ingest_checkpoint.json"
+INGEST_HTTP_CACHE_PATH = "data/ingest_http_cache.json"
+
+# Path to the JSON database
+DB_PATH = "data/meal_database.json"
+# The insert journal is merged into DB_PATH once it holds more records than
+# the snapshot, and never below this many
+JOURNAL_COMPACT_MIN_RECORDS = 1000
+
+# Ranked recommendations (data/scoring.py): score added by a matching area or
+# category, in the IDF units of the ingredient weights
+SCORE_AREA_BOOST = 2.0
+SCORE_CATEGORY_BOOST = 2.0
+# Closest recipes proposed when no recipe matches every slot
+CLOSEST_RECIPES_K = 5
+
+# Pantry mode: ingredients a recipe may need besides the ones the user has
+PANTRY_MAX_MISSING = 2
+# and the most they may need to be proposed as closest when none is within that
+PANTRY_CLOSEST_MAX_MISSING = 5
+
+# Database configuration
+# Storage backend behind data.database: "json" (DB_PATH) or "sqlite" (SQLITE_PATH)
+DB_BACKEND = os.environ.get("CHEFFY_DB_BACKEND", "json")
+SQLITE_PATH = "data/meals.db"
 
-# # Database configuration
 # CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 # DB_PATH = Path(f"{CURRENT_DIR}/meals.db")  # Save database in a subdirectory called 'data'
 # DB_PATH.parent.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+from data.index import normalize_term
+from data.meal import Meal
+
+
+class CooccurrenceStats:
+    """
+    Ingredient co-occurrence counts of the catalogue.
+
+    The counts are the sparse ingredient x ingredient product of the binary
+    recipe x ingredient matrix with itself: entry (i, j) is the number of
+    recipes using both i and j, and the diagonal the number using i. Built
+    once from the facet keys and updated in place when meals are inserted.
+    """
+
+    def __init__(self, keys_by_meal: Sequence[Iterable[str]] = (), displays: Optional[Dict[str, str]] = None):
+        self.ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.displays: Dict[str, str] = dict(displays or {})
+        self.meals = 0
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.int64)
+        self.add(keys_by_meal)
+
+    def _id(self, key: str) -> int:
+        column = self.ids.get(key)
+        if column is None:
+            column = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return column
+
+    def add(self, keys_by_meal: Iterable[Iterable[str]]):
+        """Count the meals given as their normalized ingredient keys."""
+        rows, columns = [], []
+        meals = 0
+        for keys in keys_by_meal:
+            for key in set(keys):
+                rows.append(meals)
+                columns.append(self._id(key))
+            meals += 1
+        size = len(self.keys)
+        presence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)), shape=(meals, size))
+        matrix = self.matrix.copy()
+        matrix.resize((size, size))
+        self.matrix = (matrix + presence.T @ presence).tocsr()
+        self.meals += meals
+
+    def add_meals(self, meals: Iterable[Meal]):
+        keys_by_meal = []
+        for meal in meals:
+            keys = []
+            for name in meal.ingredient_names:
+                key = normalize_term(name)
+                self.displays.setdefault(key, name)
+                keys.append(key)
+            keys_by_meal.append(keys)
+        self.add(keys_by_meal)
+
+    def display(self, key: str) -> str:
+        return self.displays.get(key, key)
+
+    def count(self, ingredient: str) -> int:
+        column = self.ids.get(normalize_term(ingredient))
+        return int(self.matrix[column, column]) if column is not None else 0
+
+    def cooccurring(self, ingredient: str) -> Dict[str, int]:
+        """Number of recipes using `ingredient` together with each other ingredient."""
+        column = self.ids.get(normalize_term(ingredient))
+        if column is None:
+            return {}
+        row = self.matrix.getrow(column)
+        return {self.display(self.keys[other]): int(count) for other, count in zip(row.indices, row.data) if other != column and count}
+
+    def conditional(self, ingredient: str) -> Dict[str, float]:
+        """P(other ingredient | ingredient) over the recipes using `ingredient`."""
+        total = self.count(ingredient)
+        return {other: count / total for other, count in self.cooccurring(ingredient).items()} if total else {}
+
+    def totals(self) -> Dict[str, int]:
+        return {self.display(key): int(count) for key, count in zip(self.keys, self.matrix.diagonal()) if count}
+
+
+def best_splits(counts: Dict[str, int], total: int, k: int) -> List[Tuple[str, int]]:
+    """
+    The k (ingredient, recipes) pairs closest to splitting `total` candidates
+    in half, so either answer to "do you want it?" removes the most options.
+    Ingredients used by every candidate or by none tell nothing and are left out.
+    """
+    splits = [(name, count) for name, count in counts.items() if 0 < count < total]
+    splits.sort(key=lambda split: (abs(split[1] / total - 0.5), -split[1], split[0]))
+    return splits[:k]
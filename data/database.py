@@ -3,49 +3,29 @@ import json
 from pathlib import Path
 from typing import Optional, List
 import requests
-from data.config import API_URL
-
-# Define the structure for Meal class
-class Meal:
-    def __init__(
-        self,
-        idMeal: str,
-        strMeal: str,
-        strCategory: Optional[str] = None,
-        strArea: Optional[str] = None,
-        strInstructions: Optional[str] = None,
-        strMealThumb: Optional[str] = None,
-        strTags: Optional[str] = None,
-        strYoutube: Optional[str] = None,
-        strSource: Optional[str] = None,
-        ingredients: Optional[str] = None,
-    ):
-        self.idMeal = idMeal
-        self.strMeal = strMeal
-        self.strCategory = strCategory
-        self.strArea = strArea
-        self.strInstructions = strInstructions
-        self.strMealThumb = strMealThumb
-        self.strTags = strTags
-        self.strYoutube = strYoutube
-        self.strSource = strSource
-        self.ingredients = ingredients
-
-    def to_dict(self):
-        return self.__dict__
-
-    @staticmethod
-    def from_dict(data):
-        return Meal(**data)
-
-# Path to the JSON database
-DB_PATH = "data/meal_database.json"
+from data.config import API_URL, CLOSEST_RECIPES_K, DB_PATH, PANTRY_MAX_MISSING
+from data.index import normalize_term
+from data.meal import Meal
+from data.procedure import estimate_complete
+from data.projection import project, stored_fields
+from data.store import get_store, set_backend
 
 # Initialize the database
 def init_db():
-    if not os.path.exists(DB_PATH):
-        with open(DB_PATH, "w") as db_file:
-            json.dump([], db_file)
+    get_store().init()
+
+# Build a Meal from a MealDB API record
+def meal_from_api(item: dict) -> Meal:
+    valid_fields = Meal.__init__.__code__.co_varnames
+
+    # Prepare ingredients field
+    item = dict(item)
+    item["ingredients"] = [item.get(f"strIngredient{i}") for i in range(1, 21) if item.get(f"strIngredient{i}")]
+    item["ingredients"] = "##".join(item["ingredients"])
+
+    # Filter out unexpected fields
+    filtered_item = {key: value for key, value in item.items() if key in valid_fields}
+    return Meal.from_dict(filtered_item)
 
 # Fetch data from the MealDB API
 def fetch_meals():
@@ -54,19 +34,11 @@ def fetch_meals():
     data = response.json()
 
     meals = []
-    valid_fields = Meal.__init__.__code__.co_varnames
 
     for item in data.get("meals", []):
-        # Prepare ingredients field
-        item["ingredients"] = [item[f"strIngredient{i}"] for i in range(1, 21) if item[f"strIngredient{i}"]]
-        item["ingredients"] = "##".join(item["ingredients"])
-
-        # Filter out unexpected fields
-        filtered_item = {key: value for key, value in item.items() if key in valid_fields}
-
         # Create a Meal instance
         try:
-            meals.append(Meal.from_dict(filtered_item))
+            meals.append(meal_from_api(item))
         except TypeError as e:
             print(f"Error creating Meal: {e}")
 
@@ -76,80 +48,144 @@ def fetch_meals():
     return meals
 
 
-# Insert meals into the JSON database
+# Insert meals into the selected backend
 def insert_meals(meals: List[Meal]):
-    with open(DB_PATH, "r") as db_file:
-        db_data = json.load(db_file)
+    get_store().insert(meals)
 
-    db_data_ids = {meal["idMeal"] for meal in db_data}
-
-    for meal in meals:
-        if meal.idMeal not in db_data_ids:
-            db_data.append(meal.to_dict())
-
-    with open(DB_PATH, "w") as db_file:
-        json.dump(db_data, db_file, indent=4)
-
-# Query functions
+# Query functions, all served by the selected MealStore backend
 def get_all_meals():
-    with open(DB_PATH, "r") as db_file:
-        db_data = json.load(db_file)
-        return [Meal.from_dict(meal) for meal in db_data]
+    return list(get_store().meals)
 
 def get_all_recipe_names():
-    return [meal.strMeal for meal in get_all_meals()]
+    return list(get_store().recipe_names())
 
 def get_meal_by_name(name: str):
-    return [meal.to_dict() for meal in get_all_meals() if name.lower() in meal.strMeal.lower()]
+    return [meal.to_dict() for meal in get_store().find_by_name(name)]
+
+def resolve_recipe_name(name: str, limit: int = 5):
+    """Ranked (recipe name, score) matches for a possibly misspelled or space-mangled name."""
+    return [(meal.strMeal, score) for meal, score in get_store().resolve_name(name, limit)]
+
+def get_meal_projection(name: str, fields: List[str]):
+    """
+    Only `fields` of the recipes matching `name` (the closest names without a
+    substring match), e.g. INTENT_FIELDS["ask_for_ingredients"]. Stored fields
+    are read one by one, so unused instructions or URLs are never decoded.
+    """
+    store = get_store()
+    positions = store.find_positions(name)
+    if not positions:
+        matches = store.resolve_positions(name)
+        positions = [position for position, score in matches if score == matches[0][1]]
+    return [project(record, fields) for record in store.read_fields(positions, stored_fields(fields))]
+
+def get_recipe_names_by_prefix(prefix: str, limit: int = 10):
+    return get_store().names_by_prefix(prefix, limit)
 
 def get_meals_by_category(category: str):
-    return [meal.to_dict() for meal in get_all_meals() if meal.strCategory == category]
+    return [meal.to_dict() for meal in get_store().by_category(category)]
 
 def get_all_ingredients():
-    ingredients = []
-    for meal in get_all_meals():
-        ingredients.extend(meal.ingredients.split("##"))
-    return list(set(ingredients))
+    return list(get_store().ingredients())
 
 def get_ingredients_by_meal(name: str):
     meals = get_meal_by_name(name)
     ingredients = []
     for meal in meals:
-        ingredients.extend(meal.ingredients.split("##"))
+        ingredients.extend(meal["ingredients"].split("##"))
     return list(set(ingredients))
 
-def filter_recipes(nationality: Optional[str] = None, category: Optional[str] = None, ingredients: Optional[List[str]] = None):
-    results = []
+def _parse_ingredients(ingredients):
     if isinstance(ingredients,str):
         ingredients = ingredients.split(",")
         ingredients = [ing.replace(" ","").lower() for ing in ingredients]
-    for meal in get_all_meals():
-        if (nationality is None or meal.strArea.lower() == nationality.lower()) and \
-            (category is None or meal.strCategory.lower() == category.lower()) and \
-            (ingredients is None or all(ingredient in meal.ingredients.lower().split("##") for ingredient in ingredients)):
-            results.append(meal.strMeal)
+    return ingredients
+
+def filter_recipes(nationality: Optional[str] = None, category: Optional[str] = None, ingredients: Optional[List[str]] = None, exclude_ingredients: Optional[List[str]] = None, max_time: Optional[int] = None):
+    meals = get_store().filter(nationality, category, _parse_ingredients(ingredients), _parse_ingredients(exclude_ingredients), max_time)
+    return [meal.strMeal for meal in meals]
+
+def get_unconfirmed_times(names: List[str]):
+    """The `names` whose estimated time is only a lower bound, a time filter keeps them as they may still fit."""
+    store = get_store()
+    unconfirmed = []
+    for name in names:
+        records = store.read_fields(store.find_positions(name), ["strMeal", "strInstructions"])
+        if any(record["strMeal"] == name and not estimate_complete(record["strInstructions"]) for record in records):
+            unconfirmed.append(name)
+    return unconfirmed
+
+def get_pantry_recipes(ingredients: List[str], max_missing: int = PANTRY_MAX_MISSING, nationality: Optional[str] = None, category: Optional[str] = None, max_time: Optional[int] = None):
+    """(recipe name, missing ingredients) of the recipes cookable with `ingredients` and at most `max_missing` more."""
+    pantry = _parse_ingredients(ingredients) or []
+    available = {normalize_term(ingredient) for ingredient in pantry}
+    results = []
+    for meal, missing in get_store().pantry(pantry, max_missing, nationality, category, max_time):
+        results.append((meal.strMeal, [name for name in dict.fromkeys(meal.ingredient_names) if normalize_term(name) not in available]))
     return results
 
+def rank_recipes(nationality: Optional[str] = None, category: Optional[str] = None, ingredients: Optional[List[str]] = None, exclude_ingredients: Optional[List[str]] = None, max_time: Optional[int] = None, k: int = CLOSEST_RECIPES_K):
+    """Best (recipe name, score) partial matches of the slots, score 1.0 meaning every slot matches; max_time is a hard limit."""
+    query = {"nationality": nationality, "category": category, "ingredients": ingredients, "exclude_ingredients": exclude_ingredients, "max_time": max_time}
+    return rank_recipes_batch([query], k)[0]
+
+def rank_recipes_batch(queries: List[dict], k: int = CLOSEST_RECIPES_K):
+    """rank_recipes for many slot dicts at once, scored with a single matrix product."""
+    from data.scoring import Query
+    queries = [
+        Query(query.get("nationality"), query.get("category"), _parse_ingredients(query.get("ingredients")), _parse_ingredients(query.get("exclude_ingredients")), query.get("max_time"))
+        for query in queries
+    ]
+    return [[(meal.strMeal, round(score, 3)) for meal, score in top] for top in get_store().rank(queries, k)]
+
+def get_similar_meals(name: str, k: int = 5):
+    """(recipe name, similarity) of the k recipes most similar to `name`, read from the precomputed neighbour lists."""
+    return get_store().similar(name, k)
+
 def get_all_areas():
-    return list(set(meal.strArea for meal in get_all_meals() if meal.strArea))
+    return list(get_store().areas())
 
 def get_recipes(slots: dict):
     results = []
-    for meal in get_all_meals():
+    for meal in get_store().meals:
         if all(getattr(meal, key) == value for key, value in slots.items() if value):
             results.append(meal.strMeal)
     return results
 
 def get_meals_by_ingredients(ingredients: List[str]):
     results = []
-    for meal in get_all_meals():
-        meal_ingredients = set(meal.ingredients.split("##"))
+    # The index is case-insensitive, the exact match is checked on the candidates only
+    for meal in get_store().filter(ingredients=ingredients):
+        meal_ingredients = set(meal.ingredient_names)
         if all(ingredient in meal_ingredients for ingredient in ingredients):
             results.append(meal.strMeal)
     return results
 
 def get_all_categories():
-    return list(set(meal.strCategory for meal in get_all_meals() if meal.strCategory))
+    return list(get_store().categories())
+
+# Facets of the recommendation slots: "nationality", "category" and "ingredients"
+def is_known_value(facet: str, value: str):
+    return get_store().facets().has(facet, value)
+
+def get_facet_counts(facet: str):
+    """Number of recipes per value of the facet, most frequent first."""
+    return get_store().facets().counts(facet)
+
+def get_conditional_facet_counts(facet: str, slots: dict):
+    """Number of recipes per value of the facet among those matching the other filled slots."""
+    return get_store().facets().conditional_counts(facet, _parse_slots(slots))
+
+def rank_missing_slots(slots: dict):
+    """Unfilled recommendation slots, the one splitting the current matches best first."""
+    return [facet for facet, expected in get_store().facets().rank_missing_slots(_parse_slots(slots))]
+
+def suggest_refining_ingredients(current_slots: dict, k: int = 5):
+    """Ingredients to ask about that best split the recipes matching the current slots."""
+    return [ingredient for ingredient, count in get_store().refining_ingredients(_parse_slots(current_slots), k)]
+
+def _parse_slots(slots: dict):
+    return dict(slots, ingredients=_parse_ingredients(slots.get("ingredients")))
 
 if __name__ == "__main__":
     # Initialize the database
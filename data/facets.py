@@ -0,0 +1,101 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+from data.index import MealIndex, normalize_term
+
+# Recommendation slots and the MealIndex posting dict answering each of them
+FACETS = {
+    "nationality": "areas",
+    "category": "categories",
+    "ingredients": "ingredients",
+}
+
+
+class FacetIndex:
+    """
+    Distinct values and recipe counts of the recommendation slots.
+
+    Global counts are the posting list lengths of the MealIndex. Conditional
+    counts (how many recipes remain per value given a partial filter) walk
+    only the recipes matching the filter, through a per-recipe table of facet
+    keys inverted once from the postings.
+    """
+
+    def __init__(self, index: MealIndex, values: Dict[str, Iterable[str]]):
+        self.index = index
+        self.displays: Dict[str, Dict[str, str]] = {}
+        for facet, facet_values in values.items():
+            displays = {}
+            for value in facet_values:
+                if value:
+                    displays.setdefault(normalize_term(value), value)
+            self.displays[facet] = displays
+        self._by_meal: Dict[str, List[Tuple[str, ...]]] = {}
+
+    def _postings(self, facet: str):
+        return getattr(self.index, FACETS[facet])
+
+    def display(self, facet: str, key: str) -> str:
+        return self.displays[facet].get(key, key)
+
+    def has(self, facet: str, value: str) -> bool:
+        return normalize_term(value) in self._postings(facet)
+
+    def values(self, facet: str) -> List[str]:
+        return [self.display(facet, key) for key in self._postings(facet)]
+
+    def counts(self, facet: str) -> Dict[str, int]:
+        """Number of recipes per value of `facet`, most frequent first."""
+        postings = self._postings(facet)
+        keys = sorted(postings, key=lambda key: -len(postings[key]))
+        return {self.display(facet, key): len(postings[key]) for key in keys}
+
+    def keys_by_meal(self, facet: str) -> List[Tuple[str, ...]]:
+        """The normalized values of `facet` of every meal, by position."""
+        by_meal = self._by_meal.get(facet)
+        if by_meal is None:
+            lists: List[List[str]] = [[] for _ in range(self.index.size)]
+            for key, positions in self._postings(facet).items():
+                for position in positions:
+                    lists[position].append(key)
+            by_meal = self._by_meal[facet] = [tuple(keys) for keys in lists]
+        return by_meal
+
+    def conditional_counts(self, facet: str, slots: Dict[str, object]) -> Dict[str, int]:
+        """
+        Recipes per value of `facet` among those matching the other slots.
+
+        A single-valued facet ignores its own slot, so the counts show the
+        alternatives to the current choice; ingredients keep their filter and
+        count the ingredients that could be added to it.
+        """
+        filters = {slot: slots.get(slot) for slot in FACETS}
+        if facet != "ingredients":
+            filters[facet] = None
+        candidates = self.index.match(filters["nationality"], filters["category"], filters["ingredients"])
+        selected = {normalize_term(value) for value in filters["ingredients"] or []} if facet == "ingredients" else set()
+        by_meal = self.keys_by_meal(facet)
+        counter = Counter()
+        for position in candidates:
+            counter.update(by_meal[position])
+        return {self.display(facet, key): count for key, count in counter.most_common() if key not in selected}
+
+    def rank_missing_slots(self, slots: Dict[str, object]) -> List[Tuple[str, float]]:
+        """
+        Unfilled slots ordered from the most to the least discriminating.
+
+        A slot scores the number of recipes expected to remain once the user
+        answers it, sum(count^2) / sum(count) over its conditional counts, so
+        the best question splits the current matches into the smallest parts.
+        Slots that no current match has a value for are left out.
+        """
+        ranked = []
+        for facet in FACETS:
+            if slots.get(facet):
+                continue
+            counts = self.conditional_counts(facet, slots).values()
+            total = sum(counts)
+            if total:
+                ranked.append((facet, sum(count * count for count in counts) / total))
+        ranked.sort(key=lambda item: item[1])
+        return ranked
+
@@ -0,0 +1,96 @@
+import unicodedata
+from itertools import combinations
+from typing import Dict, List, Mapping, Sequence, Set, Tuple
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+MIN_SCORE = 0.6
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents and drop everything but letters and digits."""
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(char for char in decomposed.lower() if char.isalnum())
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, or max_distance + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    """Every string obtained by removing up to max_distance characters from `word`."""
+    results = {word}
+    for count in range(1, min(max_distance, len(word)) + 1):
+        for positions in combinations(range(len(word)), count):
+            results.add("".join(char for i, char in enumerate(word) if i not in positions))
+    return results
+
+
+class FuzzyNameIndex:
+    """
+    SymSpell-style index for typo- and spacing-tolerant recipe name lookup.
+
+    Names are normalized (case, accents, spaces, punctuation) and the deletes
+    of their first PREFIX_LENGTH characters are precomputed, so a lookup only
+    generates the deletes of the query prefix and verifies the few candidates
+    sharing one with the full edit distance.
+    """
+
+    def __init__(self, names: List[str], max_distance: int = MAX_DISTANCE, prefix_length: int = PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.keys: Dict[str, List[int]] = {}
+        for position, name in enumerate(names):
+            key = normalize_name(name)
+            if key:
+                self.keys.setdefault(key, []).append(position)
+        self.deletes: Dict[str, List[str]] = {}
+        for key in self.keys:
+            for delete in deletes(key[:prefix_length], max_distance):
+                self.deletes.setdefault(delete, []).append(key)
+
+    @classmethod
+    def from_parts(cls, keys: Mapping[str, Sequence[int]], deletes: Mapping[str, Sequence[str]], max_distance: int, prefix_length: int):
+        """Wrap keys and deletes built elsewhere, e.g. mapped from a binary snapshot."""
+        index = cls.__new__(cls)
+        index.max_distance, index.prefix_length = max_distance, prefix_length
+        index.keys, index.deletes = keys, deletes
+        return index
+
+    def lookup(self, query: str, limit: int = 5, min_score: float = MIN_SCORE) -> List[Tuple[int, float]]:
+        """Positions of the closest names with a 0..1 similarity score, best first."""
+        query = normalize_name(query)
+        if not query:
+            return []
+        if query in self.keys:
+            return [(position, 1.0) for position in self.keys[query]][:limit]
+
+        scored: Dict[str, float] = {}
+        for delete in deletes(query[:self.prefix_length], self.max_distance):
+            for key in self.deletes.get(delete, []):
+                if key in scored:
+                    continue
+                distance = edit_distance(query, key, self.max_distance)
+                if distance <= self.max_distance:
+                    scored[key] = 1 - distance / max(len(query), len(key))
+
+        ranked = sorted((score, key) for key, score in scored.items() if score >= min_score)
+        results = []
+        for score, key in reversed(ranked):
+            results.extend((position, round(score, 3)) for position in self.keys[key])
+        return results[:limit]
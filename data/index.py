@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from data.meal import Meal
+
+EMPTY = array("I")
+
+
+def normalize_term(value: str) -> str:
+    """Normalize an ingredient/area/category for index lookups."""
+    return " ".join(value.lower().split())
+
+
+def contains(posting: array, meal_id: int) -> bool:
+    position = bisect_left(posting, meal_id)
+    return position < len(posting) and posting[position] == meal_id
+
+
+def intersect(postings: List[array]) -> List[int]:
+    """AND of sorted posting lists, driven by the shortest one."""
+    if not postings:
+        return []
+    postings = sorted(postings, key=len)
+    result = list(postings[0])
+    for posting in postings[1:]:
+        if not result:
+            break
+        result = [meal_id for meal_id in result if contains(posting, meal_id)]
+    return result
+
+
+def subtract(candidates: Iterable[int], postings: List[array]) -> List[int]:
+    """AND-NOT of the candidates against every posting list."""
+    return [meal_id for meal_id in candidates if not any(contains(posting, meal_id) for posting in postings)]
+
+
+class MealIndex:
+    """
+    Inverted index from normalized area, category and ingredient to the
+    positions of the meals containing it, kept as sorted uint32 arrays.
+
+    Posting lists are sorted arrays rather than integer bitsets: bitsets
+    cost catalogue-size/8 bytes per distinct ingredient, while arrays stay
+    proportional to the number of (meal, ingredient) pairs. Intersections
+    walk the shortest list, so a query costs O(matches * log n).
+    """
+
+    def __init__(self, meals: List[Meal]):
+        self.size = len(meals)
+        self.areas = self._build(meals, lambda meal: [meal.strArea] if meal.strArea else [])
+        self.categories = self._build(meals, lambda meal: [meal.strCategory] if meal.strCategory else [])
+        self.ingredients = self._build(meals, lambda meal: meal.ingredient_names)
+        self._ingredient_counts: Optional[array] = None
+
+    @classmethod
+    def from_postings(cls, size: int, areas: Dict[str, Sequence[int]], categories: Dict[str, Sequence[int]], ingredients: Dict[str, Sequence[int]]):
+        """Wrap posting lists built elsewhere, e.g. mapped from a binary snapshot."""
+        index = cls.__new__(cls)
+        index.size = size
+        index.areas, index.categories, index.ingredients = areas, categories, ingredients
+        index._ingredient_counts = None
+        return index
+
+    @staticmethod
+    def _build(meals: List[Meal], values) -> Dict[str, array]:
+        postings: Dict[str, array] = {}
+        for meal_id, meal in enumerate(meals):
+            for term in {normalize_term(value) for value in values(meal)}:
+                postings.setdefault(term, array("I")).append(meal_id)
+        return postings
+
+    def match(
+        self,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+        ingredients: Optional[List[str]] = None,
+        exclude_ingredients: Optional[List[str]] = None,
+    ) -> List[int]:
+        """Positions of the meals matching every filter and none of the exclusions, in database order."""
+        postings = []
+        if nationality is not None:
+            postings.append(self.areas.get(normalize_term(nationality), EMPTY))
+        if category is not None:
+            postings.append(self.categories.get(normalize_term(category), EMPTY))
+        for ingredient in ingredients or []:
+            postings.append(self.ingredients.get(normalize_term(ingredient), EMPTY))
+
+        candidates = intersect(postings) if postings else range(self.size)
+        if exclude_ingredients:
+            excluded = [self.ingredients[term] for term in map(normalize_term, exclude_ingredients) if term in self.ingredients]
+            return subtract(candidates, excluded)
+        return list(candidates)
+
+    @property
+    def ingredient_counts(self) -> array:
+        """Number of distinct ingredients of every meal, counted once over the postings."""
+        if self._ingredient_counts is None:
+            counts = array("I", bytes(4 * self.size))
+            for posting in self.ingredients.values():
+                for meal_id in posting:
+                    counts[meal_id] += 1
+            self._ingredient_counts = counts
+        return self._ingredient_counts
+
+    def pantry(
+        self,
+        ingredients: List[str],
+        max_missing: int = 0,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        (position, missing count) of the meals needing at most `max_missing`
+        ingredients besides `ingredients`, fewest missing first.
+
+        One counting pass over the posting lists of the pantry gives, per
+        meal, how many of its ingredients are available; a meal qualifies
+        when that count is within max_missing of its ingredient count. The
+        cost depends on the pantry postings only, never on the catalogue.
+        """
+        available: Dict[int, int] = {}
+        for term in {normalize_term(ingredient) for ingredient in ingredients}:
+            for meal_id in self.ingredients.get(term, EMPTY):
+                available[meal_id] = available.get(meal_id, 0) + 1
+
+        filters = []
+        if nationality is not None:
+            filters.append(self.areas.get(normalize_term(nationality), EMPTY))
+        if category is not None:
+            filters.append(self.categories.get(normalize_term(category), EMPTY))
+
+        counts = self.ingredient_counts
+        matches = []
+        for meal_id, count in available.items():
+            missing = counts[meal_id] - count
+            if missing <= max_missing and all(contains(posting, meal_id) for posting in filters):
+                matches.append((meal_id, missing))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
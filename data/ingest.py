@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import time
+from typing import Dict, Iterable, List, Optional
+import httpx
+from data.config import API_BASE_URL, INGEST_CHECKPOINT_PATH, INGEST_HTTP_CACHE_PATH
+from data.database import init_db, insert_meals, meal_from_api
+from data.meal import Meal
+from data.files import atomic_write
+from data.store import MealStore, get_store
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket shared by all the crawl workers."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HttpCache:
+    """Persisted ETag/Last-Modified validators and bodies for conditional requests."""
+
+    def __init__(self, path: Optional[str] = INGEST_HTTP_CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as cache_file:
+                self.entries = json.load(cache_file)
+
+    def headers(self, url: str) -> Dict[str, str]:
+        entry = self.entries.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def body(self, url: str):
+        return self.entries[url]["body"]
+
+    def store(self, url: str, response: httpx.Response, body):
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.entries[url] = {"etag": etag, "last_modified": last_modified, "body": body}
+
+    def save(self):
+        if self.path:
+            atomic_write(self.path, json.dumps(self.entries))
+
+
+class Checkpoint:
+    """Letters and meal ids already crawled, persisted after every unit of work."""
+
+    def __init__(self, path: Optional[str] = INGEST_CHECKPOINT_PATH):
+        self.path = path
+        self.letters: set = set()
+        self.ids: set = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as checkpoint_file:
+                state = json.load(checkpoint_file)
+            self.letters, self.ids = set(state["letters"]), set(state["ids"])
+
+    def save(self):
+        if self.path:
+            atomic_write(self.path, json.dumps({"letters": sorted(self.letters), "ids": sorted(self.ids)}))
+
+    def reset(self):
+        self.letters, self.ids = set(), set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MealCrawler:
+    """
+    Concurrent, resumable MealDB crawler.
+
+    Meals are listed by first letter (search.php?f=) and fetched by id
+    (lookup.php?i=) through one pooled httpx client. A semaphore bounds the
+    requests in flight, a token bucket caps the request rate, failed requests
+    are retried with exponential backoff and responses are revalidated with
+    ETag/If-Modified-Since. Every finished letter or id is inserted and
+    checkpointed, so an interrupted crawl resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_BASE_URL,
+        concurrency: int = 8,
+        rate: float = 10.0,
+        retries: int = 4,
+        backoff: float = 0.5,
+        timeout: float = 30.0,
+        checkpoint: Optional[Checkpoint] = None,
+        cache: Optional[HttpCache] = None,
+    ):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate, burst=concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.checkpoint = checkpoint if checkpoint is not None else Checkpoint()
+        self.cache = cache if cache is not None else HttpCache()
+        self.meals_fetched = 0
+        self.requests_sent = 0
+        self.not_modified = 0
+
+    async def get_json(self, client: httpx.AsyncClient, path: str):
+        url = self.base_url + path
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            try:
+                self.requests_sent += 1
+                response = await client.get(url, headers=self.cache.headers(url))
+            except httpx.TransportError as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Request to {url} failed ({e!r}), retrying")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code == 304:
+                self.not_modified += 1
+                return self.cache.body(url)
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                retry_after = response.headers.get("Retry-After", "")
+                await asyncio.sleep(float(retry_after) if retry_after.isdigit() else self._delay(attempt))
+                continue
+            response.raise_for_status()
+            body = response.json()
+            self.cache.store(url, response, body)
+            return body
+
+    def _delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+    async def _ingest(self, items: Optional[List[dict]]) -> List[Meal]:
+        meals = []
+        for item in items or []:
+            try:
+                meals.append(meal_from_api(item))
+            except TypeError as e:
+                print(f"Error creating Meal: {e}")
+        if meals:
+            # Journal writes and compactions run off the event loop, so the
+            # requests in flight keep going meanwhile
+            await asyncio.to_thread(insert_meals, meals)
+        self.meals_fetched += len(meals)
+        return meals
+
+    def _save_progress(self):
+        # The validators are saved with the checkpoint, so a crash keeps the
+        # ones of every unit already done
+        self.checkpoint.save()
+        self.cache.save()
+
+    async def _crawl_letter(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, letter: str):
+        async with semaphore:
+            data = await self.get_json(client, f"search.php?f={letter}")
+        meals = await self._ingest(data.get("meals"))
+        self.checkpoint.letters.add(letter)
+        self.checkpoint.ids.update(meal.idMeal for meal in meals)
+        self._save_progress()
+
+    async def _crawl_id(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, id_meal: str):
+        async with semaphore:
+            data = await self.get_json(client, f"lookup.php?i={id_meal}")
+        await self._ingest(data.get("meals"))
+        self.checkpoint.ids.add(id_meal)
+        self._save_progress()
+
+    async def crawl(self, letters: Iterable[str] = string.ascii_lowercase, ids: Iterable[str] = ()) -> dict:
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            try:
+                results = await asyncio.gather(*(
+                    self._crawl_letter(client, semaphore, letter)
+                    for letter in letters if letter not in self.checkpoint.letters
+                ), return_exceptions=True)
+                # Letters run first, so ids they already returned are skipped
+                results += await asyncio.gather(*(
+                    self._crawl_id(client, semaphore, id_meal)
+                    for id_meal in dict.fromkeys(ids) if id_meal not in self.checkpoint.ids
+                ), return_exceptions=True)
+            finally:
+                self.cache.save()
+        # Failed units stay out of the checkpoint and are retried by the next run
+        failures = [result for result in results if isinstance(result, Exception)]
+        for failure in failures:
+            print(f"Crawl step failed: {failure!r}")
+        elapsed = time.perf_counter() - start
+        return {
+            "meals": self.meals_fetched,
+            "requests": self.requests_sent,
+            "not_modified": self.not_modified,
+            "failures": len(failures),
+            "seconds": round(elapsed, 3),
+            "meals_per_second": round(self.meals_fetched / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl TheMealDB into the meal database.")
+    parser.add_argument("--base-url", type=str, default=API_BASE_URL, help="API root, e.g. a local stand-in server.")
+    parser.add_argument("--letters", type=str, default=string.ascii_lowercase, help="First letters to crawl.")
+    parser.add_argument("--ids", type=str, nargs="*", default=[], help="Meal ids to fetch with lookup.php.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum requests per second (0 disables the limit).")
+    parser.add_argument("--retries", type=int, default=4, help="Retries per request.")
+    parser.add_argument("--reset", action="store_true", help="Ignore the checkpoint and crawl everything again.")
+    args = parser.parse_args()
+
+    init_db()
+    checkpoint = Checkpoint()
+    if args.reset:
+        checkpoint.reset()
+    crawler = MealCrawler(args.base_url, args.concurrency, args.rate, args.retries, checkpoint=checkpoint)
+    stats = asyncio.run(crawler.crawl(args.letters, args.ids))
+    store = get_store()
+    if isinstance(store, MealStore) and os.path.exists(store.snapshot_path):
+        # The inserts left the binary snapshot stale, it is never rewritten by reads
+        store.write_snapshot()
+    print(f"Fetched {stats['meals']} meals with {stats['requests']} requests "
+          f"({stats['not_modified']} not modified, {stats['failures']} failed) in {stats['seconds']}s: {stats['meals_per_second']} meals/sec.")
@@ -0,0 +1,109 @@
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class Vocabulary:
+    """Process-wide table mapping interned strings to small integer codes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(sys.intern(value))
+                    self.codes[self.values[code]] = code
+        return code
+
+    def value(self, code: int) -> str:
+        return self.values[code]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+# Every ingredient name seen by the process, shared by all meals
+INGREDIENTS = Vocabulary()
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
+# Define the structure for Meal class
+class Meal:
+    # Without a __dict__ a meal is a fixed slot array; areas and categories are
+    # interned and ingredients are kept as codes into INGREDIENTS, parsed once
+    __slots__ = (
+        "idMeal",
+        "strMeal",
+        "strCategory",
+        "strArea",
+        "strInstructions",
+        "strMealThumb",
+        "strTags",
+        "strYoutube",
+        "strSource",
+        "ingredient_ids",
+    )
+
+    # Field order of the JSON representation
+    FIELDS = __slots__[:-1] + ("ingredients",)
+
+    def __init__(
+        self,
+        idMeal: str,
+        strMeal: str,
+        strCategory: Optional[str] = None,
+        strArea: Optional[str] = None,
+        strInstructions: Optional[str] = None,
+        strMealThumb: Optional[str] = None,
+        strTags: Optional[str] = None,
+        strYoutube: Optional[str] = None,
+        strSource: Optional[str] = None,
+        ingredients: Optional[str] = None,
+    ):
+        self.idMeal = idMeal
+        self.strMeal = strMeal
+        self.strCategory = _intern(strCategory)
+        self.strArea = _intern(strArea)
+        self.strInstructions = strInstructions
+        self.strMealThumb = strMealThumb
+        self.strTags = strTags
+        self.strYoutube = strYoutube
+        self.strSource = strSource
+        self.ingredients = ingredients
+
+    @property
+    def ingredient_names(self) -> Tuple[str, ...]:
+        if self.ingredient_ids is None:
+            return ()
+        return tuple(INGREDIENTS.value(code) for code in self.ingredient_ids)
+
+    @property
+    def ingredients(self) -> Optional[str]:
+        """The "##"-joined ingredient string of the JSON representation."""
+        if self.ingredient_ids is None:
+            return None
+        return "##".join(self.ingredient_names)
+
+    @ingredients.setter
+    def ingredients(self, ingredients: Optional[str]):
+        if ingredients is None:
+            self.ingredient_ids = None
+        else:
+            self.ingredient_ids = tuple(INGREDIENTS.code(name) for name in ingredients.split("##"))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @staticmethod
+    def from_dict(data):
+        return Meal(**data)
@@ -0,0 +1,76 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Mapping, Sequence
+from data.index import EMPTY, intersect
+
+GRAM_SIZE = 3
+
+
+def grams(text: str) -> set:
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+class _SortedNames(Sequence):
+    """(name, position) in name order, read through `name_order` when indexed."""
+
+    def __init__(self, names: Sequence[str], name_order: Sequence[int]):
+        self.names = names
+        self.name_order = name_order
+
+    def __len__(self) -> int:
+        return len(self.name_order)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        position = self.name_order[i]
+        return (self.names[position], position)
+
+
+class NameIndex:
+    """
+    Trigram index over lowercased recipe names.
+
+    A substring query intersects the posting lists of its trigrams to get the
+    candidate positions, then confirms them with a plain `in` test. A sorted
+    copy of the names answers prefix (autocomplete) lookups with bisect.
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = [name.lower() for name in names]
+        self.trigrams: Dict[str, array] = {}
+        for position, name in enumerate(self.names):
+            for gram in grams(name):
+                self.trigrams.setdefault(gram, array("I")).append(position)
+        self.sorted_names = sorted((name, position) for position, name in enumerate(self.names))
+
+    @classmethod
+    def from_parts(cls, names: Sequence[str], trigrams: Mapping[str, Sequence[int]], name_order: Sequence[int]):
+        """
+        Wrap lowercased names, trigram postings and name order built
+        elsewhere, e.g. mapped from a binary snapshot: none of them is copied.
+        """
+        index = cls.__new__(cls)
+        index.names = names
+        index.trigrams = trigrams
+        index.sorted_names = _SortedNames(names, name_order)
+        return index
+
+    def search(self, query: str) -> List[int]:
+        """Positions of the names containing `query`, in database order."""
+        query = query.lower()
+        if len(query) < GRAM_SIZE:
+            return [position for position, name in enumerate(self.names) if query in name]
+        candidates = intersect([self.trigrams.get(gram, EMPTY) for gram in grams(query)])
+        return [position for position in candidates if query in self.names[position]]
+
+    def prefix(self, prefix: str, limit: int = 10) -> List[int]:
+        """Positions of up to `limit` names starting with `prefix`, alphabetically."""
+        prefix = prefix.lower()
+        results = []
+        start = bisect_left(self.sorted_names, (prefix, -1))
+        for name, position in self.sorted_names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            results.append(position)
+        return results
@@ -0,0 +1,146 @@
+import re
+from array import array
+from bisect import bisect_right
+from typing import List, Optional, Sequence, Tuple
+
+# "STEP 3" headers and "01." / "2)" / "0.\t" numbering in front of a step
+STEP_HEADER = re.compile(r"^\s*step\s*\d+\s*:?\s*$", re.IGNORECASE)
+STEP_NUMBER = re.compile(r"^\s*(?:step\s*)?\d{1,2}\s*[.)]\s*", re.IGNORECASE)
+
+WORD_NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12, "fifteen": 15, "twenty": 20,
+    "thirty": 30, "forty": 40, "forty-five": 45, "sixty": 60, "ninety": 90,
+}
+UNIT_MINUTES = {"sec": 1 / 60, "second": 1 / 60, "min": 1, "minute": 1, "hr": 60, "hour": 60}
+NUMBER = r"(?:\d+(?:[.,]\d+)?|" + "|".join(sorted(WORD_NUMBERS, key=len, reverse=True)) + r")"
+# Units are found first and the quantity is read right before them, so the
+# number patterns are never tried at every position of long instructions
+UNIT = re.compile(r"\b(sec|second|min|minute|hr|hour)s?\b", re.IGNORECASE)
+# "20 mins", "15-20 minutes", "5 to 10 minutes", "1 1/2 hours", "half an hour"
+QUANTITY = re.compile(
+    r"(?<![\w/])(?P<half>half\s+)?(?:(?P<low>" + NUMBER + r")\s*(?:-|–|to|or)\s*)?(?P<high>" + NUMBER + r")"
+    r"(?P<fraction> 1/2| and a half|½)?\s*-?\s*$",
+    re.IGNORECASE,
+)
+OVERNIGHT = re.compile(r"\bovernight\b", re.IGNORECASE)
+OVERNIGHT_MINUTES = 8 * 60
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+# Steps that cook, rest or chill: one without a duration leaves only a lower bound
+COOKING = re.compile(
+    r"\b(?:bake|baking|boil|bring|simmer|roast|fry|fried|frying|grill|broil|cook|cooking|heat|warm|marinate|rest|chill|"
+    r"refrigerate|freeze|rise|prove|steam|poach|braise|stew|toast|brown|sear|microwave|reduce)\b",
+    re.IGNORECASE,
+)
+# Bumped whenever estimate_minutes changes, so stored estimates get recomputed
+ESTIMATE_VERSION = 3
+
+
+def parse_steps(instructions: Optional[str]) -> List[str]:
+    """Split strInstructions into steps, dropping "STEP n" headers and step numbers."""
+    steps = []
+    for line in (instructions or "").splitlines():
+        if STEP_HEADER.match(line):
+            continue
+        line = STEP_NUMBER.sub("", line, count=1).strip()
+        if line:
+            steps.append(line)
+    return steps
+
+
+def _number(text: str) -> float:
+    text = text.lower()
+    return float(WORD_NUMBERS[text]) if text in WORD_NUMBERS else float(text.replace(",", "."))
+
+
+def _durations(text: str):
+    """(phrase, minutes) of the durations of `text`, skipping "up to" limits."""
+    for unit in UNIT.finditer(text):
+        before = text[max(0, unit.start() - 40):unit.start()]
+        quantity = QUANTITY.search(before)
+        if quantity is None or before[:quantity.start()].lower().endswith("up to "):
+            continue
+        value = _number(quantity.group("high"))
+        if quantity.group("fraction"):
+            value += 0.5
+        if quantity.group("half"):
+            value /= 2
+        yield (quantity.group(0) + unit.group(0)).strip(), value * UNIT_MINUTES[unit.group(1).lower()]
+
+
+def parse_durations(text: str) -> List[str]:
+    """The duration phrases of `text`, e.g. ["20 mins", "3-5 minutes", "overnight"]."""
+    return [phrase for phrase, minutes in _durations(text)] + OVERNIGHT.findall(text)
+
+
+def parse_minutes(text: str) -> Optional[int]:
+    """
+    Minutes of all the durations in `text`, the upper bound of ranges, or
+    None without any. A sentence resting overnight counts OVERNIGHT_MINUTES
+    whatever else it says ("marinate overnight or for 24 hours").
+    """
+    minutes, found = 0.0, False
+    for sentence in SENTENCE.split(text):
+        if OVERNIGHT.search(sentence):
+            minutes += OVERNIGHT_MINUTES
+            found = True
+            continue
+        for phrase, value in _durations(sentence):
+            minutes += value
+            found = True
+    return int(round(minutes)) if found else None
+
+
+def timed_steps(instructions: Optional[str]) -> List[dict]:
+    """{"step": n, "durations": [...]} of the steps giving a duration, numbered from 1."""
+    timed = []
+    for number, step in enumerate(parse_steps(instructions), 1):
+        durations = parse_durations(step)
+        if durations:
+            timed.append({"step": number, "durations": durations})
+    return timed
+
+
+def estimate_time(instructions: Optional[str]) -> Tuple[Optional[int], bool]:
+    """
+    (minutes, complete) of a recipe: the sum of the durations of its steps,
+    None without any. Not complete when a step that cooks, rests or chills
+    gives no duration ("grill until golden"), the sum is then only a lower
+    bound; steps without those verbs (chopping, mixing, serving) are taken as
+    quick.
+    """
+    total, complete = None, True
+    for step in parse_steps(instructions):
+        minutes = parse_minutes(step)
+        if minutes is not None:
+            total = (total or 0) + minutes
+        elif COOKING.search(step):
+            complete = False
+    return total, complete and total is not None
+
+
+def estimate_minutes(instructions: Optional[str]) -> Optional[int]:
+    """Estimated total time of a recipe, a lower bound when some cooking step gives no duration."""
+    return estimate_time(instructions)[0]
+
+
+def estimate_complete(instructions: Optional[str]) -> bool:
+    """Whether estimate_minutes is the whole time of the recipe rather than a lower bound."""
+    return estimate_time(instructions)[1]
+
+
+class TimeIndex:
+    """Meal positions sorted by estimated minutes, for "ready in under N minutes" filters."""
+
+    def __init__(self, minutes: Sequence[Optional[int]]):
+        # Meals without any duration take at least 0 minutes
+        timed = sorted((value or 0, position) for position, value in enumerate(minutes))
+        self.minutes = array("I", (value for value, position in timed))
+        self.positions = array("I", (position for value, position in timed))
+
+    def under(self, max_minutes: int) -> array:
+        """
+        Sorted positions of the meals that may be ready in `max_minutes`: the
+        estimates are lower bounds, so untimed meals match too.
+        """
+        return array("I", sorted(self.positions[:bisect_right(self.minutes, max_minutes)]))
@@ -0,0 +1,35 @@
+from typing import Dict, List, Sequence
+from data.procedure import estimate_complete, parse_steps, timed_steps
+
+# Meal fields each recipe information intent sends to the DM and NLG prompts,
+# instead of the whole meal with its instructions, thumbnail, YouTube and
+# source URLs (recommendations only send recipe names)
+INTENT_FIELDS = {
+    "ask_for_ingredients": ("strMeal", "ingredients"),
+    "ask_for_procedure": ("strMeal", "steps", "estimated_minutes", "estimate_complete"),
+    "ask_for_time": ("strMeal", "estimated_minutes", "estimate_complete", "timed_steps"),
+}
+
+# Fields computed from a stored one: name -> (stored field, parser)
+DERIVED_FIELDS = {
+    "steps": ("strInstructions", parse_steps),
+    "timed_steps": ("strInstructions", timed_steps),
+    "estimate_complete": ("strInstructions", estimate_complete),
+}
+
+
+def stored_fields(fields: Sequence[str]) -> List[str]:
+    """The stored fields to read for `fields`, each once."""
+    return list(dict.fromkeys(DERIVED_FIELDS[field][0] if field in DERIVED_FIELDS else field for field in fields))
+
+
+def project(record: Dict[str, object], fields: Sequence[str]) -> Dict[str, object]:
+    """`fields` of a record holding their stored fields, in the requested order."""
+    projected = {}
+    for field in fields:
+        if field in DERIVED_FIELDS:
+            source, parse = DERIVED_FIELDS[field]
+            projected[field] = parse(record[source])
+        else:
+            projected[field] = record[field]
+    return projected
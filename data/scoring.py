@@ -0,0 +1,125 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+from data.config import SCORE_AREA_BOOST, SCORE_CATEGORY_BOOST
+from data.index import MealIndex, normalize_term
+
+
+class Query:
+    """Slot values of one recommendation request."""
+
+    __slots__ = ("nationality", "category", "ingredients", "exclude_ingredients", "max_time")
+
+    def __init__(
+        self,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+        ingredients: Optional[List[str]] = None,
+        exclude_ingredients: Optional[List[str]] = None,
+        max_time: Optional[int] = None,
+    ):
+        self.nationality = nationality
+        self.category = category
+        self.ingredients = ingredients or []
+        self.exclude_ingredients = exclude_ingredients or []
+        self.max_time = max_time
+
+
+class RecipeScorer:
+    """
+    Ranks every recipe against slot queries with sparse matrix products.
+
+    Recipes are the rows of a CSR recipe x ingredient matrix holding the IDF
+    weight of each ingredient, so rare ingredients count more than salt or
+    water. A batch of queries is a sparse ingredient x query matrix: one
+    product gives the matched ingredient weight of every (recipe, query)
+    pair, area and category matches add their boost, and recipes holding an
+    excluded ingredient or estimated to take longer than the query's
+    max_time are masked out. A score is the matched share of the
+    requested weight, 1.0 meaning the recipe satisfies the whole request.
+    """
+
+    def __init__(self, index: MealIndex, minutes: Sequence[Optional[int]], area_boost: float = SCORE_AREA_BOOST, category_boost: float = SCORE_CATEGORY_BOOST):
+        self.size = index.size
+        self.area_boost = area_boost
+        self.category_boost = category_boost
+
+        self.ingredient_ids = {key: column for column, key in enumerate(index.ingredients)}
+        postings = list(index.ingredients.values())
+        rows = np.concatenate([np.asarray(posting, dtype=np.int64) for posting in postings]) if postings else np.zeros(0, dtype=np.int64)
+        frequencies = np.array([len(posting) for posting in postings], dtype=np.float64)
+        columns = np.repeat(np.arange(len(postings)), frequencies.astype(np.int64))
+        self.idf = np.log((1 + self.size) / (1 + frequencies)) + 1
+        # An unknown ingredient cannot match, it weighs like the rarest one
+        self.unknown_weight = float(self.idf.max()) if len(postings) else 1.0
+        self.matrix = sparse.csr_matrix((self.idf[columns], (rows, columns)), shape=(self.size, len(postings)))
+        self.presence = self.matrix.astype(bool).astype(np.float32)
+
+        # Estimates are lower bounds, a meal without durations may take no time
+        self.minutes = np.array([value or 0 for value in minutes], dtype=np.int64)
+
+        self.area_ids, self.area_of = self._labels(index.areas)
+        self.category_ids, self.category_of = self._labels(index.categories)
+
+    def _labels(self, postings: Dict[str, Sequence[int]]) -> Tuple[Dict[str, int], np.ndarray]:
+        ids = {key: label for label, key in enumerate(postings)}
+        labels = np.full(self.size, -1, dtype=np.int32)
+        for key, positions in postings.items():
+            labels[np.asarray(positions, dtype=np.int64)] = ids[key]
+        return ids, labels
+
+    def _ingredient_matrix(self, queries: List[Query], exclude: bool) -> sparse.csc_matrix:
+        rows, columns = [], []
+        for column, query in enumerate(queries):
+            terms = query.exclude_ingredients if exclude else query.ingredients
+            for term in {normalize_term(term) for term in terms}:
+                if term in self.ingredient_ids:
+                    rows.append(self.ingredient_ids[term])
+                    columns.append(column)
+        data = np.ones(len(rows), dtype=np.float32 if exclude else np.float64)
+        return sparse.csc_matrix((data, (rows, columns)), shape=(len(self.ingredient_ids), len(queries)))
+
+    def _requested_weight(self, query: Query) -> float:
+        weight = 0.0
+        for term in {normalize_term(term) for term in query.ingredients}:
+            column = self.ingredient_ids.get(term)
+            weight += self.idf[column] if column is not None else self.unknown_weight
+        if query.nationality:
+            weight += self.area_boost
+        if query.category:
+            weight += self.category_boost
+        return weight
+
+    def score(self, queries: List[Query]) -> np.ndarray:
+        """Scores of every recipe for each query, as a (queries x recipes) array."""
+        scores = np.ascontiguousarray((self.matrix @ self._ingredient_matrix(queries, exclude=False)).toarray().T)
+        # -1 marks a slot left empty, -2 a value no recipe has
+        areas = np.array([self.area_ids.get(normalize_term(query.nationality), -2) if query.nationality else -1 for query in queries])
+        categories = np.array([self.category_ids.get(normalize_term(query.category), -2) if query.category else -1 for query in queries])
+        scores += self.area_boost * ((self.area_of[None, :] == areas[:, None]) & (areas[:, None] != -1))
+        scores += self.category_boost * ((self.category_of[None, :] == categories[:, None]) & (categories[:, None] != -1))
+        weights = np.array([self._requested_weight(query) for query in queries])
+        scores /= np.where(weights > 0, weights, 1.0)[:, None]
+
+        if any(query.exclude_ingredients for query in queries):
+            excluded = np.ascontiguousarray((self.presence @ self._ingredient_matrix(queries, exclude=True)).toarray().T) > 0
+            scores[excluded] = -math.inf
+        for row, query in enumerate(queries):
+            if query.max_time is not None:
+                scores[row, self.minutes > query.max_time] = -math.inf
+        return scores
+
+    def top_k(self, queries: List[Query], k: int) -> List[List[Tuple[int, float]]]:
+        """The k best (position, score) of each query, best first, leaving out recipes scoring 0."""
+        if not queries or not self.size or k <= 0:
+            return [[] for _ in queries]
+        scores = self.score(queries)
+        k = min(k, self.size)
+        results = []
+        for row in scores:
+            # argpartition selects the k best in O(recipes), only those are sorted
+            candidates = np.argpartition(-row, k - 1)[:k] if k < self.size else np.arange(self.size)
+            candidates = candidates[np.lexsort((candidates, -row[candidates]))]
+            results.append([(int(position), float(row[position])) for position in candidates if row[position] > 0])
+        return results
@@ -0,0 +1,111 @@
+import json
+import sys
+import zlib
+from typing import Dict, List, Sequence
+import numpy as np
+from data.files import atomic_write
+from data.index import normalize_term
+from data.meal import Meal
+
+# 16 bands of 4 rows: pairs with a Jaccard similarity of 0.5 share a bucket
+# with probability 1 - (1 - 0.5^4)^16 = 0.64, pairs at 0.2 with 0.025
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+NEIGHBOURS = 10
+# Candidates kept per meal, so very common buckets stay cheap
+MAX_CANDIDATES = 200
+PRIME = (1 << 31) - 1
+
+
+def meal_tokens(meal: Meal) -> List[str]:
+    tokens = {f"ingredient:{normalize_term(name)}" for name in meal.ingredient_names if name}
+    if meal.strArea:
+        tokens.add(f"area:{normalize_term(meal.strArea)}")
+    if meal.strCategory:
+        tokens.add(f"category:{normalize_term(meal.strCategory)}")
+    # A meal without any token only resembles itself
+    return sorted(tokens) or [f"meal:{meal.idMeal}"]
+
+
+def minhash_signatures(token_lists: Sequence[List[str]], seed: int = 0) -> np.ndarray:
+    """(meals x NUM_PERMUTATIONS) MinHash signatures of the token sets."""
+    vocabulary: Dict[str, int] = {}
+    flat, offsets = [], []
+    for tokens in token_lists:
+        offsets.append(len(flat))
+        flat.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+
+    random = np.random.default_rng(seed)
+    a = random.integers(1, PRIME, NUM_PERMUTATIONS, dtype=np.int64)
+    b = random.integers(0, PRIME, NUM_PERMUTATIONS, dtype=np.int64)
+    # crc32 is stable across processes, unlike hash() on strings
+    hashes = np.array([zlib.crc32(token.encode()) for token in vocabulary], dtype=np.int64) % PRIME
+    permuted = (hashes[:, None] * a[None, :] + b[None, :]) % PRIME
+    return np.minimum.reduceat(permuted[np.array(flat, dtype=np.int64)], np.array(offsets, dtype=np.int64), axis=0)
+
+
+def build_neighbours(meals: Sequence[Meal], k: int = NEIGHBOURS, seed: int = 0) -> Dict[str, List[list]]:
+    """
+    {idMeal: [[idMeal, strMeal, similarity], ...]} of the k most similar meals.
+
+    Meals are MinHash signatures of their ingredient, area and category
+    tokens. LSH banding puts meals agreeing on a whole band in one bucket, so
+    only meals sharing a bucket are compared, by the share of equal signature
+    values (an estimate of the Jaccard similarity of the token sets).
+    """
+    if not meals:
+        return {}
+    signatures = minhash_signatures([meal_tokens(meal) for meal in meals], seed)
+    buckets: List[Dict[bytes, List[int]]] = []
+    band_keys = []
+    for band in range(BANDS):
+        rows = np.ascontiguousarray(signatures[:, band * ROWS:(band + 1) * ROWS])
+        keys = [row.tobytes() for row in rows]
+        band_buckets: Dict[bytes, List[int]] = {}
+        for position, key in enumerate(keys):
+            band_buckets.setdefault(key, []).append(position)
+        buckets.append(band_buckets)
+        band_keys.append(keys)
+
+    neighbours = {}
+    everyone = len(meals) <= MAX_CANDIDATES
+    for position, meal in enumerate(meals):
+        if everyone:
+            # Comparing with every meal is cheaper than banding a small catalogue
+            candidates = dict.fromkeys(other for other in range(len(meals)) if other != position)
+        else:
+            candidates = {}
+            for band in range(BANDS):
+                for other in buckets[band][band_keys[band][position]]:
+                    if other != position:
+                        candidates[other] = None
+                if len(candidates) >= MAX_CANDIDATES:
+                    break
+        if not candidates:
+            neighbours[meal.idMeal] = []
+            continue
+        others = np.fromiter(candidates, dtype=np.int64)
+        similarity = (signatures[others] == signatures[position]).mean(axis=1)
+        order = [i for i in np.lexsort((others, -similarity))[:k] if similarity[i] > 0]
+        neighbours[meal.idMeal] = [[meals[others[i]].idMeal, meals[others[i]].strMeal, round(float(similarity[i]), 3)] for i in order]
+    return neighbours
+
+
+def write_neighbours(meals: Sequence[Meal], path: str, k: int = NEIGHBOURS):
+    atomic_write(path, json.dumps({"k": k, "meals": len(meals), "neighbours": build_neighbours(meals, k)}))
+
+
+def read_neighbours(path: str) -> dict:
+    """The saved {"k", "meals", "neighbours"}, "meals" being the number of meals they were built from."""
+    with open(path, "r") as neighbours_file:
+        return json.load(neighbours_file)
+
+
+if __name__ == "__main__":
+    from data.store import get_store
+
+    store = get_store()
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else NEIGHBOURS
+    store.write_neighbours(k)
+    print(f"Wrote the {k} nearest neighbours of {len(store)} meals to {store.neighbours_path}.")
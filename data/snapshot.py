@@ -0,0 +1,327 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Sequence, Tuple
+from data.config import DB_PATH
+from data.files import atomic_write
+from data.fuzzy import FuzzyNameIndex
+from data.index import normalize_term
+from data.meal import Meal
+from data.name_index import grams
+from data.procedure import estimate_minutes
+
+# Layout (little-endian, every section 8-byte aligned):
+#   header   magic, version, meal count, source signature, section count
+#   sections (name, offset, length) table, then the sections themselves:
+#   STRPOOL  utf-8 bytes of every distinct string
+#   STROFFS  uint64 offsets into STRPOOL, string i is pool[off[i]:off[i + 1]]
+#   MEALS    one fixed-width record of MEAL_RECORD uint32 per meal: a string id
+#            per STRING_FIELDS entry (NO_STRING for None), then the offset and
+#            count of its ingredients in MEALINGS
+#   MEALINGS uint32 string ids of the raw ingredient names, per meal
+#   INGVOCAB uint32 string ids of the distinct raw ingredient names
+#   NAMESORT uint32 meal positions ordered by lowercased name
+#   MINUTES  uint32 estimated minutes of every meal, a lower bound (NO_STRING without durations)
+#   K:<kind> per index key (key string id, display string id, offset, count),
+#            ordered by the utf-8 bytes of the key
+#   P:<kind> uint32 sorted meal positions, sliced by the K:<kind> records
+#   K:fkey   the normalized names of the fuzzy name index, P:fkey their positions
+#   K:fdel   the deletes of the fuzzy name index, P:fdel string ids of their names
+#   FUZPARAM uint32 max distance and prefix length of the fuzzy name index
+MAGIC = b"MEALBIN1"
+VERSION = 5
+HEADER = struct.Struct("<8sII4qI")
+SECTION = struct.Struct("<8sQQ")
+NO_STRING = 0xFFFFFFFF
+STRING_FIELDS = Meal.__slots__[:-1]
+MEAL_RECORD = len(STRING_FIELDS) + 2
+INDEX_KINDS = ("area", "cat", "ingr", "tri")
+
+Signature = Tuple[Optional[Tuple[int, int]], ...]
+
+
+def _flatten_signature(signature: Signature) -> Tuple[int, int, int, int]:
+    values = []
+    for stat in signature[:2]:
+        values.extend(stat if stat is not None else (-1, -1))
+    values.extend([-1, -1] * (2 - len(signature)))
+    return tuple(values[:4])
+
+
+class _Strings:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def id(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return string_id
+
+
+def write_snapshot(meals: Sequence[Meal], path: str, source_signature: Signature = ()):
+    """Write the binary snapshot of `meals`, tagged with the signature of the files it was built from."""
+    strings = _Strings()
+    records = array("I")
+    meal_ingredients = array("I")
+    vocabulary: Dict[str, int] = {}
+    postings: Dict[str, Dict[str, Tuple[str, array]]] = {kind: {} for kind in INDEX_KINDS}
+
+    def post(kind, display, position):
+        key = normalize_term(display) if kind != "tri" else display
+        entry = postings[kind].setdefault(key, (display, array("I")))
+        if not entry[1] or entry[1][-1] != position:
+            entry[1].append(position)
+
+    for position, meal in enumerate(meals):
+        records.extend(strings.id(getattr(meal, field)) for field in STRING_FIELDS)
+        names = meal.ingredient_names
+        records.extend((len(meal_ingredients), len(names)))
+        for name in names:
+            meal_ingredients.append(strings.id(name))
+            vocabulary.setdefault(name, strings.id(name))
+            post("ingr", name, position)
+        if meal.strArea:
+            post("area", meal.strArea, position)
+        if meal.strCategory:
+            post("cat", meal.strCategory, position)
+        for gram in sorted(grams(meal.strMeal.lower())):
+            post("tri", gram, position)
+
+    minutes = array("I", (NO_STRING if value is None else value for value in map(estimate_minutes, (meal.strInstructions for meal in meals))))
+    name_order = array("I", sorted(range(len(meals)), key=lambda position: (meals[position].strMeal.lower(), position)))
+
+    sections: List[Tuple[bytes, bytes]] = []
+
+    def add_table(name, entries):
+        # Sorted str keys are also sorted by their utf-8 bytes, which lookups bisect
+        keys, flat = array("I"), array("I")
+        for key, display, values in sorted(entries, key=lambda entry: entry[0]):
+            keys.extend((strings.id(key), strings.id(display), len(flat), len(values)))
+            flat.extend(values)
+        sections.append((f"K:{name}".encode(), keys.tobytes()))
+        sections.append((f"P:{name}".encode(), flat.tobytes()))
+
+    for kind in INDEX_KINDS:
+        add_table(kind, [(key, display, positions) for key, (display, positions) in postings[kind].items()])
+    fuzzy = FuzzyNameIndex([meal.strMeal for meal in meals])
+    add_table("fkey", [(key, key, positions) for key, positions in fuzzy.keys.items()])
+    add_table("fdel", [(delete, delete, [strings.id(key) for key in keys]) for delete, keys in fuzzy.deletes.items()])
+    sections.append((b"FUZPARAM", array("I", (fuzzy.max_distance, fuzzy.prefix_length)).tobytes()))
+
+    encoded = [value.encode("utf-8") for value in strings.values]
+    offsets = array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections = [
+        (b"STRPOOL", b"".join(encoded)),
+        (b"STROFFS", offsets.tobytes()),
+        (b"MEALS", records.tobytes()),
+        (b"MEALINGS", meal_ingredients.tobytes()),
+        (b"INGVOCAB", array("I", vocabulary.values()).tobytes()),
+        (b"NAMESORT", name_order.tobytes()),
+        (b"MINUTES", minutes.tobytes()),
+    ] + sections
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table, body = [], []
+    for name, data in sections:
+        offset += -offset % 8
+        table.append(SECTION.pack(name, offset, len(data)))
+        body.append(data)
+        offset += len(data)
+
+    chunks = [HEADER.pack(MAGIC, VERSION, len(meals), *_flatten_signature(source_signature), len(sections))] + table
+    position = sum(len(chunk) for chunk in chunks)
+    for data in body:
+        padding = -position % 8
+        chunks.append(b"\0" * padding)
+        chunks.append(data)
+        position += padding + len(data)
+    atomic_write(path, b"".join(chunks))
+
+
+class SnapshotTable(Mapping):
+    """
+    Read-only mapping over a K:<name>/P:<name> section pair. Keys are stored
+    in order, so a lookup bisects them and only decodes the keys it probes;
+    iterating decodes them all.
+    """
+
+    def __init__(self, snapshot: "MealSnapshot", name: str, strings: bool = False):
+        self._snapshot = snapshot
+        self._keys = snapshot._sections[f"K:{name}"].cast("I")
+        self._flat = snapshot._sections[f"P:{name}"].cast("I")
+        # Values are string ids to decode instead of meal positions
+        self._strings = strings
+
+    def __len__(self) -> int:
+        return len(self._keys) // 4
+
+    def _find(self, key: str) -> int:
+        target = key.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._snapshot.raw(self._keys[4 * middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self._snapshot.raw(self._keys[4 * low]) == target:
+            return low
+        return -1
+
+    def _values(self, record: int):
+        start, count = self._keys[4 * record + 2], self._keys[4 * record + 3]
+        values = self._flat[start:start + count]
+        return [self._snapshot.string(string_id) for string_id in values] if self._strings else values
+
+    def __getitem__(self, key: str):
+        record = self._find(key) if isinstance(key, str) else -1
+        if record < 0:
+            raise KeyError(key)
+        return self._values(record)
+
+    def __iter__(self):
+        return (self._snapshot.string(self._keys[4 * record]) for record in range(len(self)))
+
+    def items(self):
+        return [(self._snapshot.string(self._keys[4 * record]), self._values(record)) for record in range(len(self))]
+
+    def values(self):
+        return [self._values(record) for record in range(len(self))]
+
+    def displays(self) -> List[str]:
+        return [self._snapshot.string(self._keys[4 * record + 1]) for record in range(len(self))]
+
+
+class SnapshotNames(Sequence):
+    """The strMeal of every meal, lowercased with `lower`, decoded when indexed."""
+
+    def __init__(self, snapshot: "MealSnapshot", lower: bool = False):
+        self._snapshot = snapshot
+        self._lower = lower
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        name = self._snapshot.field(position, "strMeal")
+        return name.lower() if self._lower else name
+
+
+class MealSnapshot:
+    """
+    Read-only, memory-mapped view of a meal_database.bin snapshot.
+
+    Opening only maps the file and reads the header and section table, so it
+    takes the same time whatever the catalogue size; pages are shared by every
+    process mapping the file through the OS page cache. Strings, meals and
+    index keys are decoded on demand from the fixed-width tables, and the
+    posting lists, name index and fuzzy name index are looked up in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, self.size, *signature, section_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} meal snapshot")
+        self.source_signature = tuple(signature)
+        self._sections: Dict[str, memoryview] = {}
+        for i in range(section_count):
+            name, offset, length = SECTION.unpack_from(self._mmap, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b"\0").decode()] = self._view[offset:offset + length]
+        self._pool = self._sections["STRPOOL"]
+        self._offsets = self._sections["STROFFS"].cast("Q")
+        self._records = self._sections["MEALS"].cast("I")
+        self._meal_ingredients = self._sections["MEALINGS"].cast("I")
+
+    def matches(self, source_signature: Signature) -> bool:
+        return self.source_signature == _flatten_signature(source_signature)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def raw(self, string_id: int) -> bytes:
+        return bytes(self._pool[self._offsets[string_id]:self._offsets[string_id + 1]])
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id == NO_STRING:
+            return None
+        return self.raw(string_id).decode("utf-8")
+
+    def field(self, position: int, field: str):
+        """A single field of the meal at `position`, decoded without building the Meal."""
+        if field == "ingredients":
+            # Meals without ingredients are stored with a count of 0
+            return "##".join(self.ingredient_names(position)) or None
+        return self.string(self._records[position * MEAL_RECORD + STRING_FIELDS.index(field)])
+
+    def ingredient_names(self, position: int) -> List[str]:
+        base = position * MEAL_RECORD + len(STRING_FIELDS)
+        start, count = self._records[base], self._records[base + 1]
+        return [self.string(string_id) for string_id in self._meal_ingredients[start:start + count]]
+
+    def meal(self, position: int) -> Meal:
+        base = position * MEAL_RECORD
+        fields = [self.string(self._records[base + i]) for i in range(len(STRING_FIELDS))]
+        return Meal(*fields, ingredients=self.field(position, "ingredients"))
+
+    def meals(self) -> List[Meal]:
+        return [self.meal(position) for position in range(self.size)]
+
+    def names(self, lower: bool = False) -> SnapshotNames:
+        return SnapshotNames(self, lower)
+
+    def ingredients(self) -> List[str]:
+        return [self.string(string_id) for string_id in self._sections["INGVOCAB"].cast("I")]
+
+    def name_order(self) -> memoryview:
+        return self._sections["NAMESORT"].cast("I")
+
+    def minutes(self) -> List[Optional[int]]:
+        return [None if value == NO_STRING else value for value in self._sections["MINUTES"].cast("I")]
+
+    def postings(self, kind: str) -> SnapshotTable:
+        """Index `kind` as {normalized key: sorted meal positions}."""
+        return SnapshotTable(self, kind)
+
+    def values(self, kind: str) -> List[str]:
+        return self.postings(kind).displays()
+
+    def fuzzy(self) -> FuzzyNameIndex:
+        max_distance, prefix_length = self._sections["FUZPARAM"].cast("I")
+        return FuzzyNameIndex.from_parts(SnapshotTable(self, "fkey"), SnapshotTable(self, "fdel", strings=True), max_distance, prefix_length)
+
+
+def open_snapshot(path: str, source_signature: Signature) -> Optional[MealSnapshot]:
+    """The snapshot at `path` if it exists and was built from files with `source_signature`."""
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = MealSnapshot(path)
+    except (ValueError, struct.error) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return None
+    return snapshot if snapshot.matches(source_signature) else None
+
+
+if __name__ == "__main__":
+    from data.store import MealStore
+
+    store = MealStore(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    path = sys.argv[2] if len(sys.argv) > 2 else store.snapshot_path
+    store.write_snapshot(path)
+    print(f"Wrote {len(store)} meals to {path}.")
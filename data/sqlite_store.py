@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+from data.config import DB_PATH, SQLITE_PATH
+from data.index import normalize_term
+from data.meal import Meal
+from data.procedure import ESTIMATE_VERSION, estimate_minutes
+from data.store import BaseMealStore, MealStore
+
+MEAL_FIELDS = ("idMeal", "strMeal", "strCategory", "strArea", "strInstructions", "strMealThumb", "strTags", "strYoutube", "strSource")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meal (
+    position INTEGER PRIMARY KEY,
+    idMeal TEXT NOT NULL UNIQUE,
+    strMeal TEXT NOT NULL,
+    strCategory TEXT,
+    strArea TEXT,
+    strInstructions TEXT,
+    strMealThumb TEXT,
+    strTags TEXT,
+    strYoutube TEXT,
+    strSource TEXT,
+    area_key TEXT,
+    category_key TEXT,
+    estimated_minutes INTEGER
+);
+CREATE INDEX IF NOT EXISTS meal_by_area ON meal(area_key);
+CREATE INDEX IF NOT EXISTS meal_by_category ON meal(category_key);
+CREATE INDEX IF NOT EXISTS meal_by_time ON meal(estimated_minutes);
+
+CREATE TABLE IF NOT EXISTS ingredient (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS meal_ingredient (
+    meal INTEGER NOT NULL REFERENCES meal(position),
+    ordinal INTEGER NOT NULL,
+    ingredient INTEGER NOT NULL REFERENCES ingredient(id),
+    raw TEXT NOT NULL,
+    PRIMARY KEY (meal, ordinal)
+);
+CREATE INDEX IF NOT EXISTS meal_ingredient_by_ingredient ON meal_ingredient(ingredient, meal);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS meal_fts USING fts5(
+    strMeal, strInstructions, content='meal', content_rowid='position', tokenize='trigram'
+);
+"""
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class SqliteMealStore(BaseMealStore):
+    """
+    Meal store backed by a SQLite database.
+
+    Meals and ingredients live in normalized tables indexed by area, category
+    and ingredient, and an FTS5 trigram table over strMeal/strInstructions
+    answers the substring name lookups. Queries only read the matching
+    rows; the full meal list is loaded lazily for the in-memory structures
+    (fuzzy names) that still need it. Each thread gets its own connection and
+    the database runs in WAL mode, so readers never block each other.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH, json_path: Optional[str] = DB_PATH):
+        super().__init__(path)
+        self._local = threading.local()
+        # A missing, empty or foreign database file gets the schema (and the
+        # JSON meals), one from before the latest columns gets upgraded
+        if not self._has_meal_table():
+            self.init()
+            if json_path and (os.path.exists(json_path) or os.path.exists(f"{json_path}.journal")):
+                migrate_json_to_sqlite(json_path, path)
+        else:
+            self._upgrade()
+
+    def _has_meal_table(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meal'").fetchone() is not None
+
+    def _upgrade(self):
+        # Databases created before the estimated_minutes column get it
+        # backfilled, and recomputed when estimate_minutes has changed since
+        with sqlite3.connect(self.path) as connection:
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(meal)")}
+            if "estimated_minutes" not in columns:
+                connection.execute("ALTER TABLE meal ADD COLUMN estimated_minutes INTEGER")
+            if "estimated_minutes" not in columns or connection.execute("PRAGMA user_version").fetchone()[0] < ESTIMATE_VERSION:
+                connection.executemany(
+                    "UPDATE meal SET estimated_minutes = ? WHERE position = ?",
+                    [(estimate_minutes(instructions), position) for position, instructions in connection.execute("SELECT position, strInstructions FROM meal")],
+                )
+                connection.execute(f"PRAGMA user_version = {ESTIMATE_VERSION}")
+            connection.executescript(SCHEMA)
+
+    def _file_signature(self) -> Tuple:
+        return (self._stat(self.path), self._stat(f"{self.path}-wal"))
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def _query(self, sql: str, parameters=()) -> List[tuple]:
+        return self.connection().execute(sql, parameters).fetchall()
+
+    def _meals_at(self, where: str, parameters=()) -> List[Meal]:
+        rows = self._query(f"SELECT position, {', '.join(MEAL_FIELDS)} FROM meal {where} ORDER BY position", parameters)
+        if not rows:
+            return []
+        positions = [row[0] for row in rows]
+        ingredients = {position: [] for position in positions}
+        for start in range(0, len(positions), 500):
+            chunk = positions[start:start + 500]
+            for meal, raw in self._query(
+                f"SELECT meal, raw FROM meal_ingredient WHERE meal IN ({', '.join('?' * len(chunk))}) ORDER BY meal, ordinal",
+                chunk,
+            ):
+                ingredients[meal].append(raw)
+        return [
+            Meal(*row[1:], ingredients="##".join(ingredients[row[0]]))
+            for row in rows
+        ]
+
+    def _read_meals(self) -> List[Meal]:
+        return self._meals_at("")
+
+    def init(self):
+        with sqlite3.connect(self.path) as connection:
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version = {ESTIMATE_VERSION}")
+
+    def insert(self, meals: List[Meal]):
+        connection = self.connection()
+        with connection:
+            position = connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM meal").fetchone()[0]
+            for meal in meals:
+                if connection.execute("SELECT 1 FROM meal WHERE idMeal = ?", (meal.idMeal,)).fetchone():
+                    continue
+                connection.execute(
+                    f"INSERT INTO meal (position, {', '.join(MEAL_FIELDS)}, area_key, category_key, estimated_minutes) VALUES ({', '.join('?' * (len(MEAL_FIELDS) + 4))})",
+                    (
+                        position,
+                        *(getattr(meal, field) for field in MEAL_FIELDS),
+                        normalize_term(meal.strArea) if meal.strArea else None,
+                        normalize_term(meal.strCategory) if meal.strCategory else None,
+                        estimate_minutes(meal.strInstructions),
+                    ),
+                )
+                connection.execute(
+                    "INSERT INTO meal_fts (rowid, strMeal, strInstructions) VALUES (?, ?, ?)",
+                    (position, meal.strMeal, meal.strInstructions),
+                )
+                for ordinal, raw in enumerate(meal.ingredient_names):
+                    connection.execute("INSERT OR IGNORE INTO ingredient (name) VALUES (?)", (normalize_term(raw),))
+                    connection.execute(
+                        "INSERT INTO meal_ingredient (meal, ordinal, ingredient, raw) "
+                        "SELECT ?, ?, id, ? FROM ingredient WHERE name = ?",
+                        (position, ordinal, raw, normalize_term(raw)),
+                    )
+                position += 1
+        self.invalidate()
+
+    # Query methods answered by SQLite
+    def recipe_names(self) -> List[str]:
+        return [name for name, in self._query("SELECT strMeal FROM meal ORDER BY position")]
+
+    def ingredients(self) -> List[str]:
+        return [raw for raw, in self._query("SELECT DISTINCT raw FROM meal_ingredient")]
+
+    def areas(self) -> List[str]:
+        return [area for area, in self._query("SELECT DISTINCT strArea FROM meal WHERE strArea IS NOT NULL AND strArea != ''")]
+
+    def categories(self) -> List[str]:
+        return [category for category, in self._query("SELECT DISTINCT strCategory FROM meal WHERE strCategory IS NOT NULL AND strCategory != ''")]
+
+    def estimated_minutes(self) -> List[Optional[int]]:
+        return [minutes for minutes, in self._query("SELECT estimated_minutes FROM meal ORDER BY position")]
+
+    def find_by_name(self, name: str) -> List[Meal]:
+        # The trigram tokenizer serves LIKE patterns of 3+ characters from the index
+        return self._meals_at(
+            "WHERE position IN (SELECT rowid FROM meal_fts WHERE strMeal LIKE ? ESCAPE '\\')",
+            (f"%{_escape_like(name)}%",),
+        )
+
+    def find_positions(self, name: str) -> List[int]:
+        rows = self._query(
+            "SELECT rowid FROM meal_fts WHERE strMeal LIKE ? ESCAPE '\\' ORDER BY rowid",
+            (f"%{_escape_like(name)}%",),
+        )
+        return [position for position, in rows]
+
+    def read_fields(self, positions: List[int], fields: List[str]) -> List[Dict[str, object]]:
+        # Only the requested columns are read, the ingredients only when asked for
+        columns = [field for field in fields if field != "ingredients"]
+        unknown = set(columns) - set(MEAL_FIELDS) - {"estimated_minutes"}
+        if unknown:
+            raise ValueError(f"Unknown meal fields: {sorted(unknown)}")
+        records = {position: {} for position in positions}
+        for start in range(0, len(positions), 500):
+            chunk = positions[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            if columns:
+                for row in self._query(f"SELECT position, {', '.join(columns)} FROM meal WHERE position IN ({placeholders})", chunk):
+                    records[row[0]].update(zip(columns, row[1:]))
+            if "ingredients" in fields:
+                ingredients = {position: [] for position in chunk}
+                for meal, raw in self._query(
+                    f"SELECT meal, raw FROM meal_ingredient WHERE meal IN ({placeholders}) ORDER BY meal, ordinal",
+                    chunk,
+                ):
+                    ingredients[meal].append(raw)
+                for position in chunk:
+                    records[position]["ingredients"] = "##".join(ingredients[position])
+        return [{field: records[position][field] for field in fields} for position in positions]
+
+    def names_by_prefix(self, prefix: str, limit: int = 10) -> List[str]:
+        rows = self._query(
+            "SELECT strMeal FROM meal WHERE strMeal LIKE ? ESCAPE '\\' ORDER BY lower(strMeal) LIMIT ?",
+            (f"{_escape_like(prefix)}%", limit),
+        )
+        return [name for name, in rows]
+
+    def by_category(self, category: str) -> List[Meal]:
+        return self._meals_at("WHERE strCategory = ?", (category,))
+
+    def filter(
+        self,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+        ingredients: Optional[List[str]] = None,
+        exclude_ingredients: Optional[List[str]] = None,
+        max_time: Optional[int] = None,
+    ) -> List[Meal]:
+        conditions, parameters = [], []
+        if max_time is not None:
+            # The estimates are lower bounds, untimed meals may fit too
+            conditions.append("(estimated_minutes IS NULL OR estimated_minutes <= ?)")
+            parameters.append(max_time)
+        if nationality is not None:
+            conditions.append("area_key = ?")
+            parameters.append(normalize_term(nationality))
+        if category is not None:
+            conditions.append("category_key = ?")
+            parameters.append(normalize_term(category))
+        with_ingredient = "position {} (SELECT mi.meal FROM meal_ingredient mi JOIN ingredient i ON i.id = mi.ingredient WHERE i.name = ?)"
+        for ingredient in ingredients or []:
+            conditions.append(with_ingredient.format("IN"))
+            parameters.append(normalize_term(ingredient))
+        for ingredient in exclude_ingredients or []:
+            conditions.append(with_ingredient.format("NOT IN"))
+            parameters.append(normalize_term(ingredient))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._meals_at(where, parameters)
+
+
+def migrate_json_to_sqlite(json_path: str = DB_PATH, sqlite_path: str = SQLITE_PATH):
+    """One-shot copy of the JSON meal database into the SQLite backend."""
+    # Read through MealStore, so meals still in the journal are copied too
+    meals = MealStore(json_path).meals
+    store = SqliteMealStore(sqlite_path, json_path=None)
+    store.insert(meals)
+    return len(meals)
+
+
+if __name__ == "__main__":
+    json_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    sqlite_path = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    count = migrate_json_to_sqlite(json_path, sqlite_path)
+    print(f"Migrated {count} meals from {json_path} to {sqlite_path}.")
@@ -0,0 +1,580 @@
+import os
+import json
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from data.config import DB_BACKEND, DB_PATH, JOURNAL_COMPACT_MIN_RECORDS
+from data.facets import FacetIndex
+from data.files import atomic_write
+from data.fuzzy import FuzzyNameIndex
+from data.index import MealIndex, contains, normalize_term
+from data.meal import Meal
+from data.name_index import NameIndex
+from data.procedure import TimeIndex, estimate_minutes
+from data.snapshot import MealSnapshot, open_snapshot, write_snapshot
+
+
+class BaseMealStore:
+    """
+    Resident, process-wide view of a meal database backend.
+
+    Every access stats the backing files and drops the cached meals when their
+    mtime or size changed, so external writers are still picked up. Meals are
+    read lazily, and structures derived from them (vocabularies, indexes) are
+    built on first use and dropped together with the meals.
+
+    The query methods are answered from the in-memory indexes; backends with
+    their own query engine override them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Precomputed "more like this" lists, see data/similarity.py
+        self.neighbours_path = os.path.splitext(path)[0] + ".neighbours.json"
+        self._lock = threading.RLock()
+        self._signature: Optional[Tuple] = None
+        self._checked = False
+        self._meals: Optional[List[Meal]] = None
+        self._by_id: Dict[str, Meal] = {}
+        self._derived: Dict[str, object] = {}
+
+    def _stat(self, path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _file_signature(self) -> Tuple:
+        return (self._stat(self.path),)
+
+    def _read_meals(self) -> List[Meal]:
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def _ensure_fresh(self):
+        signature = self._file_signature()
+        if self._checked and signature == self._signature:
+            return
+        with self._lock:
+            if self._checked and signature == self._signature:
+                return
+            self._meals = None
+            self._by_id = {}
+            self._derived = {}
+            self._signature = signature
+            self._checked = True
+
+    def _load_meals(self) -> List[Meal]:
+        with self._lock:
+            if self._meals is None:
+                self._meals = self._read_meals()
+                self._by_id = {meal.idMeal: meal for meal in self._meals}
+            return self._meals
+
+    def invalidate(self):
+        """Force a reload on the next access."""
+        with self._lock:
+            self._checked = False
+
+    @property
+    def meals(self) -> List[Meal]:
+        self._ensure_fresh()
+        return self._load_meals()
+
+    def get(self, id_meal: str) -> Optional[Meal]:
+        self._ensure_fresh()
+        self._load_meals()
+        return self._by_id.get(id_meal)
+
+    def __contains__(self, id_meal: str) -> bool:
+        return self.get(id_meal) is not None
+
+    def __len__(self) -> int:
+        return len(self.meals)
+
+    def cached(self, key: str, build: Callable[[], object]):
+        """Return the value cached under `key` for the current generation of the files, building it on first use."""
+        self._ensure_fresh()
+        with self._lock:
+            # The cache is read and filled under the lock so a concurrent reload
+            # can never pair a new generation with values built from the old one
+            cache = self._derived
+            if key not in cache:
+                cache[key] = build()
+            return cache[key]
+
+    def derived(self, key: str, build: Callable[[List[Meal]], object]):
+        """Return the structure cached under `key`, building it from the meals on first use."""
+        return self.cached(key, lambda: build(self._load_meals()))
+
+    def _meal_at(self, position: int) -> Meal:
+        return self._meals_by_position([position])[0]
+
+    def _meals_by_position(self, positions) -> List[Meal]:
+        """The meals at `positions`, the files are checked once for the whole query."""
+        meals = self.meals
+        return [meals[position] for position in positions]
+
+    def init(self):
+        """Create an empty database if there is none."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    def insert(self, meals: List[Meal]):
+        """Add the meals whose idMeal is not stored yet."""
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    # Query methods
+    def _index(self) -> MealIndex:
+        return self.derived("index", MealIndex)
+
+    def _names(self) -> NameIndex:
+        return self.derived("names", lambda meals: NameIndex([meal.strMeal for meal in meals]))
+
+    def _fuzzy(self) -> FuzzyNameIndex:
+        return self.cached("fuzzy_names", lambda: FuzzyNameIndex(self.recipe_names()))
+
+    def facets(self) -> FacetIndex:
+        return self.cached("facets", lambda: FacetIndex(self._index(), {
+            "nationality": self.areas(),
+            "category": self.categories(),
+            "ingredients": self.ingredients(),
+        }))
+
+    def scorer(self):
+        # numpy/scipy are only needed once ranked recommendations are asked for
+        from data.scoring import RecipeScorer
+        return self.cached("scorer", lambda: RecipeScorer(self._index(), self.estimated_minutes()))
+
+    def rank(self, queries: list, k: int) -> List[List[Tuple[Meal, float]]]:
+        """The k best scoring meals for each query of the batch."""
+        results = []
+        for top in self.scorer().top_k(queries, k):
+            meals = self._meals_by_position([position for position, score in top])
+            results.append([(meal, score) for meal, (position, score) in zip(meals, top)])
+        return results
+
+    def neighbours(self) -> Dict[str, list]:
+        from data.similarity import build_neighbours, read_neighbours
+
+        def build():
+            if not os.path.exists(self.neighbours_path):
+                # Nothing precomputed: build the lists once for this process
+                return build_neighbours(self.meals)
+            saved = read_neighbours(self.neighbours_path)
+            if saved["meals"] == len(self):
+                return saved["neighbours"]
+            # Written before later inserts, which the lists would miss
+            return build_neighbours(self.meals, saved["k"])
+
+        return self.cached("neighbours", build)
+
+    def write_neighbours(self, k: int):
+        from data.similarity import write_neighbours
+        write_neighbours(self.meals, self.neighbours_path, k)
+        with self._lock:
+            self._derived.pop("neighbours", None)
+
+    def similar(self, name: str, k: int) -> List[Tuple[str, float]]:
+        """(recipe name, similarity) of the meals most similar to the recipe closest to `name`."""
+        position = self._name_positions().get(name.strip().lower())
+        if position is not None:
+            meal = self._meal_at(position)
+        else:
+            matches = self.resolve_name(name, 1)
+            if not matches:
+                return []
+            meal = matches[0][0]
+        return [(neighbour, similarity) for id_meal, neighbour, similarity in self.neighbours().get(meal.idMeal, [])[:k]]
+
+    def _name_positions(self) -> Dict[str, int]:
+        # First meal of every lowercased name
+        return self.cached("name_positions", lambda: {name.lower(): position for position, name in reversed(list(enumerate(self.recipe_names())))})
+
+    def cooccurrence(self):
+        from data.cooccurrence import CooccurrenceStats
+        facets = self.facets()
+        return self.cached("cooccurrence", lambda: CooccurrenceStats(facets.keys_by_meal("ingredients"), facets.displays["ingredients"]))
+
+    def refining_ingredients(self, slots: Dict[str, object], k: int) -> List[Tuple[str, int]]:
+        """(ingredient, recipes) that best split the recipes matching `slots`."""
+        from data.cooccurrence import best_splits
+        ingredients = list(dict.fromkeys(normalize_term(ingredient) for ingredient in slots.get("ingredients") or []))
+        if slots.get("nationality") or slots.get("category") or len(ingredients) > 1:
+            # Several filters: count the ingredients of the matching recipes
+            total = len(self._index().match(slots.get("nationality"), slots.get("category"), ingredients))
+            return best_splits(self.facets().conditional_counts("ingredients", slots), total, k)
+        stats = self.cooccurrence()
+        if ingredients:
+            return best_splits(stats.cooccurring(ingredients[0]), stats.count(ingredients[0]), k)
+        return best_splits(stats.totals(), stats.meals, k)
+
+    def estimated_minutes(self) -> List[Optional[int]]:
+        """Estimated cooking time of every meal, by position, a lower bound when some cooking step gives no duration, None without durations."""
+        return self.derived("minutes", lambda meals: [estimate_minutes(meal.strInstructions) for meal in meals])
+
+    def _time_index(self) -> TimeIndex:
+        return self.cached("time_index", lambda: TimeIndex(self.estimated_minutes()))
+
+    def recipe_names(self) -> List[str]:
+        return self.derived("recipe_names", lambda meals: [meal.strMeal for meal in meals])
+
+    def ingredients(self) -> List[str]:
+        def distinct_ingredients(meals):
+            ingredients = set()
+            for meal in meals:
+                ingredients.update(meal.ingredient_names)
+            return list(ingredients)
+        return self.derived("ingredients", distinct_ingredients)
+
+    def areas(self) -> List[str]:
+        return self.derived("areas", lambda meals: list(set(meal.strArea for meal in meals if meal.strArea)))
+
+    def categories(self) -> List[str]:
+        return self.derived("categories", lambda meals: list(set(meal.strCategory for meal in meals if meal.strCategory)))
+
+    def find_by_name(self, name: str) -> List[Meal]:
+        return self._meals_by_position(self.find_positions(name))
+
+    def find_positions(self, name: str) -> List[int]:
+        """Positions of the meals whose name contains `name`."""
+        return list(self._names().search(name))
+
+    def read_fields(self, positions: List[int], fields: List[str]) -> List[Dict[str, object]]:
+        """The stored `fields` of the meals at `positions`, without building the other ones."""
+        meals = self._meals_by_position(positions)
+        minutes = self.estimated_minutes() if "estimated_minutes" in fields else None
+        return [
+            {field: minutes[position] if field == "estimated_minutes" else getattr(meal, field) for field in fields}
+            for position, meal in zip(positions, meals)
+        ]
+
+    def names_by_prefix(self, prefix: str, limit: int = 10) -> List[str]:
+        names = self.recipe_names()
+        return [names[meal_id] for meal_id in self._names().prefix(prefix, limit)]
+
+    def resolve_name(self, name: str, limit: int = 5) -> List[Tuple[Meal, float]]:
+        matches = self.resolve_positions(name, limit)
+        return list(zip(self._meals_by_position([meal_id for meal_id, score in matches]), [score for meal_id, score in matches]))
+
+    def resolve_positions(self, name: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """(position, score) of the closest recipe names, best first."""
+        return self._fuzzy().lookup(name, limit)
+
+    def by_category(self, category: str) -> List[Meal]:
+        return [meal for meal in self.meals if meal.strCategory == category]
+
+    def filter(
+        self,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+        ingredients: Optional[List[str]] = None,
+        exclude_ingredients: Optional[List[str]] = None,
+        max_time: Optional[int] = None,
+    ) -> List[Meal]:
+        positions = self._index().match(nationality, category, ingredients, exclude_ingredients)
+        if max_time is not None:
+            quick = self._time_index().under(max_time)
+            positions = [meal_id for meal_id in positions if contains(quick, meal_id)]
+        return self._meals_by_position(positions)
+
+    def pantry(
+        self,
+        ingredients: List[str],
+        max_missing: int = 0,
+        nationality: Optional[str] = None,
+        category: Optional[str] = None,
+        max_time: Optional[int] = None,
+    ) -> List[Tuple[Meal, int]]:
+        """Meals cookable with `ingredients` plus at most `max_missing` others, fewest missing first."""
+        matches = self._index().pantry(ingredients, max_missing, nationality, category)
+        if max_time is not None:
+            quick = self._time_index().under(max_time)
+            matches = [(meal_id, missing) for meal_id, missing in matches if contains(quick, meal_id)]
+        return list(zip(self._meals_by_position([meal_id for meal_id, missing in matches]), [missing for meal_id, missing in matches]))
+
+
+class MealStore(BaseMealStore):
+    """
+    Meal store backed by the JSON database file.
+
+    Inserts are appended to a JSONL journal of meal upserts next to the
+    snapshot instead of rewriting it. Reading replays the journal over the
+    snapshot, the last record for an idMeal winning. Once the journal holds
+    more records than the snapshot it is compacted: the merged meals are
+    written to a temporary file that atomically replaces the snapshot, so
+    ingestion stays linear overall. Duplicate idMeals are skipped through an
+    append-only id index file, kept in memory between inserts.
+
+    When a binary snapshot (data/snapshot.py) built from the current snapshot
+    and journal sits next to the file, vocabularies and indexes are mapped
+    from it and meals are decoded one at a time, instead of parsing the JSON.
+    Inserts leave it stale until the next compaction or write_snapshot(),
+    which rewrite it; reads never do.
+    """
+
+    def __init__(self, path: str = DB_PATH, compact_min_records: int = JOURNAL_COMPACT_MIN_RECORDS, snapshot_path: Optional[str] = None):
+        super().__init__(path)
+        self.snapshot_path = snapshot_path or os.path.splitext(path)[0] + ".bin"
+        self.journal_path = f"{path}.journal"
+        self.ids_path = f"{path}.ids"
+        self.compact_min_records = compact_min_records
+        self._write_lock = threading.Lock()
+        self._ids: Optional[set] = None
+        self._ids_signature = None
+        self._counts_signature = None
+        self._snapshot_records = 0
+        self._journal_records = 0
+
+    def _file_signature(self) -> Tuple:
+        return (self._stat(self.path), self._stat(self.journal_path))
+
+    def _read_snapshot(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as db_file:
+            return json.load(db_file)
+
+    def _read_journal(self) -> List[dict]:
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, "r") as journal:
+            for line in journal:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted append
+                    print(f"Skipping corrupt journal record in {self.journal_path}")
+        return records
+
+    def _merged_records(self) -> List[dict]:
+        self._counts_signature = self._file_signature()
+        snapshot = self._read_snapshot()
+        journal = self._read_journal()
+        self._snapshot_records, self._journal_records = len(snapshot), len(journal)
+        if not journal:
+            return snapshot
+        positions = {record["idMeal"]: position for position, record in enumerate(snapshot)}
+        for record in journal:
+            if record["idMeal"] in positions:
+                snapshot[positions[record["idMeal"]]] = record
+            else:
+                positions[record["idMeal"]] = len(snapshot)
+                snapshot.append(record)
+        return snapshot
+
+    def _read_meals(self) -> List[Meal]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.meals()
+        return [Meal.from_dict(meal) for meal in self._merged_records()]
+
+    def _snapshot(self) -> Optional[MealSnapshot]:
+        return self.cached("snapshot", lambda: open_snapshot(self.snapshot_path, self._signature))
+
+    def write_snapshot(self, path: Optional[str] = None):
+        """Write the binary snapshot of the current meals."""
+        self._ensure_fresh()
+        with self._lock:
+            meals, signature = self._load_meals(), self._signature
+        write_snapshot(meals, path or self.snapshot_path, signature)
+        if path is None or path == self.snapshot_path:
+            with self._lock:
+                # Checked before the write, the cached lookup holds None or the old file
+                self._derived.pop("snapshot", None)
+
+    def _meals_by_position(self, positions) -> List[Meal]:
+        snapshot = self._snapshot()
+        if snapshot is not None and self._meals is None:
+            return [snapshot.meal(position) for position in positions]
+        # Checked just above, the resident meals are indexed directly
+        meals = self._load_meals()
+        return [meals[position] for position in positions]
+
+    def read_fields(self, positions: List[int], fields: List[str]) -> List[Dict[str, object]]:
+        snapshot = self._snapshot()
+        if snapshot is None or self._meals is not None:
+            return super().read_fields(positions, fields)
+        # Only the requested strings are decoded from the mapped file
+        minutes = self.estimated_minutes() if "estimated_minutes" in fields else None
+        return [
+            {field: minutes[position] if field == "estimated_minutes" else snapshot.field(position, field) for field in fields}
+            for position in positions
+        ]
+
+    def __len__(self) -> int:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return len(snapshot)
+        return super().__len__()
+
+    def recipe_names(self) -> List[str]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            # Decoded one name at a time, when indexed
+            return self.cached("recipe_names", snapshot.names)
+        return super().recipe_names()
+
+    def ingredients(self) -> List[str]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return self.cached("ingredients", snapshot.ingredients)
+        return super().ingredients()
+
+    def areas(self) -> List[str]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return self.cached("areas", lambda: snapshot.values("area"))
+        return super().areas()
+
+    def categories(self) -> List[str]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return self.cached("categories", lambda: snapshot.values("cat"))
+        return super().categories()
+
+    def estimated_minutes(self) -> List[Optional[int]]:
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return self.cached("minutes", snapshot.minutes)
+        return super().estimated_minutes()
+
+    def _index(self) -> MealIndex:
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return super()._index()
+        # Posting lists are looked up in the mapped file, never copied
+        return self.cached("index", lambda: MealIndex.from_postings(len(snapshot), snapshot.postings("area"), snapshot.postings("cat"), snapshot.postings("ingr")))
+
+    def _names(self) -> NameIndex:
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return super()._names()
+        return self.cached("names", lambda: NameIndex.from_parts(snapshot.names(lower=True), snapshot.postings("tri"), snapshot.name_order()))
+
+    def _fuzzy(self) -> FuzzyNameIndex:
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return super()._fuzzy()
+        return self.cached("fuzzy_names", snapshot.fuzzy)
+
+    def init(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "w") as db_file:
+                json.dump([], db_file)
+
+    def _load_ids(self) -> set:
+        signature = self._stat(self.ids_path)
+        if self._ids is not None and signature == self._ids_signature:
+            return self._ids
+        if signature is None:
+            # First insert on this database: build the id index from the data
+            self._rewrite_ids([record["idMeal"] for record in self._merged_records()])
+        else:
+            with open(self.ids_path, "r") as ids_file:
+                self._ids = {line.strip() for line in ids_file if line.strip()}
+            self._ids_signature = signature
+        return self._ids
+
+    def _rewrite_ids(self, ids: List[str]):
+        atomic_write(self.ids_path, "".join(f"{id_meal}\n" for id_meal in ids))
+        self._ids = set(ids)
+        self._ids_signature = self._stat(self.ids_path)
+
+    def insert(self, meals: List[Meal]):
+        with self._write_lock:
+            ids = self._load_ids()
+            new_meals = []
+            for meal in meals:
+                if meal.idMeal not in ids:
+                    ids.add(meal.idMeal)
+                    new_meals.append(meal)
+            if not new_meals:
+                return
+
+            if self._counts_signature != self._file_signature():
+                self._merged_records()
+            before = self._file_signature()
+            with open(self.journal_path, "a") as journal:
+                journal.write("".join(json.dumps(meal.to_dict()) + "\n" for meal in new_meals))
+                journal.flush()
+                os.fsync(journal.fileno())
+            with open(self.ids_path, "a") as ids_file:
+                ids_file.write("".join(f"{meal.idMeal}\n" for meal in new_meals))
+            self._ids_signature = self._stat(self.ids_path)
+            self._journal_records += len(new_meals)
+            self._counts_signature = self._file_signature()
+
+            if self._journal_records > max(self.compact_min_records, self._snapshot_records):
+                self.compact()
+            else:
+                self._apply(new_meals, before)
+
+    def _apply(self, meals: List[Meal], before: Tuple):
+        # Keep the resident meals in step with our own append instead of
+        # re-reading snapshot and journal
+        with self._lock:
+            if self._checked and self._meals is not None and self._signature == before:
+                self._meals = self._meals + meals
+                self._by_id.update((meal.idMeal, meal) for meal in meals)
+                cooccurrence, minutes = self._derived.get("cooccurrence"), self._derived.get("minutes")
+                self._derived = {}
+                # Co-occurrence counts are additive and estimated times per
+                # meal, both take the new meals in instead of being rebuilt
+                if cooccurrence is not None:
+                    cooccurrence.add_meals(meals)
+                    self._derived["cooccurrence"] = cooccurrence
+                if minutes is not None:
+                    self._derived["minutes"] = minutes + [estimate_minutes(meal.strInstructions) for meal in meals]
+                self._signature = self._file_signature()
+            else:
+                self._checked = False
+
+    def compact(self):
+        """Merge the journal into the snapshot and truncate it."""
+        records = self._merged_records()
+        atomic_write(self.path, json.dumps(records, indent=4))
+        # Replaying the old journal over the new snapshot is idempotent, so a
+        # crash before the journal is cleared leaves a consistent database
+        atomic_write(self.journal_path, "")
+        self._rewrite_ids([record["idMeal"] for record in records])
+        self._snapshot_records, self._journal_records = len(records), 0
+        self._counts_signature = self._file_signature()
+        self.invalidate()
+        if os.path.exists(self.snapshot_path):
+            # Keep an existing binary snapshot usable after the compaction
+            self.write_snapshot()
+
+
+BACKENDS = ("json", "sqlite")
+
+_store: Optional[BaseMealStore] = None
+_backend = DB_BACKEND
+_store_lock = threading.Lock()
+
+
+def set_backend(backend: str):
+    """Select the storage backend used by get_store()."""
+    global _store, _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend: {backend}")
+    with _store_lock:
+        if backend != _backend:
+            _store = None
+        _backend = backend
+
+
+def get_store() -> BaseMealStore:
+    """Return the process-wide meal store for the selected backend."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if _backend == "sqlite":
+                    from data.sqlite_store import SqliteMealStore
+                    _store = SqliteMealStore()
+                else:
+                    _store = MealStore()
+    return _store
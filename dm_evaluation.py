@@ -1,10 +1,10 @@
 
 import json
 import random
-from data.database import get_all_areas, get_all_categories, get_all_ingredients, get_all_recipe_names
+from data.database import get_all_areas, get_all_categories, get_all_ingredients, get_all_recipe_names, rank_recipes_batch
 from pipeline import generate_dm_input, generate_dm_output, get_args
 from recipe_state_tracker import RecipeStateTracker
-from utils import load_model
+from utils import load_model, variant_suffix
 from sklearn.metrics import precision_recall_fscore_support
 import time
 
@@ -26,38 +26,47 @@ def compute_metrics(ground_truth_list, prediction_list):
 if __name__ == "__main__":
 
     args = get_args()
-    model, tokenizer = load_model(args)
+    suffix = variant_suffix(args)
+    model, tokenizer = (None, None) if args.no_model else load_model(args)
     start_time = time.time()
     test_data = []
     predictions = []
     deterministic = False
     one_prompt = True
 
-    for intent in ["recipe_recommendation","ask_for_ingredients", "ask_for_procedure", "ask_for_time"]:
+    # Vocabularies are read once, not at every iteration
+    all_category = get_all_categories()
+    all_nationality = get_all_areas()
+    all_ingredients = get_all_ingredients()
+    all_recipes = get_all_recipe_names()
+
+    # With --no-model the metrics are computed on the outputs saved by the last run
+    if args.no_model:
+        with open(f"data/test_data{suffix}.json", "r") as f:
+            test_data = json.load(f)
+        predictions = [(data["dm_output"]["action_required"], data["actions"]) for data in test_data]
+
+    for intent in [] if args.no_model else ["recipe_recommendation","ask_for_ingredients", "ask_for_procedure", "ask_for_time"]:
         for _ in range(20):
             state_tracker = RecipeStateTracker()
 
             if intent == "recipe_recommendation":
-                all_category = get_all_categories()
-                all_nationality = get_all_areas()
-                all_ingredients = get_all_ingredients()
                 num_filters = random.choices([1, 2, 3], weights=[0.6, 0.2, 0.2], k=1)[0]
                 filters = ["category", "ingredients", "nationality"]
                 selected_filters = random.sample(filters, num_filters)
 
                 category = random.choice(all_category) if "category" in selected_filters else None
                 ingredients = [random.choice(all_ingredients) for _ in range(random.choice(range(1, 3)))] if "ingredients" in selected_filters else None
-                all_nationality = random.choice(all_nationality) if "nationality" in selected_filters else None
+                nationality = random.choice(all_nationality) if "nationality" in selected_filters else None
                 nlu = {
                     "intent": "recipe_recommendation",
                     "slots": {
                         "category": category,
                         "ingredients": ingredients,
-                        "nationality": all_nationality,
+                        "nationality": nationality,
                     }
                 }
             else:
-                all_recipes = get_all_recipe_names()
                 recipe = random.choice(all_recipes) if random.random() > 0.2 else None
                 nlu = {
                     "intent": intent,
@@ -119,7 +128,12 @@ if __name__ == "__main__":
             test_data.append(data)
             predictions.append((dm_output["action_required"], actions))
 
-    with open("data/test_data.json", "w") as f:
+    # Closest recipes of the requests nothing matched, all ranked with one matrix product
+    unmatched = [data for data in test_data if data["nlu"]["intent"] == "recipe_recommendation" and "no_recipe_found" in data["actions"]]
+    for data, closest in zip(unmatched, rank_recipes_batch([data["nlu"]["slots"] for data in unmatched])):
+        data["closest_recipes"] = [name for name, score in closest]
+
+    with open(f"data/test_data{suffix}.json", "w") as f:
         json.dump(test_data, f, indent=4)
 
     results = [compute_metrics(gt, pred) for gt, pred in predictions]
@@ -135,9 +149,12 @@ if __name__ == "__main__":
         "f1": f1_avg
     }
 
-    with open("data/dm_metrics.json", "w") as f:
+    with open(f"data/dm_metrics{suffix}.json", "w") as f:
         json.dump(metrics, f, indent=4)
 
     end_time = time.time()
     duration = end_time - start_time
-    print(f"Script duration: {duration} seconds")
\ No newline at end of file
+    print(f"Script duration: {duration} seconds")
+    if args.generation_cache is not None:
+        print(args.generation_cache.stats())
+    print(args.generation_stats.report())
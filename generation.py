@@ -0,0 +1,287 @@
+import threading
+import time
+from argparse import Namespace
+from typing import Dict, Iterator, List
+
+import torch
+from transformers import (
+    BatchEncoding,
+    PreTrainedTokenizer,
+    PreTrainedModel,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+from constrained import GrammarLogitsProcessor
+from utils import JsonScanner
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """Stops each sequence once it has generated its first complete, valid JSON object."""
+
+    def __init__(self, tokenizer: PreTrainedTokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.scanners: List[JsonScanner] = []
+        self._pieces: Dict[int, str] = {}
+
+    def _piece(self, token: int) -> str:
+        if token not in self._pieces:
+            self._pieces[token] = self.tokenizer.decode([token])
+        return self._pieces[token]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if not self.scanners:
+            self.scanners = [JsonScanner() for _ in range(len(input_ids))]
+        for sequence, scanner in zip(input_ids, self.scanners):
+            # Only the tokens generated since the last call are scanned
+            for token in sequence[self.prompt_length + scanner.tokens:].tolist():
+                scanner.feed(self._piece(token))
+        return torch.tensor([scanner.complete for scanner in self.scanners], device=input_ids.device)
+
+
+def json_stopping_criteria(inputs: BatchEncoding, tokenizer: PreTrainedTokenizer, stop_at_json: bool):
+    if not stop_at_json:
+        return None
+    return StoppingCriteriaList([JsonObjectStoppingCriteria(tokenizer, inputs.input_ids.shape[1])])
+
+
+def grammar_logits_processor(inputs: BatchEncoding, tokenizer: PreTrainedTokenizer, grammars):
+    if not grammars or all(grammar is None for grammar in grammars):
+        return None
+    return LogitsProcessorList([GrammarLogitsProcessor(tokenizer, grammars, inputs.input_ids.shape[1])])
+
+
+def prefix_past_key_values(
+    model: PreTrainedModel,
+    inputs: BatchEncoding,
+    tokenizer: PreTrainedTokenizer,
+    args: Namespace,
+):
+    """The cached system prompt prefix of a single prompt, when the prefix cache is on."""
+    prefix_cache = getattr(args, "prefix_cache", None)
+    if prefix_cache is None or len(inputs.input_ids) != 1:
+        return None
+    return prefix_cache.lookup(model, tokenizer, inputs.input_ids[0].tolist())
+
+
+def assistant_kwargs(args: Namespace, rows: int) -> Dict:
+    """The draft model of --draft-model, assisted decoding only runs on a single prompt."""
+    assistant_model = getattr(args, "assistant_model", None)
+    return {"assistant_model": assistant_model} if assistant_model is not None and rows == 1 else {}
+
+
+class StageRecorder:
+    """Times a generation of a pipeline stage and counts the forwards of the model and its draft model."""
+
+    def __init__(self, model: PreTrainedModel, args: Namespace, stage: str, assisted: bool):
+        self.stats = getattr(args, "generation_stats", None)
+        self.stage = stage
+        self.models = [model, args.assistant_model] if assisted else [model]
+        self.forwards = [0, 0]
+        self.tokens = 0
+
+    def _counter(self, index: int):
+        def hook(module, inputs, output):
+            self.forwards[index] += 1
+        return hook
+
+    def __enter__(self):
+        self.handles = [] if self.stats is None else [model.register_forward_hook(self._counter(index)) for index, model in enumerate(self.models)]
+        self.start = time.time()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        for handle in self.handles:
+            handle.remove()
+        if self.stats is not None and error_type is None:
+            self.stats.add(self.stage, self.tokens, time.time() - self.start, self.forwards[0], self.forwards[1])
+
+
+def sampling_kwargs(args: Namespace) -> Dict:
+    """Greedy decoding with --greedy, otherwise the generation config of the model."""
+    return {"do_sample": False, "temperature": None, "top_p": None} if getattr(args, "greedy", False) else {}
+
+
+def generation_key(
+    model: PreTrainedModel,
+    input_ids: List[int],
+    args: Namespace,
+    stop_at_json: bool = False,
+    grammar=None,
+):
+    """
+    Key of a generation in the generation cache, None when the cache is off or
+    the decoding samples, since then the same prompt gives different texts.
+    """
+    cache = getattr(args, "generation_cache", None)
+    if cache is None or not (getattr(args, "greedy", False) or not model.generation_config.do_sample):
+        return None
+    return cache.key(
+        model=model.name_or_path,
+        dtype=str(model.dtype),
+        quantize=getattr(args, "quantize", "none"),
+        draft=getattr(args, "draft_model", None),
+        prompt=input_ids,
+        max_new_tokens=args.max_new_tokens,
+        stop_at_json=stop_at_json,
+        grammar=grammar.digest() if grammar is not None else None,
+    )
+
+
+def generate(
+    model: PreTrainedModel,
+    inputs: BatchEncoding,
+    tokenizer: PreTrainedTokenizer,
+    args: Namespace,
+    stop_at_json: bool = False,
+    grammar=None,
+    stage: str = "generate",
+) -> str:
+    key = generation_key(model, inputs.input_ids[0].tolist(), args, stop_at_json, grammar)
+    if key is not None:
+        text = args.generation_cache.get(key)
+        if text is not None:
+            return text
+    past_key_values = prefix_past_key_values(model, inputs, tokenizer, args)
+    assistant = assistant_kwargs(args, 1)
+    with StageRecorder(model, args, stage, bool(assistant)) as recorder:
+        output = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=args.max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            past_key_values=past_key_values,
+            stopping_criteria=json_stopping_criteria(inputs, tokenizer, stop_at_json),
+            logits_processor=grammar_logits_processor(inputs, tokenizer, [grammar]),
+            **assistant,
+            **sampling_kwargs(args),
+        )
+        recorder.tokens = len(output[0]) - len(inputs.input_ids[0])
+    text = tokenizer.decode(
+        output[0][len(inputs.input_ids[0]) :], skip_special_tokens=True
+    )
+    if key is not None:
+        args.generation_cache.put(key, text)
+    return text
+
+
+def generate_stream(
+    model: PreTrainedModel,
+    inputs: BatchEncoding,
+    tokenizer: PreTrainedTokenizer,
+    args: Namespace,
+    stage: str = "generate",
+) -> Iterator[str]:
+    """generate() yielding the text as it is decoded, generation runs in a thread."""
+    key = generation_key(model, inputs.input_ids[0].tolist(), args)
+    if key is not None:
+        text = args.generation_cache.get(key)
+        if text is not None:
+            yield text
+            return
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    past_key_values = prefix_past_key_values(model, inputs, tokenizer, args)
+    assistant = assistant_kwargs(args, 1)
+    errors = []
+
+    def run():
+        try:
+            with StageRecorder(model, args, stage, bool(assistant)) as recorder:
+                output = model.generate(
+                    inputs.input_ids,
+                    attention_mask=inputs.attention_mask,
+                    max_new_tokens=args.max_new_tokens,
+                    pad_token_id=tokenizer.eos_token_id,
+                    past_key_values=past_key_values,
+                    streamer=streamer,
+                    **assistant,
+                    **sampling_kwargs(args),
+                )
+                recorder.tokens = len(output[0]) - len(inputs.input_ids[0])
+        except Exception as error:
+            # Without the end signal the consumer would wait forever
+            errors.append(error)
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    chunks = []
+    for chunk in streamer:
+        chunks.append(chunk)
+        yield chunk
+    thread.join()
+    if errors:
+        raise errors[0]
+    if key is not None:
+        # The streamer decodes the same tokens as generate(), the joined text is its reply
+        args.generation_cache.put(key, "".join(chunks))
+
+
+def tokenize_left_padded(tokenizer: PreTrainedTokenizer, texts: List[str], model: PreTrainedModel) -> BatchEncoding:
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Left padding, so every prompt ends where its generation starts
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        return tokenizer(texts, return_tensors="pt", padding=True).to(model.device)
+    finally:
+        tokenizer.padding_side = padding_side
+
+
+def generate_batch(
+    model: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    texts: List[str],
+    args: Namespace,
+    stop_at_json: bool = False,
+    grammars=None,
+    stage: str = "generate",
+) -> List[str]:
+    """
+    Continuations of several prompts from a single model.generate call. With
+    `stop_at_json`, each one ends after its first complete JSON object, and
+    `grammars` constrain each prompt to its grammar (None leaves it free).
+    Prompts found in the generation cache are left out of the call.
+    """
+    if not texts:
+        return []
+    grammars = grammars or [None] * len(texts)
+    inputs = tokenize_left_padded(tokenizer, texts, model)
+    # Keyed on the prompt tokens without padding, like a single generate() call
+    keys = [
+        generation_key(model, input_ids[attention_mask.bool()].tolist(), args, stop_at_json, grammar)
+        for input_ids, attention_mask, grammar in zip(inputs.input_ids, inputs.attention_mask, grammars)
+    ]
+    outputs = [args.generation_cache.get(key) if key is not None else None for key in keys]
+    missing = [row for row, output in enumerate(outputs) if output is None]
+    if not missing:
+        return outputs
+    if len(missing) < len(texts):
+        inputs = tokenize_left_padded(tokenizer, [texts[row] for row in missing], model)
+        grammars = [grammars[row] for row in missing]
+    # Left-padded rows do not line up with a cached prefix, only single prompts reuse it
+    past_key_values = prefix_past_key_values(model, inputs, tokenizer, args)
+    assistant = assistant_kwargs(args, len(inputs.input_ids))
+    prompt_length = inputs.input_ids.shape[1]
+    with StageRecorder(model, args, stage, bool(assistant)) as recorder:
+        output = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=args.max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            past_key_values=past_key_values,
+            stopping_criteria=json_stopping_criteria(inputs, tokenizer, stop_at_json),
+            logits_processor=grammar_logits_processor(inputs, tokenizer, grammars),
+            **assistant,
+            **sampling_kwargs(args),
+        )
+        # Finished rows are padded with eos
+        recorder.tokens = int((output[:, prompt_length:] != tokenizer.eos_token_id).sum())
+    for row, sequence in zip(missing, output):
+        outputs[row] = tokenizer.decode(sequence[prompt_length:], skip_special_tokens=True)
+        if keys[row] is not None:
+            args.generation_cache.put(keys[row], outputs[row])
+    return outputs
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from typing import Optional
+from data.files import atomic_write
+
+GENERATION_CACHE_DIR = ".cache/generations"
+
+
+class GenerationCache:
+    """
+    Generated texts on disk, addressed by the sha256 of everything the
+    generation depends on (model, dtype, prompt tokens, parameters).
+
+    Entries are files sharded by the first two hex digits of their key. A
+    hit touches its file, so the modification times order the entries for
+    the LRU eviction that keeps the directory under `max_bytes`.
+    """
+
+    def __init__(self, directory: str = GENERATION_CACHE_DIR, max_bytes: int = 256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = sum(os.path.getsize(path) for path, mtime in self._entries())
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                entries.extend((entry.path, entry.stat().st_mtime) for entry in os.scandir(shard.path) if entry.name.endswith(".json"))
+        return entries
+
+    @staticmethod
+    def key(**fields) -> str:
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as entry_file:
+                text = json.load(entry_file)["text"]
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # An overwritten entry no longer counts its old size
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        atomic_write(path, json.dumps({"text": text}))
+        self.bytes += os.path.getsize(path) - previous
+        if self.bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # Least recently used first, down to 90% so eviction does not run on every put
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.bytes = sum(os.path.getsize(path) for path, mtime in entries)
+        for path, mtime in entries:
+            if self.bytes <= self.max_bytes * 0.9:
+                break
+            self.bytes -= os.path.getsize(path)
+            os.remove(path)
+
+    def stats(self) -> str:
+        return f"generation cache: {self.hits} hits, {self.misses} misses, {self.bytes >> 10} KiB"
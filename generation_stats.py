@@ -0,0 +1,35 @@
+from typing import Dict
+
+
+class GenerationStats:
+    """
+    Generated tokens, decoding time and draft acceptance of each pipeline stage.
+
+    Assisted decoding runs one forward of the model per round, which keeps the
+    accepted draft tokens plus one of its own. So the accepted tokens are the
+    tokens of the assisted calls minus their rounds, out of one draft token
+    per forward of the draft model. Batches are not assisted.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def add(self, stage: str, tokens: int, seconds: float, rounds: int, drafted: int):
+        totals = self.stages.setdefault(stage, {"calls": 0, "tokens": 0, "seconds": 0.0, "assisted_tokens": 0, "rounds": 0, "drafted": 0})
+        totals["calls"] += 1
+        totals["tokens"] += tokens
+        totals["seconds"] += seconds
+        if drafted:
+            totals["assisted_tokens"] += tokens
+            totals["rounds"] += rounds
+            totals["drafted"] += drafted
+
+    def report(self) -> str:
+        lines = []
+        for stage, totals in self.stages.items():
+            line = f"{stage}: {totals['calls']} calls, {totals['tokens']} tokens, {totals['tokens'] / max(totals['seconds'], 1e-9):.1f} tokens/s"
+            if totals["drafted"]:
+                accepted = max(totals["assisted_tokens"] - totals["rounds"], 0)
+                line += f", {accepted / totals['drafted']:.0%} of {totals['drafted']} draft tokens accepted, {totals['assisted_tokens'] / max(totals['rounds'], 1):.2f} tokens per forward"
+            lines.append(line)
+        return "\n".join(lines)
@@ -3,7 +3,7 @@ import random
 from data.database import get_all_areas, get_all_ingredients, get_all_categories, get_all_recipe_names
 from pipeline import get_args, process_nlu, update_nlu_slots
 from recipe_state_tracker import RecipeStateTracker
-from utils import load_model
+from utils import load_model, variant_suffix
 from collections import Counter
 from typing import List, Dict
 from tqdm import tqdm
@@ -229,7 +229,9 @@ def generate_filled_question_recipe_name(templates, all_recipes, intent,num_ques
 if __name__ == "__main__":
     EVALUATE = ["recipe_recommendation","ask_for_ingredients", "ask_for_time", "ask_for_procedure"]
     args = get_args()
-    model, tokenizer = load_model(args)
+    suffix = variant_suffix(args)
+    # With --no-model the metrics are computed on the outputs saved by the last run
+    model, tokenizer = (None, None) if args.no_model else load_model(args)
     state_tracker = RecipeStateTracker()
     TEMPLATES = {
         "recipe_recommendation": RECIPE_RECCOMENDATION_TEMPLATES,
@@ -247,7 +249,7 @@ if __name__ == "__main__":
         test_data_recipe_reccomendation = generate_filled_questions_recipe_recommendation(RECIPE_RECCOMENDATION_TEMPLATES, all_ingredients, all_nationalities, all_categories, num_questions=10)
 
 
-        compute_metrics = False
+        compute_metrics = not args.no_model
         if compute_metrics:
         # Print all generated answers
             for item in test_data_recipe_reccomendation:
@@ -255,7 +257,7 @@ if __name__ == "__main__":
                 intents = process_nlu(user_input, state_tracker, [], model, tokenizer, args)
                 item["detected_intent"] = intents
                 nlu = {"intent": "recipe_recommendation", "slots": {}}
-                update_nlu_slots(nlu, user_input, state_tracker, model, tokenizer, args)  
+                update_nlu_slots(nlu, user_input, state_tracker, [], model, tokenizer, args)
                 if "nationality" not in nlu["slots"]:
                     nlu["slots"]["nationality"] = []
                 if isinstance(nlu["slots"]["nationality"], str):
@@ -270,17 +272,17 @@ if __name__ == "__main__":
                     nlu["slots"]["ingredients"] =  nlu["slots"]["ingredients"].replace(" ","").split(",")
                 item["detected_slots"] = nlu["slots"]
         else:
-            with open("test_data_recipe_reccomendation.json", "r") as f:
+            with open(f"test_data_recipe_recommendation{suffix}.json", "r") as f:
                 test_data_recipe_reccomendation = json.load(f)
         # Calculate metrics
         metrics = calculate_nlu_metrics(test_data_recipe_reccomendation)
         #save metrics
-        with open("nlu_metrics_recipe_recommendation.json", "w") as f:
+        with open(f"nlu_metrics_recipe_recommendation{suffix}.json", "w") as f:
             json.dump(metrics, f, indent=4)
         # save test data recipe
-        with open("test_data_recipe_recommendation.json", "w") as f:
+        with open(f"test_data_recipe_recommendation{suffix}.json", "w") as f:
             json.dump(test_data_recipe_reccomendation, f, indent=4)
-        print("Test data recipe reccomendation saved")
+        print("Test data recipe recommendation saved")
 
     for intent in ["ask_for_ingredients", "ask_for_time", "ask_for_procedure"]:
         if intent not in EVALUATE:
@@ -288,7 +290,7 @@ if __name__ == "__main__":
 
         all_recipes = get_all_recipe_names() 
         test_data = generate_filled_question_recipe_name(TEMPLATES[intent], all_recipes, intent, num_questions=10)
-        compute_metrics = True
+        compute_metrics = not args.no_model
         if compute_metrics:
             # Print all generated answers
             for item in tqdm(test_data, desc=f"Processing {intent}"):
@@ -296,18 +298,24 @@ if __name__ == "__main__":
                 intents = process_nlu(user_input, state_tracker, [], model, tokenizer, args)
                 item["detected_intent"] = intents
                 nlu = {"intent": intent, "slots": {}}
-                update_nlu_slots(nlu, user_input, state_tracker, model, tokenizer, args)  
+                update_nlu_slots(nlu, user_input, state_tracker, [], model, tokenizer, args)
                 if "recipe_name" not in nlu["slots"]:
                     nlu["slots"]["recipe_name"] = []
                 if isinstance(nlu["slots"]["recipe_name"], str):
                     nlu["slots"]["recipe_name"] =  nlu["slots"]["recipe_name"].replace(" ","").split(",")
                 item["detected_slots"] = nlu["slots"]
+        else:
+            with open(f"test_data_{intent}{suffix}.json", "r") as f:
+                test_data = json.load(f)
         
         metrics = calculate_nlu_metrics(test_data)
-        with open(f"nlu_metrics_{intent}.json", "w") as f:
+        with open(f"nlu_metrics_{intent}{suffix}.json", "w") as f:
             json.dump(metrics, f, indent=4)
         # save test data recipe
-        with open(f"test_data_{intent}.json", "w") as f:
+        with open(f"test_data_{intent}{suffix}.json", "w") as f:
             json.dump(test_data, f, indent=4)
         print(f"Test data {intent} saved")
-    
\ No newline at end of file
+    
+    if args.generation_cache is not None:
+        print(args.generation_cache.stats())
+    print(args.generation_stats.report())
@@ -1,15 +1,24 @@
 import argparse
+import atexit
 from argparse import Namespace
 import random
 import sys
 from recipe_state_tracker import RecipeStateTracker
-import torch
-from utils import load_model, generate, MODELS, TEMPLATES, PROMPTS
+from utils import load_model, generate, generate_batch, generate_stream, MODELS, TEMPLATES, PROMPTS
 import json
 import re
-from data.database import filter_recipes, get_all_recipe_names, get_meal_by_name, get_meals_by_ingredients
+from data.config import CLOSEST_RECIPES_K, DB_BACKEND, PANTRY_CLOSEST_MAX_MISSING
+from data.database import filter_recipes, get_all_areas, get_all_categories, get_all_ingredients, get_all_recipe_names, get_pantry_recipes, get_similar_meals, get_unconfirmed_times, get_meal_by_name, get_meal_projection, get_meals_by_ingredients, rank_missing_slots, rank_recipes, suggest_refining_ingredients
+from data.projection import INTENT_FIELDS
+from data.store import BACKENDS, set_backend
+from prefix_cache import PrefixCache, prompt_prefixes
+from generation_cache import GenerationCache
+from generation_stats import GenerationStats
 from copy import deepcopy
 
+# Grammars by (prompt key, --constrained), built on first use
+GRAMMARS = {}
+
 def extract_json_from_text(content):
 
     open_braces = content.count('{')
@@ -56,8 +65,8 @@ def get_args() -> Namespace:
     parser.add_argument(
         "--device",
         type=str,
-        default="cuda" if torch.cuda.is_available() else "cpu",
-        help="The device to use for the model.",
+        default=None,
+        help="The device to use for the model, cuda when available.",
     )
     parser.add_argument(
         "--parallel",
@@ -78,80 +87,264 @@ def get_args() -> Namespace:
         help="The maximum sequence length to use for the model.",
     )
 
+    parser.add_argument(
+        "--db-backend",
+        type=str,
+        choices=list(BACKENDS),
+        default=DB_BACKEND,
+        help="The storage backend for the meal database.",
+    )
+
+    parser.add_argument(
+        "--draft-model",
+        type=str,
+        choices=list(MODELS.keys()),
+        default=None,
+        help="A small model with the same tokenizer, drafting tokens for the model to check (assisted decoding).",
+    )
+    parser.add_argument(
+        "--quantize",
+        type=str,
+        choices=["none", "int8"],
+        default="none",
+        help="Dynamic int8 quantization of the linear layers, for CPU inference.",
+    )
+    parser.add_argument(
+        "--constrained",
+        type=str,
+        choices=["none", "schema", "vocabulary"],
+        default="none",
+        help="Constrain the NLU and DM outputs to their JSON schema, and slot values to the database vocabularies.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the replies token by token as they are generated.",
+    )
+    parser.add_argument(
+        "--prefix-cache-mb",
+        type=int,
+        default=1024,
+        help="Memory for the KV caches of the system prompts, 0 to disable them.",
+    )
+    parser.add_argument(
+        "--greedy",
+        action="store_true",
+        help="Decode greedily, so the same prompt always gives the same output.",
+    )
+    parser.add_argument(
+        "--no-generation-cache",
+        action="store_true",
+        help="Always run the model, even for prompts whose output is in the generation cache.",
+    )
+    parser.add_argument(
+        "--generation-cache-mb",
+        type=int,
+        default=256,
+        help="Disk space for the outputs of greedy generations, kept in .cache/generations.",
+    )
+    parser.add_argument(
+        "--no-model",
+        action="store_true",
+        help="Do not load a model, for the evaluation stages that only compute metrics from saved outputs.",
+    )
+
     parsed_args = parser.parse_args()
+    set_backend(parsed_args.db_backend)
     parsed_args.chat_template = TEMPLATES[parsed_args.model_name]
+    parsed_args.prefix_cache = None
+    if parsed_args.prefix_cache_mb > 0:
+        parsed_args.prefix_cache = PrefixCache(prompt_prefixes(parsed_args.chat_template, PROMPTS.values()), parsed_args.prefix_cache_mb << 20)
     parsed_args.model_name = MODELS[parsed_args.model_name]
+    parsed_args.draft_model = MODELS[parsed_args.draft_model] if parsed_args.draft_model else None
+    parsed_args.assistant_model = None
+    parsed_args.generation_stats = GenerationStats()
+    # Only deterministic generations are looked up, see utils.generation_key
+    parsed_args.generation_cache = None
+    if not parsed_args.no_generation_cache and parsed_args.generation_cache_mb > 0:
+        parsed_args.generation_cache = GenerationCache(max_bytes=parsed_args.generation_cache_mb << 20)
 
     return parsed_args
 def main():
     args = get_args()
     model, tokenizer = load_model(args)
     state_tracker = RecipeStateTracker()
+    if args.draft_model:
+        # The session ends with Ctrl+C, the acceptance of the draft model is printed on the way out
+        atexit.register(lambda: print(args.generation_stats.report()))
 
     historical_context = []
     while True:
         user_input = get_user_input(historical_context)
         intents = process_nlu(user_input, state_tracker, historical_context, model, tokenizer, args)
-        nlgs = []
-        for intent in intents:
-            nlu = {"intent": intent, "slots": {}}
-            nlus = [nlu]
-            if intent not in ["not_supported","ask_for_recipe_list"]: 
-                update_nlu_slots(nlu, user_input, state_tracker,historical_context, model, tokenizer, args)  
-                if nlu["intent"] == "recipe_recommendation":
-                    if isinstance(nlu["slots"]["nationality"], str):
-                        nlu["slots"]["nationality"] =  nlu["slots"]["nationality"].replace(" ","").split(",")
-                    if isinstance(nlu["slots"]["nationality"], list):
-                        nationalities = nlu["slots"]["nationality"]
-                        nlu["slots"]["nationality"] = nationalities[0]
-                        nationalities = nationalities[1:]
-                        for i in range(len(nationalities)):
-                            new_nlu = deepcopy(nlu)
-                            new_nlu["slots"]["nationality"] = nationalities[i]
-                            nlus.append(new_nlu)
-                if nlu["intent"] in ["ask_for_ingredients","ask_for_procedure","ask_for_time"]:
-                    if isinstance(nlu["slots"]["recipe_name"], str):
-                        nlu["slots"]["recipe_name"] =  nlu["slots"]["recipe_name"].replace(" ","").split(",")
-                    if isinstance(nlu["slots"]["recipe_name"], list):
-                        recipe_names = nlu["slots"]["recipe_name"]
-                        if len(recipe_names) == 0:
-                            nlu["slots"]["recipe_name"] = None
-                        else:
-                            nlu["slots"]["recipe_name"] = recipe_names[0]
-                            recipe_names = recipe_names[1:]
-                            for i in range(len(recipe_names)):
-                                new_nlu = deepcopy(nlu)
-                                new_nlu["slots"]["recipe_name"] = recipe_names[i]
-                                nlus.append(new_nlu)
-            for nlu in nlus:
-                state_tracker.update(nlu)
-                
-                dm_input, filtered_recipes, recipe_information = generate_dm_input(nlu, state_tracker)
-                dm_output = generate_dm_output(nlu, dm_input, state_tracker, recipe_information, model, tokenizer, args)
-                # print(f"DM: {dm_output['action_required'][0]}")
-                
-                nlg_input, prompt = prepare_nlg_input(nlu, state_tracker, dm_output, filtered_recipes, recipe_information)
-                nlg_output = generate_nlg_output(nlg_input, prompt, model, tokenizer, args)
-                nlgs.append(nlg_output)                
+        nlus = [{"intent": intent, "slots": {}} for intent in intents]
+        # Each stage runs the prompts of every intent of the turn as one batch
+        update_nlu_slots_batch([nlu for nlu in nlus if nlu["intent"] not in ["not_supported","ask_for_recipe_list"]], user_input, historical_context, model, tokenizer, args)
+        nlus = [split for nlu in nlus for split in split_nlu(nlu)]
+
+        turns = []
+        for nlu in nlus:
+            state_tracker.update(nlu)
+            dm_input, filtered_recipes, recipe_information = generate_dm_input(nlu, state_tracker)
+            dm_text = dm_prompt(nlu, dm_input, args)
+            # Rule-based actions are taken in order, as they can update the tracker
+            dm_output = rule_dm_output(nlu, state_tracker, recipe_information) if dm_text is None else None
+            # The NLG of an nlu sees the state right after it, not after the later ones
+            turns.append([nlu, deepcopy(state_tracker), dm_input, dm_text, dm_output, filtered_recipes, recipe_information])
+
+        model_turns = [turn for turn in turns if turn[3] is not None]
+        grammars = [prompt_grammar(dm_prompt_key(turn[0]), args) for turn in model_turns]
+        for turn, dm_output in zip(model_turns, generate_batch(model, tokenizer, [turn[3] for turn in model_turns], args, stop_at_json=True, grammars=grammars, stage="dm")):
+            turn[4] = extract_json_from_text(dm_output)
+            # print(f"DM: {turn[4]['action_required'][0]}")
+
+        nlg_texts = []
+        for nlu, turn_state, dm_input, dm_text, dm_output, filtered_recipes, recipe_information in turns:
+            nlg_input, prompt = prepare_nlg_input(nlu, turn_state, dm_input, dm_output, filtered_recipes, recipe_information)
+            nlg_texts.append(args.chat_template.format(prompt, json.dumps(nlg_input, indent=4)))
+
+        if args.stream:
+            if len(nlg_texts) > 1:
+                # Only the merged reply is shown, so only it is streamed
+                nlgs = generate_batch(model, tokenizer, nlg_texts, args, stage="nlg")
+                chunks = stream_nlg_output(nlgs, PROMPTS["NLG_END"], model, tokenizer, args)
+            else:
+                chunks = generate_stream(model, tokenizer(nlg_texts[0], return_tensors="pt").to(model.device), tokenizer, args, stage="nlg")
+            nlg_output, shown = stream_reply(chunks)
+            historical_context.append(shown if len(nlg_texts) > 1 else nlg_output)
+            continue
+
+        nlgs = generate_batch(model, tokenizer, nlg_texts, args, stage="nlg")
 
         if len(nlgs) > 1:
             nlg_input = nlgs
             prompt = PROMPTS["NLG_END"]
-            nlg_output = generate_nlg_output(nlg_input, prompt, model, tokenizer, args)
-            if nlg_output.count('\"') == 2:
-                match = re.search(r'\"(.*?)\"', nlg_output, re.DOTALL)
-                if match : 
-                    nlg_output = match.group(1)
+            nlg_output = strip_quotes(generate_nlg_output(nlg_input, prompt, model, tokenizer, args))
             print(f"Cheffy: {nlg_output}")
             historical_context.append(nlg_output)
         else:
-            if nlgs[0].count('\"') == 2:
-                match = re.search(r'\"(.*?)\"', nlgs[0], re.DOTALL)
-                if match : 
-                    nlg_output = match.group(1)
+            nlg_output = strip_quotes(nlgs[0])
             print(f"Cheffy: {nlg_output}")
             historical_context.append(nlgs[0])
 
+def split_nlu(nlu):
+    """One nlu per nationality or recipe name given in the slots."""
+    nlus = [nlu]
+    if nlu["intent"] == "recipe_recommendation":
+        if isinstance(nlu["slots"].get("nationality"), str):
+            nlu["slots"]["nationality"] =  nlu["slots"]["nationality"].replace(" ","").split(",")
+        if isinstance(nlu["slots"].get("nationality"), list):
+            nationalities = nlu["slots"]["nationality"]
+            nlu["slots"]["nationality"] = nationalities[0]
+            nationalities = nationalities[1:]
+            for i in range(len(nationalities)):
+                new_nlu = deepcopy(nlu)
+                new_nlu["slots"]["nationality"] = nationalities[i]
+                nlus.append(new_nlu)
+    if nlu["intent"] in ["ask_for_ingredients","ask_for_procedure","ask_for_time"]:
+        if isinstance(nlu["slots"].get("recipe_name"), str):
+            nlu["slots"]["recipe_name"] =  [name.strip() for name in nlu["slots"]["recipe_name"].split(",")]
+        if isinstance(nlu["slots"].get("recipe_name"), list):
+            recipe_names = nlu["slots"]["recipe_name"]
+            if len(recipe_names) == 0:
+                nlu["slots"]["recipe_name"] = None
+            else:
+                nlu["slots"]["recipe_name"] = recipe_names[0]
+                recipe_names = recipe_names[1:]
+                for i in range(len(recipe_names)):
+                    new_nlu = deepcopy(nlu)
+                    new_nlu["slots"]["recipe_name"] = recipe_names[i]
+                    nlus.append(new_nlu)
+    return nlus
+
+def prompt_grammar(prompt_key, args):
+    """The grammar constraining the output of a prompt with --constrained, else None."""
+    constrained = getattr(args, "constrained", "none")
+    if constrained == "none":
+        return None
+    key = (prompt_key, constrained)
+    if key not in GRAMMARS:
+        intents = {intent: list(state.get_slots()) for intent, state in RecipeStateTracker().intents.items()}
+        vocabularies = None
+        if constrained == "vocabulary":
+            # Recipe names stay free strings: the user may ask for a recipe
+            # missing from the database, which the DM then reports as not found
+            vocabularies = {
+                "nationality": get_all_areas(),
+                "category": get_all_categories(),
+                "ingredients": get_all_ingredients(),
+            }
+        from constrained import stage_grammar
+        GRAMMARS[key] = stage_grammar(prompt_key, intents, vocabularies)
+    return GRAMMARS[key]
+
+
+def strip_quotes(text):
+    """The reply to show: a reply opening with a quote is shown from it up to its last quote, both left out."""
+    stripped = text.lstrip()
+    if not stripped.startswith('"'):
+        return text
+    inner = stripped[1:]
+    return inner[:inner.rfind('"')] if '"' in inner else inner
+
+
+class QuoteStripper:
+    """
+    strip_quotes applied to a stream: after the opening quote the text is
+    shown as it arrives, each later quote and the text following it are held
+    back until another quote shows it was not the closing one.
+    """
+
+    def __init__(self):
+        self.state = "start"
+        self.pending = ""
+        self.held = None
+        self.shown = ""
+
+    def _show(self, text):
+        self.shown += text
+        return text
+
+    def feed(self, text):
+        shown = ""
+        for char in text:
+            if self.state == "plain":
+                shown += self._show(char)
+            elif self.state == "start":
+                if char == '"':
+                    self.state = "quoted"
+                elif char.isspace():
+                    self.pending += char
+                else:
+                    self.state = "plain"
+                    shown += self._show(self.pending + char)
+            elif char == '"':
+                if self.held is not None:
+                    shown += self._show(self.held)
+                self.held = char
+            elif self.held is not None:
+                self.held += char
+            else:
+                shown += self._show(char)
+        return shown
+
+    def finish(self):
+        # The last held quote closed the reply, it and what follows are dropped
+        return self._show(self.pending) if self.state == "start" else ""
+
+
+def stream_reply(chunks, write=lambda text: print(text, end="", flush=True)):
+    """Write a reply as its chunks arrive, returns the generated and the shown text."""
+    stripper = QuoteStripper()
+    generated = ""
+    write("Cheffy: ")
+    for chunk in chunks:
+        generated += chunk
+        write(stripper.feed(chunk))
+    write(stripper.finish() + "\n")
+    return generated, stripper.shown
+
+
 def extract_text_between_quotes(text):
     match = re.search(r'"(.*?)"', text)
     return match.group(1) if match else None
@@ -173,7 +366,7 @@ def process_nlu(user_input, state_tracker, historical_context, model, tokenizer,
 
     nlu_text = args.chat_template.format(PROMPTS["NLU_INTENT"], nlu_input)
     tokenized_input = tokenizer(nlu_text, return_tensors="pt").to(model.device)
-    nlu_output = generate(model, tokenized_input, tokenizer, args)
+    nlu_output = generate(model, tokenized_input, tokenizer, args, stop_at_json=True, grammar=prompt_grammar("NLU_INTENT", args), stage="nlu_intent")
     nlu_output = extract_json_from_text(nlu_output)
     # print(f"NLU INTENT: {nlu_output}")
     if "intents" not in list(nlu_output.keys()):
@@ -192,31 +385,61 @@ def process_nlu(user_input, state_tracker, historical_context, model, tokenizer,
     return nlu_output["intents"]
 
 
-def update_nlu_slots(nlu, user_input, state_tracker, historical_context, model, tokenizer, args):
+def nlu_slots_text(nlu, user_input, historical_context, args):
     nlu_input = {"user_input": user_input, "historical_context": historical_context}
     # print(f"NLU Input: {nlu_input}")
-    nlu_text = args.chat_template.format(PROMPTS[f"NLU_SLOTS_{nlu['intent']}"], nlu_input)
+    return args.chat_template.format(PROMPTS[f"NLU_SLOTS_{nlu['intent']}"], nlu_input)
+
+
+def update_nlu_slots(nlu, user_input, state_tracker, historical_context, model, tokenizer, args):
+    nlu_text = nlu_slots_text(nlu, user_input, historical_context, args)
     tokenized_input = tokenizer(nlu_text, return_tensors="pt").to(model.device)
-    nlu_output = generate(model, tokenized_input, tokenizer, args)
+    nlu_output = generate(model, tokenized_input, tokenizer, args, stop_at_json=True, grammar=prompt_grammar(f"NLU_SLOTS_{nlu['intent']}", args), stage="nlu_slots")
     nlu_output = extract_json_from_text(nlu_output)
     # print(f"NLU SLOTS: {nlu_output}")
-    nlu["slots"] = nlu_output["slots"]
-    
+    nlu["slots"] = nlu_output.get("slots") or {}
+
+
+def update_nlu_slots_batch(nlus, user_input, historical_context, model, tokenizer, args):
+    """update_nlu_slots for several intents with one generate call."""
+    nlu_texts = [nlu_slots_text(nlu, user_input, historical_context, args) for nlu in nlus]
+    grammars = [prompt_grammar(f"NLU_SLOTS_{nlu['intent']}", args) for nlu in nlus]
+    for nlu, nlu_output in zip(nlus, generate_batch(model, tokenizer, nlu_texts, args, stop_at_json=True, grammars=grammars, stage="nlu_slots")):
+        nlu_output = extract_json_from_text(nlu_output)
+        # print(f"NLU SLOTS: {nlu_output}")
+        nlu["slots"] = nlu_output.get("slots") or {}
 
 
 def generate_dm_input(nlu, state_tracker):
     filtered_recipes = []
     recipe_information = []
+    missing_ingredients = {}
 
     if nlu["intent"] == "recipe_recommendation":
         slots = state_tracker.get_slots("recipe_recommendation")
         # print(f"Slots: {slots}")
-        if slots.get("category") is None and slots.get("ingredients") is None and slots.get("nationality") is None:
+        if slots.get("similar_to"):
+            # Neighbours of the recipe, narrowed by the other slots when given
+            filtered_recipes = [name for name, similarity in get_similar_meals(slots["similar_to"])]
+            if slots.get("category") is not None or slots.get("ingredients") is not None or slots.get("nationality") is not None or slots.get("max_time") is not None:
+                matching = set(filter_recipes(slots.get("nationality"), slots.get("category"), slots.get("ingredients"), max_time=slots.get("max_time")))
+                filtered_recipes = [name for name in filtered_recipes if name in matching]
+        elif slots.get("category") is None and slots.get("ingredients") is None and slots.get("nationality") is None and slots.get("max_time") is None:
             filtered_recipes= []
+        elif slots.get("ingredients_mode") == "pantry" and slots.get("ingredients"):
+            pantry_recipes = get_pantry_recipes(slots.get("ingredients"), nationality=slots.get("nationality"), category=slots.get("category"), max_time=slots.get("max_time"))
+            filtered_recipes = [name for name, missing in pantry_recipes]
+            missing_ingredients = {name: missing for name, missing in pantry_recipes if missing}
         else:
-            filtered_recipes = filter_recipes(slots.get("nationality"), slots.get("category"), slots.get("ingredients"))
+            filtered_recipes = filter_recipes(slots.get("nationality"), slots.get("category"), slots.get("ingredients"), max_time=slots.get("max_time"))
         # print(f"Meals: {filtered_recipes}")
-        return {"matched_recipes": filtered_recipes, "state": state_tracker.to_dict()}, filtered_recipes, []
+        dm_input = {"matched_recipes": filtered_recipes, "state": state_tracker.to_dict()}
+        if missing_ingredients:
+            dm_input["missing_ingredients"] = missing_ingredients
+        if len(filtered_recipes) > 1:
+            # Unfilled slots, the one narrowing the matches the most first
+            dm_input["slots_to_ask"] = rank_missing_slots(slots)
+        return dm_input, filtered_recipes, []
 
     elif nlu["intent"] == "ask_for_recipe_list":
         recipes = get_all_recipe_names()
@@ -225,75 +448,105 @@ def generate_dm_input(nlu, state_tracker):
 
     elif nlu["intent"] in {"ask_for_ingredients", "ask_for_procedure", "ask_for_time"}:
         slots = state_tracker.get_slots(nlu["intent"])
-        if slots["recipe_name"] is None:
+        if not slots["recipe_name"]:
             recipe_information = None
         else:
-            recipe_information = get_meal_by_name(slots["recipe_name"])
+            # Only the fields the intent needs: parsed steps for the procedure, never the URLs
+            recipe_information = get_meal_projection(slots["recipe_name"], INTENT_FIELDS[nlu["intent"]])
         return {"recipe": recipe_information, "state": state_tracker.to_dict()}, [], recipe_information
 
     return {"state": state_tracker.to_dict()}, [], []
 
 
-def generate_dm_output(nlu, dm_input, state_tracker, recipe_information, model, tokenizer, args, deterministic = True, one_prompt = False):
+def dm_prompt_key(nlu, deterministic = True, one_prompt = False):
+    """The PROMPTS key of the DM prompt for `nlu`, or None when its action follows from rules."""
     if one_prompt:
-        dm_text = args.chat_template.format(PROMPTS[f"DM"], json.dumps(dm_input, indent=4))
-        tokenized_input = tokenizer(dm_text, return_tensors="pt").to(model.device)
-        dm_output = generate(model, tokenized_input, tokenizer, args)
-        return extract_json_from_text(dm_output)
-    
+        return "DM"
     if nlu["intent"] in {"recipe_recommendation"}:
-        dm_text = args.chat_template.format(PROMPTS[f"DM_{nlu['intent']}"], json.dumps(dm_input, indent=4))
-        tokenized_input = tokenizer(dm_text, return_tensors="pt").to(model.device)
-        dm_output = generate(model, tokenized_input, tokenizer, args)
-        return extract_json_from_text(dm_output)
+        return f"DM_{nlu['intent']}"
+    if nlu["intent"] in {"ask_for_recipe_list", "not_supported"} or deterministic:
+        return None
+    return f"DM_{nlu['intent']}"
 
-    elif nlu["intent"] == "ask_for_recipe_list":
+
+def dm_prompt(nlu, dm_input, args, deterministic = True, one_prompt = False):
+    prompt_key = dm_prompt_key(nlu, deterministic, one_prompt)
+    if prompt_key is None:
+        return None
+    return args.chat_template.format(PROMPTS[prompt_key], json.dumps(dm_input, indent=4))
+
+
+def rule_dm_output(nlu, state_tracker, recipe_information):
+    if nlu["intent"] == "ask_for_recipe_list":
         return {"action_required": ["provide list of recipes"]}
         
     elif nlu["intent"] == "not_supported":
         return {"action_required": ["tell to the user that the bot cannot help for his request or it has understood wrong, ask to the user to repeat his intention."]}
 
-    elif deterministic:
-        if nlu["intent"] == "ask_for_ingredients":
-            if not recipe_information:
-                if nlu["slots"]["recipe_name"]:
-                    state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
-                    return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
-                else:
-                    return {"action_required": ["ask to the user to provide recipe name for which wants the ingredients"]}
+    elif nlu["intent"] == "ask_for_ingredients":
+        if not recipe_information:
+            if nlu["slots"].get("recipe_name"):
+                state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
+                return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
             else:
-                return {"action_required": ["provide list of ingredients"]}
-            
-        elif nlu["intent"] == "ask_for_recipe_list":
-            return {"action_required": ["provide list of recipes"]}
-
-        elif nlu["intent"] == "ask_for_procedure":
-            if not recipe_information :
-                if nlu["slots"]["recipe_name"]:
-                    state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
-                    return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
-                else:
-                    return {"action_required": ["ask to the user to provide recipe name for which wants know the procedure"]}
+                return {"action_required": ["ask to the user to provide recipe name for which wants the ingredients"]}
+        else:
+            return {"action_required": ["provide list of ingredients"]}
+
+    elif nlu["intent"] == "ask_for_procedure":
+        if not recipe_information :
+            if nlu["slots"].get("recipe_name"):
+                state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
+                return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
             else:
-                return {"action_required": ["provide procedure of the recipe"]}
+                return {"action_required": ["ask to the user to provide recipe name for which wants know the procedure"]}
+        else:
+            return {"action_required": ["provide procedure of the recipe"]}
 
-        elif nlu["intent"] == "ask_for_time":
-            if not recipe_information :
-                if nlu["slots"]["recipe_name"]:
-                    state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
-                    return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
-                else:
-                    return {"action_required": ["ask to the user to provide recipe name for which wants know how much time is needed in order to do the recipe"]}
+    elif nlu["intent"] == "ask_for_time":
+        if not recipe_information :
+            if nlu["slots"].get("recipe_name"):
+                state_tracker.intents["ask_for_ingredients"].slots["recipe_name"] = []
+                return {"action_required": ["tell to the user that the recipe name provided is not present in the database"]}
             else:
-                return {"action_required": ["provide the time needed for the recipe"]}
-    else:
-        dm_text = args.chat_template.format(PROMPTS[f"DM_{nlu['intent']}"], json.dumps(dm_input, indent=4))
-        tokenized_input = tokenizer(dm_text, return_tensors="pt").to(model.device)
-        dm_output = generate(model, tokenized_input, tokenizer, args)
-        return extract_json_from_text(dm_output)
+                return {"action_required": ["ask to the user to provide recipe name for which wants know how much time is needed in order to do the recipe"]}
+        else:
+            return {"action_required": ["provide the time needed for the recipe"]}
 
-def prepare_nlg_input(nlu, state_tracker, dm_output, filtered_recipes, recipe_information):
-    if nlu["intent"] == "recipe_recommendation" or nlu["intent"] == "ask_for_recipe_list":
+
+def generate_dm_output(nlu, dm_input, state_tracker, recipe_information, model, tokenizer, args, deterministic = True, one_prompt = False):
+    dm_text = dm_prompt(nlu, dm_input, args, deterministic, one_prompt)
+    if dm_text is None:
+        return rule_dm_output(nlu, state_tracker, recipe_information)
+    tokenized_input = tokenizer(dm_text, return_tensors="pt").to(model.device)
+    dm_output = generate(model, tokenized_input, tokenizer, args, stop_at_json=True, grammar=prompt_grammar(dm_prompt_key(nlu, deterministic, one_prompt), args), stage="dm")
+    return extract_json_from_text(dm_output)
+
+def prepare_nlg_input(nlu, state_tracker, dm_input, dm_output, filtered_recipes, recipe_information):
+    if nlu["intent"] == "recipe_recommendation":
+        nlg_input = {"dm": dm_output, "nlu": state_tracker.to_dict(), "recipes": filtered_recipes}
+        slots = state_tracker.get_slots("recipe_recommendation")
+        if dm_input.get("missing_ingredients"):
+            # Found by the pantry query of the DM input, not queried again
+            nlg_input["missing_ingredients"] = dm_input["missing_ingredients"]
+        if filtered_recipes and slots.get("max_time") is not None:
+            # Recipes whose steps do not give every duration may take longer
+            nlg_input["time_unconfirmed"] = get_unconfirmed_times(filtered_recipes)
+        if "req_info_ingredients" in dm_output.get("action_required", []):
+            # Ingredients splitting the current matches best, for the question to the user
+            nlg_input["ingredients_to_ask_about"] = suggest_refining_ingredients(slots)
+        if not filtered_recipes and slots.get("ingredients_mode") == "pantry" and slots.get("ingredients"):
+            # Nothing is cookable with a few more ingredients: offer the ones needing the fewest,
+            # under the same nationality, category and time filters
+            closest = get_pantry_recipes(slots.get("ingredients"), PANTRY_CLOSEST_MAX_MISSING, slots.get("nationality"), slots.get("category"), slots.get("max_time"))[:CLOSEST_RECIPES_K]
+            nlg_input["closest_recipes"] = [name for name, missing in closest]
+            nlg_input["missing_ingredients"] = {name: missing for name, missing in closest if missing}
+        elif not filtered_recipes and any(slots.get(slot) for slot in ("nationality", "category", "ingredients")):
+            # Nothing matches every slot: offer the recipes matching most of them, within the time limit
+            nlg_input["closest_recipes"] = [name for name, score in rank_recipes(slots.get("nationality"), slots.get("category"), slots.get("ingredients"), max_time=slots.get("max_time"))]
+        return nlg_input, PROMPTS[f"NLG_{nlu['intent']}"]
+
+    elif nlu["intent"] == "ask_for_recipe_list":
         return {"dm": dm_output, "nlu": state_tracker.to_dict(), "recipes": filtered_recipes}, PROMPTS[f"NLG_{nlu['intent']}"]
 
     elif nlu["intent"] in {"ask_for_ingredients", "ask_for_procedure", "ask_for_time"}:
@@ -305,10 +558,15 @@ def prepare_nlg_input(nlu, state_tracker, dm_output, filtered_recipes, recipe_in
     raise ValueError("Invalid intent detected.")
 
 
+def stream_nlg_output(nlg_input, prompt, model, tokenizer, args):
+    nlg_text = args.chat_template.format(prompt, json.dumps(nlg_input, indent=4))
+    tokenized_input = tokenizer(nlg_text, return_tensors="pt").to(model.device)
+    return generate_stream(model, tokenized_input, tokenizer, args, stage="nlg")
+
 def generate_nlg_output(nlg_input, prompt, model, tokenizer, args):
     nlg_text = args.chat_template.format(prompt, json.dumps(nlg_input, indent=4))
     tokenized_input = tokenizer(nlg_text, return_tensors="pt").to(model.device)
-    return generate(model, tokenized_input, tokenizer, args)
+    return generate(model, tokenized_input, tokenizer, args, stage="nlg")
 
 if __name__ == "__main__":
     main()
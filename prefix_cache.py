@@ -0,0 +1,90 @@
+import copy
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+# Sharing fewer tokens with a prefix is not worth copying its cache
+MIN_PREFIX_TOKENS = 32
+
+
+def prompt_prefixes(chat_template: str, prompts: Sequence[str]) -> List[str]:
+    """The chat template up to the user content, for each system prompt."""
+    head, middle = chat_template.split("{}")[:2]
+    return [head + prompt + middle for prompt in prompts]
+
+
+def cache_bytes(cache) -> int:
+    return sum(layer.keys.nbytes + layer.values.nbytes for layer in cache.layers)
+
+
+def _shared_length(prefix: Tuple[int, ...], input_ids: List[int]) -> int:
+    length = 0
+    for prefix_id, input_id in zip(prefix, input_ids):
+        if prefix_id != input_id:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """
+    past_key_values of the static system prompts, so a call only prefills its
+    user-specific suffix.
+
+    A prefix is the chat template formatted up to the user content. Its cache
+    is computed on first use by each model and kept in an LRU bounded by
+    bytes. A call gets a copy cropped to the tokens its prompt really shares
+    with the prefix: the tokenizer can merge the last prefix token with the
+    start of the user content, and at least one token must be left to prefill.
+    """
+
+    def __init__(self, prefixes: Sequence[str], max_bytes: int):
+        self.prefixes = list(prefixes)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tokens: Dict[int, List[Tuple[int, ...]]] = {}
+        self._caches: "OrderedDict[Tuple[int, Tuple[int, ...]], object]" = OrderedDict()
+
+    def _prefix_tokens(self, tokenizer) -> List[Tuple[int, ...]]:
+        # Tokenized like the full prompts, special tokens included
+        if id(tokenizer) not in self._tokens:
+            self._tokens[id(tokenizer)] = [tuple(tokenizer(prefix).input_ids) for prefix in self.prefixes]
+        return self._tokens[id(tokenizer)]
+
+    def _cache(self, model, prefix: Tuple[int, ...]):
+        key = (id(model), prefix)
+        cache = self._caches.get(key)
+        if cache is not None:
+            self._caches.move_to_end(key)
+            self.hits += 1
+            return cache
+        self.misses += 1
+        # Imported here so the pipeline imports without torch
+        import torch
+        with torch.no_grad():
+            cache = model(torch.tensor([prefix], device=model.device), use_cache=True).past_key_values
+        size = cache_bytes(cache)
+        if size <= self.max_bytes:
+            self._caches[key] = cache
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._caches.popitem(last=False)
+                self.bytes -= cache_bytes(evicted)
+        return cache
+
+    def lookup(self, model, tokenizer, input_ids: List[int]):
+        """A copy of the cache of the prefix `input_ids` starts with, or None."""
+        best, shared = None, 0
+        for prefix in self._prefix_tokens(tokenizer):
+            length = _shared_length(prefix, input_ids)
+            if length > shared:
+                best, shared = prefix, length
+        shared = min(shared, len(input_ids) - 1)
+        if best is None or shared < MIN_PREFIX_TOKENS:
+            return None
+        cache = copy.deepcopy(self._cache(model, best))
+        if shared < len(best):
+            # A negative length removes that many tokens from the end
+            cache.crop(shared - len(best))
+        return cache
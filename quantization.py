@@ -0,0 +1,45 @@
+import os
+import torch
+from transformers import AutoModelForCausalLM, PreTrainedModel
+
+QUANTIZED_CACHE_DIR = ".cache/quantized"
+
+
+def quantized_path(model_name: str, mode: str) -> str:
+    return os.path.join(QUANTIZED_CACHE_DIR, f"{model_name.replace('/', '--')}-{mode}.pt")
+
+
+def quantize_int8(model: PreTrainedModel) -> PreTrainedModel:
+    """
+    Dynamic int8 quantization of the linear layers: weights are stored in int8
+    and activations are quantized on the fly, on CPU only.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_int8(model_name: str) -> PreTrainedModel:
+    """
+    The int8 model, quantized from the f32 weights on the first load and then
+    read back from .cache/quantized. Quantized layers have no safetensors
+    format, so the whole module is pickled: only load files written here.
+    """
+    path = quantized_path(model_name, "int8")
+    if os.path.exists(path):
+        return torch.load(path, weights_only=False).eval()
+    # Dynamic quantization only converts f32 linear layers
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model = quantize_int8(model.eval())
+    os.makedirs(QUANTIZED_CACHE_DIR, exist_ok=True)
+    torch.save(model, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return model
+
+
+def model_bytes(model: PreTrainedModel) -> int:
+    """Memory of the weights, packed int8 weights of the quantized layers included."""
+    total = 0
+    for value in model.state_dict().values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.nelement() * tensor.element_size()
+    return total
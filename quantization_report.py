@@ -0,0 +1,66 @@
+import gc
+import json
+import os
+import time
+from copy import copy
+import torch
+from pipeline import get_args
+from quantization import model_bytes
+from utils import PROMPTS, load_model, variant_suffix
+
+# User inputs of the NLU intent prompt, generated greedily to time each variant
+QUESTIONS = [
+    "What can I cook with chicken and rice?",
+    "How long does it take to make Lasagne?",
+    "Give me the ingredients of a Vegetarian Chilli",
+]
+
+
+def benchmark(model, tokenizer, args):
+    texts = [args.chat_template.format(PROMPTS["NLU_INTENT"], {"user_input": question, "historical_context": ""}) for question in QUESTIONS]
+    tokens, seconds = 0, 0.0
+    for text in texts:
+        inputs = tokenizer(text, return_tensors="pt").to(model.device)
+        start = time.time()
+        with torch.no_grad():
+            output = model.generate(**inputs, max_new_tokens=args.max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        seconds += time.time() - start
+        tokens += len(output[0]) - len(inputs.input_ids[0])
+    return tokens / seconds
+
+
+def saved_metrics(suffix):
+    # Written by nlu_evaluation.py and dm_evaluation.py run with the same --quantize
+    metrics = {}
+    for name in ["nlu_metrics_recipe_recommendation", "nlu_metrics_ask_for_ingredients", "nlu_metrics_ask_for_procedure", "nlu_metrics_ask_for_time", "data/dm_metrics"]:
+        path = f"{name}{suffix}.json"
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                metrics[name] = json.load(f)
+    return metrics
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = {}
+    for quantize in ["none", "int8"]:
+        variant_args = copy(args)
+        variant_args.quantize = quantize
+        if quantize == "int8":
+            variant_args.device = "cpu"
+        start = time.time()
+        model, tokenizer = load_model(variant_args)
+        variant = args.dtype if quantize == "none" else quantize
+        report[variant] = {
+            "load_seconds": round(time.time() - start, 1),
+            "weights_mb": round(model_bytes(model) / (1 << 20)),
+            "tokens_per_second": round(benchmark(model, tokenizer, variant_args), 2),
+            "metrics": saved_metrics(variant_suffix(variant_args)),
+        }
+        print(variant, {key: value for key, value in report[variant].items() if key != "metrics"})
+        del model
+        gc.collect()
+
+    with open("quantization_report.json", "w") as f:
+        json.dump(report, f, indent=4)
+    print("Report saved to quantization_report.json")
@@ -1,5 +1,6 @@
 import json
-from data.database import get_all_categories, get_all_ingredients, get_all_areas
+from data.database import is_known_value, resolve_recipe_name
+from data.procedure import parse_minutes
 from rule import *
 
 class Intent:
@@ -8,6 +9,8 @@ class Intent:
         self.intent = None
         self.slots = {}
         self.values_allowed_slots: dict[str,Rule] = {}
+        # Slots left out of the state while unset
+        self.optional_slots = set()
 
     def get_active(self):
         return self.active
@@ -39,7 +42,7 @@ class Intent:
     def to_dict(self):
         return {
             "intent": self.intent,
-            "slots": self.slots
+            "slots": {slot: value for slot, value in self.slots.items() if slot not in self.optional_slots or value is not None}
         }
 
     def reset(self):
@@ -111,6 +114,7 @@ class RecipeStateTracker:
                 else:    
                     if isinstance(value, str):
                         value = value.lower()
+                    value = self.intents[intent].values_allowed_slots[slot].normalize(value)
                     if self.intents[intent].values_allowed_slots[slot].validate(value): 
                         self.intents[intent].slots[slot] = value
                     else:
@@ -149,7 +153,7 @@ class AskForTime(Intent):
             "recipe_name": None,
         }
         self.values_allowed_slots = {
-            "recipe_name": IsStringRule(),
+            "recipe_name": RecipeNameRule(resolve_recipe_name),
         }
     def reset(self):
         self.slots = {
@@ -164,21 +168,23 @@ class RecipeRaccomandation(Intent):
             "nationality": None,
             "category": None,
             "ingredients": None,
+            "ingredients_mode": None,
+            "similar_to": None,
+            "max_time": None,
         }
+        # "pantry": the ingredients are all the user has, instead of ones the recipe must contain
+        # similar_to: a recipe the user wants something like
+        # max_time: the most minutes the user wants to spend cooking
+        self.optional_slots = {"ingredients_mode", "similar_to", "max_time"}
 
-        all_ingredients = get_all_ingredients()
-        all_ingredients = [ing.lower() for ing in all_ingredients if ing]
-
-        all_areas = get_all_areas()
-        all_areas = [area.lower() for area in all_areas if area]
-
-        all_categories = get_all_categories()
-        all_categories = [category.lower() for category in all_categories]
-
+        # Checked against the facet vocabularies of the database, no list scans
         self.values_allowed_slots = {
-            "nationality": InListRule(all_areas),
-            "ingredients": InListRule(all_ingredients),
-            "category": InListRule(all_categories),
+            "nationality": InFacetRule("nationality", is_known_value),
+            "ingredients": InFacetRule("ingredients", is_known_value),
+            "category": InFacetRule("category", is_known_value),
+            "ingredients_mode": InListRule(["all", "pantry"]),
+            "similar_to": RecipeNameRule(resolve_recipe_name),
+            "max_time": DurationRule(parse_minutes),
         }
     
     def reset(self):
@@ -186,6 +192,9 @@ class RecipeRaccomandation(Intent):
             "nationality": None,
             "category": None,
             "ingredients": None,
+            "ingredients_mode": None,
+            "similar_to": None,
+            "max_time": None,
         }
         return self.slots
 
@@ -197,7 +206,7 @@ class AskForIngredients(Intent):
             "recipe_name": None,
         }
         self.values_allowed_slots = {
-            "recipe_name": IsStringRule(),
+            "recipe_name": RecipeNameRule(resolve_recipe_name),
         }
     
     def reset(self):
@@ -222,7 +231,7 @@ class AskForProcedure(Intent):
             "recipe_name": None,
         }
         self.values_allowed_slots = {
-            "recipe_name": IsStringRule(),
+            "recipe_name": RecipeNameRule(resolve_recipe_name),
         }
     def reset(self):
         self.slots = {
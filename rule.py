@@ -3,6 +3,10 @@ class Rule:
     def validate(self, value):
         raise NotImplementedError("Subclasses must implement this method.")
 
+    def normalize(self, value):
+        """Map a value to its canonical form before validation."""
+        return value
+
 class InListRuleFromString(Rule):
     """Rule to validate if a value is in a predefined list."""
     def __init__(self, allowed_values):
@@ -20,6 +24,15 @@ class InListRule(Rule):
     def validate(self, value):
         return value in self.allowed_values
 
+class InFacetRule(Rule):
+    """Rule to validate if a value is one of the values of a database facet."""
+    def __init__(self, facet, is_known):
+        self.facet = facet
+        self.is_known = is_known
+
+    def validate(self, value):
+        return isinstance(value, str) and self.is_known(self.facet, value)
+
 class AlwaysTrueRule(Rule):
     """Rule that always evaluates to True."""
     def validate(self, value):
@@ -34,11 +47,38 @@ class IsIntegerRule(Rule):
         except ValueError:
             return False
     
+class DurationRule(Rule):
+    """Rule to validate a duration, normalizing "30 minutes" or "1 hour" to minutes."""
+    def __init__(self, parse_minutes):
+        self.parse_minutes = parse_minutes
+
+    def normalize(self, value):
+        if isinstance(value, str):
+            value = value.strip()
+            if value.isdigit():
+                return int(value)
+            return self.parse_minutes(value)
+        return value
+
+    def validate(self, value):
+        return isinstance(value, int) and value > 0
+
 class IsStringRule(Rule):
     """Rule to validate if a value is a string."""
     def validate(self, value):
         return isinstance(value, str)
 
+class RecipeNameRule(IsStringRule):
+    """Rule to validate a recipe name, normalizing it to the closest known recipe."""
+    def __init__(self, resolve):
+        self.resolve = resolve
+
+    def normalize(self, value):
+        if not isinstance(value, str):
+            return value
+        matches = self.resolve(value, 1)
+        return matches[0][0] if matches else value
+
 class RangeRule(Rule):
     """Rule to validate if a value is within a range."""
     def __init__(self, min_value, max_value):
@@ -0,0 +1,20 @@
+from argparse import Namespace
+import pipeline
+from pipeline import prompt_grammar
+
+
+def test_vocabulary_grammar_keeps_recipe_names_free(monkeypatch):
+    monkeypatch.setattr(pipeline, "GRAMMARS", {})
+    monkeypatch.setattr(pipeline, "get_all_areas", lambda: ["Italian"])
+    monkeypatch.setattr(pipeline, "get_all_categories", lambda: ["Dessert"])
+    monkeypatch.setattr(pipeline, "get_all_ingredients", lambda: ["Flour"])
+    args = Namespace(constrained="vocabulary")
+
+    grammar = prompt_grammar("NLU_SLOTS_ask_for_time", args)
+    # A recipe missing from the database reaches the DM, which reports it not found
+    assert grammar.final in grammar.advance(grammar.start, '{"slots": {"recipe_name": "Beef Wellington"}}')
+
+    grammar = prompt_grammar("NLU_SLOTS_recipe_recommendation", args)
+    slots = '{"slots": {"nationality": "%s"'
+    assert grammar.advance(grammar.start, slots % "Italian")
+    assert not grammar.advance(grammar.start, slots % "Martian")
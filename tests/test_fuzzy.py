@@ -0,0 +1,33 @@
+from data.fuzzy import FuzzyNameIndex, edit_distance
+
+NAMES = ["Roti john", "Kedgeree", "Beef Wellington", "Rock Cakes", "Crème Brûlée"]
+
+
+def names(index, query):
+    return [(NAMES[position], score) for position, score in index.lookup(query)]
+
+
+def test_case_spaces_and_accents_do_not_count():
+    index = FuzzyNameIndex(NAMES)
+    assert names(index, "Rotijohn") == [("Roti john", 1.0)]
+    assert names(index, "creme brulee!") == [("Crème Brûlée", 1.0)]
+
+
+def test_typos_up_to_max_distance():
+    index = FuzzyNameIndex(NAMES)
+    assert names(index, "Kedgree") == [("Kedgeree", 0.875)]
+    # A transposition is a single edit
+    assert names(index, "Rtoi john") == [("Roti john", 0.875)]
+    assert names(index, "Kdgre") == []
+    assert names(FuzzyNameIndex(NAMES, max_distance=1), "Kedgre") == []
+    assert edit_distance("kedgeree", "kdgre", 2) == 3
+
+
+def test_prefix_limits_the_deletes_not_the_distance():
+    index = FuzzyNameIndex(NAMES, prefix_length=4)
+    # Edits after the prefix are found through the deletes of the prefix
+    assert names(index, "Beef Welingtn") == [("Beef Wellington", 0.857)]
+    # but the whole name still has to be within max_distance
+    assert names(index, "Beef Welngtn") == []
+    # Only the first prefix_length characters are indexed
+    assert all(len(delete) <= 4 for delete in index.deletes)
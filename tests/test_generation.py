@@ -0,0 +1,14 @@
+from argparse import Namespace
+from generation import generate, generate_batch
+
+PROMPTS = ["Suggest a pasta dish.", "Hi", "How long does the Kedgeree take to cook?"]
+
+
+def test_batch_matches_single_generations(tiny_model):
+    model, tokenizer = tiny_model
+    args = Namespace(max_new_tokens=12, greedy=True)
+    # Left padding leaves every continuation as if its prompt ran alone
+    singles = [generate(model, tokenizer(text, return_tensors="pt"), tokenizer, args) for text in PROMPTS]
+    assert generate_batch(model, tokenizer, PROMPTS, args) == singles
+    assert generate_batch(model, tokenizer, PROMPTS[1:2], args) == singles[1:2]
+    assert generate_batch(model, tokenizer, [], args) == []
@@ -0,0 +1,43 @@
+import os
+from argparse import Namespace
+from types import SimpleNamespace
+from generation import generation_key
+from generation_cache import GenerationCache
+
+
+def test_overwritten_entries_count_once(tmp_path):
+    cache = GenerationCache(str(tmp_path))
+    cache.put("aa1", "first text")
+    cache.put("aa1", "second, longer text")
+    assert cache.bytes == os.path.getsize(cache._path("aa1"))
+    assert GenerationCache(str(tmp_path)).bytes == cache.bytes
+
+
+def test_eviction_drops_the_least_recently_used(tmp_path):
+    cache = GenerationCache(str(tmp_path))
+    for age, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, "x" * 100)
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    # A hit makes the oldest entry the most recently used
+    assert cache.get("aa1") == "x" * 100
+
+    # Room for three and a half entries: the fourth one evicts a single entry
+    cache.max_bytes = cache.bytes * 7 // 6
+    cache.put("dd4", "x" * 100)
+    assert cache.get("bb2") is None
+    assert [cache.get(key) for key in ["aa1", "cc3", "dd4"]] == ["x" * 100] * 3
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_only_greedy_generations_get_a_key(tmp_path):
+    args = Namespace(generation_cache=GenerationCache(str(tmp_path)), max_new_tokens=8, greedy=False)
+    sampling = SimpleNamespace(name_or_path="tiny", dtype="float32", generation_config=SimpleNamespace(do_sample=True))
+    greedy = SimpleNamespace(name_or_path="tiny", dtype="float32", generation_config=SimpleNamespace(do_sample=False))
+
+    assert generation_key(sampling, [1, 2, 3], args) is None
+    assert generation_key(greedy, [1, 2, 3], args) == generation_key(greedy, [1, 2, 3], args)
+    assert generation_key(greedy, [1, 2, 3], args) != generation_key(greedy, [1, 2, 4], args)
+    # --greedy overrides a sampling generation config
+    args.greedy = True
+    assert generation_key(sampling, [1, 2, 3], args) is not None
+    assert generation_key(greedy, [1, 2, 3], Namespace(generation_cache=None, max_new_tokens=8, greedy=True)) is None
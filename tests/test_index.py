@@ -0,0 +1,59 @@
+import json
+import os
+from collections import Counter
+import pytest
+from data.facets import FacetIndex
+from data.index import MealIndex, normalize_term
+from data.meal import Meal
+
+DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "meal_database.json")
+
+with open(DB, "r") as db_file:
+    MEALS = [Meal.from_dict(meal) for meal in json.load(db_file)]
+
+
+def scan(nationality=None, category=None, ingredients=None, exclude_ingredients=None):
+    matches = []
+    for position, meal in enumerate(MEALS):
+        names = {normalize_term(name) for name in meal.ingredient_names}
+        if nationality is not None and normalize_term(meal.strArea or "") != normalize_term(nationality):
+            continue
+        if category is not None and normalize_term(meal.strCategory or "") != normalize_term(category):
+            continue
+        if any(normalize_term(ingredient) not in names for ingredient in ingredients or []):
+            continue
+        if any(normalize_term(ingredient) in names for ingredient in exclude_ingredients or []):
+            continue
+        matches.append(position)
+    return matches
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"nationality": "British"},
+    {"nationality": " british ", "category": "Seafood"},
+    {"ingredients": ["Eggs"]},
+    {"ingredients": ["eggs", "Milk"], "exclude_ingredients": ["Butter"]},
+    {"category": "Dessert", "exclude_ingredients": ["Sugar", "Nonexistent"]},
+    {"nationality": "Nowhere"},
+])
+def test_index_matches_a_linear_scan(filters):
+    assert MealIndex(MEALS).match(**filters) == scan(**filters)
+
+
+def test_facet_counts_match_a_linear_scan():
+    index = MealIndex(MEALS)
+    facets = FacetIndex(index, {
+        "nationality": [meal.strArea for meal in MEALS],
+        "category": [meal.strCategory for meal in MEALS],
+        "ingredients": [name for meal in MEALS for name in meal.ingredient_names],
+    })
+    assert facets.counts("category") == dict(Counter(meal.strCategory for meal in MEALS if meal.strCategory))
+
+    # Alternatives to the chosen nationality among the recipes with eggs
+    slots = {"nationality": "British", "category": None, "ingredients": ["Eggs"]}
+    expected = Counter(MEALS[position].strArea for position in scan(ingredients=["Eggs"]))
+    assert facets.conditional_counts("nationality", slots) == dict(expected)
+    # Ingredients to add to the eggs, the eggs themselves left out
+    expected = Counter(name for position in scan("British", ingredients=["Eggs"]) for name in set(MEALS[position].ingredient_names) if name != "Eggs")
+    assert facets.conditional_counts("ingredients", slots) == dict(expected)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import data.store
+from data.ingest import Checkpoint, HttpCache, MealCrawler
+from data.store import MealStore
+
+# Canned MealDB records, as search.php and lookup.php return them
+MEALS = [
+    {"idMeal": "1", "strMeal": "Arrabiata", "strCategory": "Vegetarian", "strArea": "Italian", "strInstructions": "Boil the pasta for 10 minutes.", "strIngredient1": "penne", "strIngredient2": "tomato", "strIngredient3": ""},
+    {"idMeal": "2", "strMeal": "Apple Pie", "strCategory": "Dessert", "strArea": "British", "strInstructions": "Bake for 40 minutes.", "strIngredient1": "apple", "strIngredient2": "flour"},
+    {"idMeal": "3", "strMeal": "Bread", "strCategory": "Side", "strArea": "British", "strInstructions": "Bake for 30 minutes.", "strIngredient1": "flour"},
+    {"idMeal": "4", "strMeal": "Zucchini Soup", "strCategory": "Starter", "strArea": "French", "strInstructions": "Simmer for 20 minutes.", "strIngredient1": "zucchini"},
+]
+
+
+class MealDbHandler(BaseHTTPRequestHandler):
+    """Stand-in for TheMealDB: ETag revalidation and a few failures to retry."""
+
+    failures = {}
+    requests = []
+    # Crawl state file read at each request, to see what a crash would leave
+    watched_path = None
+    watched = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.requests.append(self.path)
+        if self.watched_path is not None:
+            try:
+                with open(self.watched_path, "r") as watched_file:
+                    self.watched.append(json.load(watched_file))
+            except FileNotFoundError:
+                self.watched.append(None)
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        if url.path.endswith("search.php"):
+            meals = [meal for meal in MEALS if meal["strMeal"].lower().startswith(query["f"][0])]
+        else:
+            meals = [meal for meal in MEALS if meal["idMeal"] == query["i"][0]]
+        body = json.dumps({"meals": meals or None}).encode("utf-8")
+        etag = f'"{hash(body)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    MealDbHandler.failures = {}
+    MealDbHandler.requests = []
+    MealDbHandler.watched_path = None
+    MealDbHandler.watched = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), MealDbHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    meal_store = MealStore(str(tmp_path / "meals.json"))
+    meal_store.init()
+    monkeypatch.setattr(data.store, "_store", meal_store)
+    return meal_store
+
+
+def crawler(server, tmp_path, **kwargs):
+    return MealCrawler(
+        server, concurrency=4, rate=0, backoff=0.01,
+        checkpoint=Checkpoint(str(tmp_path / "checkpoint.json")),
+        cache=HttpCache(str(tmp_path / "http_cache.json")),
+        **kwargs,
+    )
+
+
+def test_crawl_inserts_letters_and_ids(server, store, tmp_path):
+    stats = asyncio.run(crawler(server, tmp_path).crawl("abz", ["4", "1"]))
+    assert stats["failures"] == 0
+    assert sorted(meal.idMeal for meal in store.meals) == ["1", "2", "3", "4"]
+    # Ids already returned by a letter are not looked up again
+    assert not any("lookup.php?i=1" in path for path in MealDbHandler.requests)
+
+
+def test_crawl_retries_failed_requests(server, store, tmp_path):
+    MealDbHandler.failures = {"/search.php?f=b": 2}
+    stats = asyncio.run(crawler(server, tmp_path).crawl("b"))
+    assert stats["failures"] == 0
+    assert MealDbHandler.requests.count("/search.php?f=b") == 3
+    assert [meal.strMeal for meal in store.meals] == ["Bread"]
+
+
+def test_failed_unit_stays_out_of_the_checkpoint(server, store, tmp_path):
+    MealDbHandler.failures = {"/search.php?f=b": 10}
+    stats = asyncio.run(crawler(server, tmp_path, retries=1).crawl("ab"))
+    assert stats["failures"] == 1
+    assert Checkpoint(str(tmp_path / "checkpoint.json")).letters == {"a"}
+
+    # The next run only crawls the failed letter
+    MealDbHandler.failures = {}
+    MealDbHandler.requests = []
+    stats = asyncio.run(crawler(server, tmp_path).crawl("ab"))
+    assert MealDbHandler.requests == ["/search.php?f=b"]
+    assert sorted(meal.idMeal for meal in store.meals) == ["1", "2", "3"]
+
+
+def test_recrawl_revalidates_with_etags(server, store, tmp_path):
+    # Ids are looked up once every letter is done: by then the validators of
+    # the letters are on disk, not only at the end of the crawl
+    MealDbHandler.watched_path = str(tmp_path / "http_cache.json")
+    asyncio.run(crawler(server, tmp_path).crawl("ab", ["4"]))
+    assert set(MealDbHandler.watched[-1]) == {server + "search.php?f=a", server + "search.php?f=b"}
+    MealDbHandler.watched_path = None
+
+    (tmp_path / "checkpoint.json").unlink()
+    stats = asyncio.run(crawler(server, tmp_path).crawl("ab", ["4"]))
+    assert stats["not_modified"] == 3
+    assert stats["meals"] == 4
+    assert len(store.meals) == 4
@@ -0,0 +1,26 @@
+import pytest
+from utils import JsonScanner
+
+
+def scan(chunks):
+    scanner = JsonScanner()
+    for position, chunk in enumerate(chunks):
+        scanner.feed(chunk)
+        if scanner.complete:
+            return position
+    return None
+
+
+@pytest.mark.parametrize("chunks, stop", [
+    (['{"intent":', ' "ask_for_time"}', " Sure!"], 1),
+    # A nested object closing is not the end
+    (['{"slots": {', '"recipe_name": null', "}", "}", "\n"], 3),
+    # Braces and escaped quotes inside strings do not count
+    (['{"text": "a } \\"', ' { b"', "}"], 2),
+    (['Here you go: ', '{"a": 1}'], 1),
+    # An invalid object is skipped for the next valid one
+    (["{not json}", ' {"a": [1, 2]}'], 1),
+    (['{"a": "unterminated}'], None),
+])
+def test_scanner_stops_after_the_first_valid_object(chunks, stop):
+    assert scan(chunks) == stop
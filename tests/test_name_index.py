@@ -0,0 +1,18 @@
+import pytest
+from data.name_index import NameIndex
+
+NAMES = ["Beef Wellington", "Beef Brisket Pot Roast", "Apple Frangipan Tart", "Apam balik", "Roti john", "Rock Cakes", "Tarte Tatin", "Beef and Mustard Pie"]
+
+
+@pytest.mark.parametrize("query", ["beef", "BEEF ", "tart", "ar", "t", "e p", "pie", "wellingtons", ""])
+def test_search_matches_a_linear_scan(query):
+    expected = [position for position, name in enumerate(NAMES) if query.lower() in name.lower()]
+    assert NameIndex(NAMES).search(query) == expected
+
+
+def test_prefix_is_alphabetical_and_limited():
+    index = NameIndex(NAMES)
+    assert [NAMES[position] for position in index.prefix("beef")] == ["Beef and Mustard Pie", "Beef Brisket Pot Roast", "Beef Wellington"]
+    assert [NAMES[position] for position in index.prefix("BEEF", limit=2)] == ["Beef and Mustard Pie", "Beef Brisket Pot Roast"]
+    assert [NAMES[position] for position in index.prefix("r")] == ["Rock Cakes", "Roti john"]
+    assert index.prefix("zz") == []
@@ -0,0 +1,30 @@
+from argparse import Namespace
+from generation import generate
+from prefix_cache import PrefixCache, cache_bytes, prompt_prefixes
+
+TEMPLATE = "System: {}\nUser: {}\nCheffy:"
+SYSTEM = ["You are the slot extraction module of a recipe bot, reply with JSON.", "You are the dialogue manager of a recipe bot, pick the next action."]
+
+
+def test_cached_prefix_gives_the_uncached_output(tiny_model):
+    model, tokenizer = tiny_model
+    cache = PrefixCache(prompt_prefixes(TEMPLATE, SYSTEM), max_bytes=1 << 30)
+    cached, uncached = Namespace(max_new_tokens=10, greedy=True, prefix_cache=cache), Namespace(max_new_tokens=10, greedy=True)
+    for system, user in [(SYSTEM[0], "A pasta dish"), (SYSTEM[1], "Kedgeree"), (SYSTEM[0], "Something quick")]:
+        inputs = tokenizer(TEMPLATE.format(system, user), return_tensors="pt")
+        assert generate(model, inputs, tokenizer, cached) == generate(model, inputs, tokenizer, uncached)
+    assert (cache.misses, cache.hits) == (2, 1)
+
+
+def test_least_recently_used_prefix_is_evicted(tiny_model):
+    model, tokenizer = tiny_model
+    prefixes = prompt_prefixes(TEMPLATE, SYSTEM)
+    probe = PrefixCache(prefixes, max_bytes=1 << 30)
+    size = max(cache_bytes(probe.lookup(model, tokenizer, tokenizer(prefix + "x").input_ids)) for prefix in prefixes)
+
+    # Room for a single prefix: the second one evicts the first
+    cache = PrefixCache(prefixes, max_bytes=size)
+    for prefix in [prefixes[0], prefixes[1], prefixes[0]]:
+        assert cache.lookup(model, tokenizer, tokenizer(prefix + "x").input_ids) is not None
+    assert (cache.misses, cache.hits) == (3, 0)
+    assert len(cache._caches) == 1 and cache.bytes <= cache.max_bytes
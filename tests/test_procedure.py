@@ -0,0 +1,38 @@
+import sqlite3
+from data.meal import Meal
+from data.procedure import estimate_minutes, estimate_time
+from data.sqlite_store import SqliteMealStore
+
+MOUSSAKA = (
+    "Heat the grill to high. Brown the beef in a deep ovenproof frying pan over a high heat for 5 mins.\r\n\r\n"
+    "Pour the yogurt mixture over the aubergines, then grill until the topping has set and turned golden."
+)
+FISH_PIE = "Chop the onion.\r\nSimmer the fish in the milk for 10 minutes.\r\nBake for 30-35 mins.\r\nServe with peas."
+
+
+def test_estimate_is_complete_with_a_duration_for_every_cooking_step():
+    # The grilling step gives no duration, 5 minutes is only a lower bound
+    assert estimate_time(MOUSSAKA) == (5, False)
+    # Chopping and serving are taken as quick
+    assert estimate_time(FISH_PIE) == (45, True)
+    assert estimate_time("Mix everything and serve.") == (None, False)
+    assert estimate_minutes(MOUSSAKA) == 5
+
+
+def test_time_filter_keeps_recipes_that_may_fit(tmp_path):
+    store = SqliteMealStore(str(tmp_path / "meals.sqlite"), json_path=None)
+    store.insert([
+        Meal.from_dict({"idMeal": "1", "strMeal": "Moussaka", "strInstructions": MOUSSAKA, "ingredients": "Beef"}),
+        Meal.from_dict({"idMeal": "2", "strMeal": "Fish pie", "strInstructions": FISH_PIE, "ingredients": "Fish"}),
+        Meal.from_dict({"idMeal": "3", "strMeal": "Salad", "strInstructions": "Toss the leaves.", "ingredients": "Lettuce"}),
+    ])
+    # The moussaka takes at least 5 minutes and the salad gives no duration, both may fit
+    assert [meal.strMeal for meal in store.filter(max_time=30)] == ["Moussaka", "Salad"]
+    assert [meal.strMeal for meal in store.filter(max_time=60)] == ["Moussaka", "Fish pie", "Salad"]
+
+    # Estimates stored by an older estimate_minutes are recomputed on open
+    with sqlite3.connect(store.path) as connection:
+        connection.execute("UPDATE meal SET estimated_minutes = 90 WHERE idMeal = '1'")
+        connection.execute("PRAGMA user_version = 2")
+    reopened = SqliteMealStore(store.path, json_path=None)
+    assert [meal.strMeal for meal in reopened.filter(max_time=30)] == ["Moussaka", "Salad"]
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+from data.meal import Meal
+from data.snapshot import SnapshotNames
+from data.sqlite_store import SqliteMealStore, migrate_json_to_sqlite
+from data.store import MealStore
+
+MEALS = [
+    {"idMeal": str(number), "strMeal": f"Meal {number}", "strCategory": "Side", "strArea": "British", "strInstructions": f"Bake for {number} minutes.", "ingredients": "Flour"}
+    for number in range(1, 9)
+]
+
+
+def make_store(tmp_path, **kwargs):
+    path = tmp_path / "meal_database.json"
+    if not path.exists():
+        path.write_text(json.dumps(MEALS[:3], indent=4))
+    return MealStore(str(path), **kwargs)
+
+
+def test_compaction_keeps_the_snapshot_mapped(tmp_path):
+    store = make_store(tmp_path, compact_min_records=0)
+    store.write_snapshot()
+    assert store._snapshot() is not None
+
+    # More journal records than snapshot records, so this insert compacts
+    store.insert([Meal.from_dict(meal) for meal in MEALS[3:]])
+    assert store._journal_records == 0
+    assert store._snapshot() is not None
+    assert len(store) == 8
+
+    reopened = make_store(tmp_path)
+    assert [meal.strMeal for meal in reopened.find_by_name("meal 8")] == ["Meal 8"]
+    assert reopened._snapshot() is not None
+    # Served from the mapped snapshot, the JSON database is never parsed
+    assert reopened._meals is None
+
+
+def test_reads_leave_a_stale_snapshot_to_write_snapshot(tmp_path):
+    store = make_store(tmp_path, compact_min_records=100)
+    store.write_snapshot()
+    store.insert([Meal.from_dict(MEALS[3])])
+    assert store._journal_records == 1
+    written = os.stat(store.snapshot_path).st_mtime_ns
+
+    stale = make_store(tmp_path)
+    assert stale._snapshot() is None
+    assert len(stale.meals) == 4
+    assert os.stat(store.snapshot_path).st_mtime_ns == written
+
+    stale.write_snapshot()
+    assert stale._snapshot() is not None
+    reopened = make_store(tmp_path)
+    assert [meal.strMeal for meal in reopened.filter(max_time=2)] == ["Meal 1", "Meal 2"]
+    assert reopened._meals is None
+
+
+def test_snapshot_lookups_match_the_resident_indexes(tmp_path):
+    path = tmp_path / "meal_database.json"
+    shutil.copy(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "meal_database.json"), path)
+    resident = MealStore(str(path), snapshot_path=str(tmp_path / "none.bin"))
+    MealStore(str(path)).write_snapshot()
+    mapped = MealStore(str(path))
+
+    for name in ["Kedgree", "lasagna", "big mac", "Sushi", "pancake", "Zzzz"]:
+        assert mapped.resolve_positions(name) == resident.resolve_positions(name)
+    for query in ["ke", "pie", "Fish", "xyz"]:
+        assert mapped.find_positions(query) == resident.find_positions(query)
+        assert mapped.names_by_prefix(query) == resident.names_by_prefix(query)
+    filters = {"nationality": "british", "ingredients": ["Eggs"]}
+    assert [meal.idMeal for meal in mapped.filter(**filters)] == [meal.idMeal for meal in resident.filter(**filters)]
+    # Served from the mapped tables: neither the meals nor the names were decoded as lists
+    assert mapped._meals is None
+    assert isinstance(mapped.recipe_names(), SnapshotNames)
+
+
+def test_sqlite_migration_copies_the_journal(tmp_path):
+    store = make_store(tmp_path, compact_min_records=100)
+    store.insert([Meal.from_dict(MEALS[3])])
+    assert store._journal_records == 1
+
+    migrated = SqliteMealStore(str(tmp_path / "meals.sqlite"), json_path=store.path)
+    assert [meal.strMeal for meal in migrated.meals] == ["Meal 1", "Meal 2", "Meal 3", "Meal 4"]
+    assert migrate_json_to_sqlite(store.path, str(tmp_path / "copy.sqlite")) == 4
+
+
+def test_neighbours_written_before_an_insert_are_rebuilt(tmp_path):
+    store = make_store(tmp_path, compact_min_records=100)
+    store.write_neighbours(3)
+    store.insert([Meal.from_dict({**MEALS[0], "idMeal": "100", "strMeal": "Meal 1 Deluxe"})])
+
+    assert store.similar("Meal 1 Deluxe", 3)
+    assert "Meal 1 Deluxe" in [name for name, similarity in make_store(tmp_path).similar("Meal 1", 3)]
+
+
+def test_inserts_append_to_the_journal_and_skip_known_ids(tmp_path):
+    store = make_store(tmp_path, compact_min_records=100)
+    database = (tmp_path / "meal_database.json").read_text()
+    store.insert([Meal.from_dict(meal) for meal in MEALS[2:5]])
+
+    # Meal 3 was already stored, only the two new meals are journaled
+    assert len((tmp_path / "meal_database.json.journal").read_text().splitlines()) == 2
+    assert (tmp_path / "meal_database.json").read_text() == database
+    assert (tmp_path / "meal_database.json.ids").read_text().split() == [str(number) for number in range(1, 6)]
+
+    # The id index is read back by a new store, a torn last line is skipped
+    with open(tmp_path / "meal_database.json.journal", "a") as journal:
+        journal.write('{"idMeal": "9", "strMe')
+    reopened = make_store(tmp_path, compact_min_records=100)
+    reopened.insert([Meal.from_dict(MEALS[4])])
+    assert [meal.strMeal for meal in reopened.meals] == ["Meal 1", "Meal 2", "Meal 3", "Meal 4", "Meal 5"]
+
+
+def test_compaction_merges_the_journal_last_record_winning(tmp_path):
+    store = make_store(tmp_path, compact_min_records=100)
+    store.insert([Meal.from_dict(MEALS[3])])
+    # An upsert of a stored meal replays over the snapshot
+    with open(store.journal_path, "a") as journal:
+        journal.write(json.dumps({**MEALS[0], "strMeal": "Meal 1 renamed"}) + "\n")
+
+    reopened = make_store(tmp_path, compact_min_records=100)
+    assert [meal.strMeal for meal in reopened.meals] == ["Meal 1 renamed", "Meal 2", "Meal 3", "Meal 4"]
+    reopened.compact()
+    assert (tmp_path / "meal_database.json.journal").read_text() == ""
+    assert [meal["strMeal"] for meal in json.loads((tmp_path / "meal_database.json").read_text())] == ["Meal 1 renamed", "Meal 2", "Meal 3", "Meal 4"]
+    assert sorted((tmp_path / "meal_database.json.ids").read_text().split()) == ["1", "2", "3", "4"]
+
+    # More journal records than snapshot records compact on insert
+    compacting = make_store(tmp_path, compact_min_records=0)
+    compacting.insert([Meal.from_dict(meal) for meal in MEALS[4:]])
+    assert compacting._journal_records == 4
+    compacting.insert([Meal.from_dict({**MEALS[0], "idMeal": "9", "strMeal": "Meal 9"})])
+    assert compacting._journal_records == 0
+    assert len(json.loads((tmp_path / "meal_database.json").read_text())) == 9
@@ -0,0 +1,36 @@
+import pytest
+from pipeline import stream_reply, strip_quotes
+
+REPLIES = [
+    "Lasagne takes about an hour.",
+    '"Lasagne takes about an hour.',
+    '  "Lasagne takes about an hour."\n',
+    '"Lasagne takes about an hour." Enjoy!',
+    'You can cook "Lasagne" tonight.',
+    '"Try the "Lasagne" tonight."',
+    '"Try "Lasagne", "Moussaka" or "Poutine"."',
+]
+
+
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+@pytest.mark.parametrize("size", [1, 3, 100])
+def test_stream_shows_the_non_streamed_reply(reply, size):
+    written = []
+    generated, shown = stream_reply(chunked(reply, size), written.append)
+    assert generated == reply
+    assert shown == strip_quotes(reply)
+    assert "".join(written) == "Cheffy: " + strip_quotes(reply) + "\n"
+
+
+def test_quoted_reply_streams_after_the_opening_quote():
+    written = []
+    chunks = iter(['"Ready', ' in 20 minutes', ' with "fast', ' pasta".', '" Enjoy!'])
+    generated, shown = stream_reply(chunks, written.append)
+    # Each chunk after the opening quote is written before the reply ends,
+    # only the text after a possible closing quote waits for the next quote
+    assert written == ["Cheffy: ", "Ready", " in 20 minutes", " with ", '"fast pasta', '".', "\n"]
+    assert shown == 'Ready in 20 minutes with "fast pasta".'
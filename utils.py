@@ -1,23 +1,26 @@
+import json
+import os
 from argparse import Namespace
-from typing import Tuple
+from typing import TYPE_CHECKING, Iterator, List, Tuple
 
-import torch
-from transformers import (
-    AutoModelForCausalLM,
-    AutoTokenizer,
-    BatchEncoding,
-    PreTrainedTokenizer,
-    PreTrainedModel,
-)
+if TYPE_CHECKING:
+    from transformers import BatchEncoding, PreTrainedModel, PreTrainedTokenizer
+
+# torch and transformers are imported when a model is loaded, not with the
+# prompts, so the stages that only compute metrics start in a few seconds
+TOKENIZER_CACHE_DIR = ".cache/tokenizers"
 
 MODELS = {
     "llama2": "meta-llama/Llama-2-7b-chat-hf",
     "llama3": "meta-llama/Meta-Llama-3-8B-Instruct",
+    # Same tokenizer as llama3, small enough to be its draft model
+    "llama3-1b": "meta-llama/Llama-3.2-1B-Instruct",
 }
 
 TEMPLATES = {
     "llama2": "<s>[INST] <<SYS>>\n{}\n<</SYS>>\n\n{} [/INST]",
     "llama3": "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{}<|eot_id|><|start_header_id|>user<|end_header_id|>\n\n{}<|eot_id|><|start_header_id|>assistant<|end_header_id|>",
+    "llama3-1b": "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{}<|eot_id|><|start_header_id|>user<|end_header_id|>\n\n{}<|eot_id|><|start_header_id|>assistant<|end_header_id|>",
 
 }
 PROMPTS = {
@@ -100,6 +103,9 @@ PROMPTS = {
         - `nationality` (e.g., Italian, Tunisian, Spanish)
         - `category` (e.g., pasta, meat, vegetarian)
         - `ingredients` (a list of ingredients, e.g., tomato, onion, garlic)
+        - `ingredients_mode`: `"pantry"` if the ingredients are everything the user has available (e.g., "what can I cook with ...", "I only have ..."), otherwise `null`
+        - `similar_to`: the name of a recipe the user wants something similar to (e.g., "something like the Kedgeree"), otherwise `null`
+        - `max_time`: the longest cooking time the user accepts, in minutes (e.g., "ready in under half an hour" is 30), otherwise `null`
     - If a slot value is not explicitly provided, set it to `null`.
 
     2) **Output Format**:
@@ -109,7 +115,10 @@ PROMPTS = {
             "slots": {
                 "nationality": "<value_or_null>",
                 "category": "<value_or_null>",
-                "ingredients": "<value_or_null>"
+                "ingredients": "<value_or_null>",
+                "ingredients_mode": "<pantry_or_null>",
+                "similar_to": "<recipe_name_or_null>",
+                "max_time": "<minutes_or_null>"
             }
         }
         ```
@@ -125,7 +134,10 @@ PROMPTS = {
         "slots": {
             "nationality": "Italian",
             "category": "pasta",
-            "ingredients": "tomato, garlic"
+            "ingredients": "tomato, garlic",
+            "ingredients_mode": null,
+            "similar_to": null,
+            "max_time": null
         }
     }```
 
@@ -136,7 +148,52 @@ PROMPTS = {
         "slots": {
             "nationality": null,
             "category": null,
-            "ingredients": "chicken, potatoes"
+            "ingredients": "chicken, potatoes",
+            "ingredients_mode": null,
+            "similar_to": null,
+            "max_time": null
+        }
+    }```
+
+    User Input: "I only have eggs, flour, milk and sugar at home, what can I cook?"
+    Output:
+    ```json
+    {
+        "slots": {
+            "nationality": null,
+            "category": null,
+            "ingredients": "eggs, flour, milk, sugar",
+            "ingredients_mode": "pantry",
+            "similar_to": null,
+            "max_time": null
+        }
+    }```
+
+    User Input: "Any vegetarian dish I can make in less than 20 minutes?"
+    Output:
+    ```json
+    {
+        "slots": {
+            "nationality": null,
+            "category": "vegetarian",
+            "ingredients": null,
+            "ingredients_mode": null,
+            "similar_to": null,
+            "max_time": 20
+        }
+    }```
+
+    User Input: "That sounds good, do you have something similar to the Kedgeree?"
+    Output:
+    ```json
+    {
+        "slots": {
+            "nationality": null,
+            "category": null,
+            "ingredients": null,
+            "ingredients_mode": null,
+            "similar_to": "Kedgeree",
+            "max_time": null
         }
     }```
 
@@ -284,6 +341,7 @@ PROMPTS = {
     2) Fill the `action_required` field:
     - If the list of recipes is empty, return `["no_recipe_found"]` **without adding any other actions**.
     - If the list of recipes is not empty, return `["propose_recipe"]`, and for each null slot, add `req_info_{slot_name}`, where `{slot_name}` is the name of a null slot.
+    - If the input has a `slots_to_ask` list, add the `req_info_{slot_name}` actions in its order: the first slot is the one that narrows the recipes the most.
 
     Return a JSON object with a single key, `action_required`, containing a list of actions to perform.
 
@@ -360,8 +418,13 @@ PROMPTS = {
     You have recived the list action required from the DM module.
     The actions are:
         - no_recipe_found: The bot has not found any recipe that matches the user's request. You should tell to the user that there are no recipes that match the request. And ask to him if he want to change his request.
+          If the input has a non empty `closest_recipes` list, propose them as the closest alternatives, they match only part of the request.
         - propose_recipe: The bot has found some recipes that match the user's request. You should provide ALL the recipes to the user, the recipes are in the list of recipes that you have recived from the DM module.
+          If the input has `missing_ingredients`, the user told you the ingredients they have: for each recipe listed there, say which ingredients they would still need to buy.
+          If the input has a non empty `time_unconfirmed` list, the user asked for a maximum time but the steps of those recipes do not give every duration: propose them too, saying they may take longer.
         - req_info_{slot_name}: The bot needs more information about the slot_name. You should ask the user to provide more information about the slot_name if he want to filter more the recipes.
+          When there are several req_info actions, ask first about the first one, it is the most useful to narrow the recipes.
+          For req_info_ingredients, if the input has `ingredients_to_ask_about`, ask whether the user would like some of those ingredients: they are the ones that narrow the recipes the most.
     - Example output:
       "With the information you have provided, you could cook Italian Lasagna. Do you want to know the list of ingredients or procedure? Otherwise, please provide more details, like the ingredients you have in your fridge."
     - Example output:
@@ -384,6 +447,8 @@ PROMPTS = {
     Instructions:
     - Provide the answer to the user's request which is inside the field `action_required` from the DM dictionary.
     - If the dm told that the recipe is not found, you should tell to the user that the recipe is not found.
+    - For the procedure you receive the numbered `steps` of the recipe: present them in order, one step at a time if they are many.
+    - For the cooking time you receive `estimated_minutes`, an estimate summed from the durations written in the steps, and the `timed_steps` with their durations: present it as an approximate time ("about 45 minutes"), never as an exact one. If `estimate_complete` is false some steps that cook give no duration, so `estimated_minutes` is only a lower bound: say it takes at least that long ("at least 20 minutes, plus the grilling"). If `estimated_minutes` is null the steps give no duration at all, so the time is unknown: say so.
     - Example output:
         "In order to cook the lasagna you need tomato, onion, garlic, and pasta. Do you want to know how to proceed with the recipe?"
     - Example output:
@@ -464,6 +529,7 @@ PROMPTS = {
         - Identify any `null` values in the `slots` dictionary.
         - If `recipes` is empty, return `{"action_required": ["no_recipe_found"]}` **alone**.
         - If `recipes` is not empty, return `"propose_recipe"` and, for each `null` slot, add `"req_info_{slot_name}"`.
+        - If the input has a `slots_to_ask` list, add the `"req_info_{slot_name}"` actions in its order: the first slot is the one that narrows the recipes the most.
 
         ### 2) Handling Ingredient Requests
         - If `recipe_information` is `null`, return `{"action_required": ["ask_recipe_name"]}`.
@@ -524,28 +590,133 @@ PROMPTS = {
 
 
 
-def load_model(args: Namespace) -> Tuple[PreTrainedModel, PreTrainedTokenizer]:
-    model = AutoModelForCausalLM.from_pretrained(
-        args.model_name,
-        device_map="auto" if args.parallel else args.device, 
+def load_tokenizer(model_name: str) -> "PreTrainedTokenizer":
+    """The tokenizer of a model, saved locally the first time so later loads skip the hub."""
+    from transformers import AutoTokenizer
+    path = os.path.join(TOKENIZER_CACHE_DIR, model_name.replace("/", "--"))
+    if os.path.isdir(path):
+        return AutoTokenizer.from_pretrained(path)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(path)
+    return tokenizer
+
+
+def _load_weights(model_name: str, args: Namespace) -> "PreTrainedModel":
+    import torch
+    from transformers import AutoModelForCausalLM
+    if getattr(args, "quantize", "none") == "int8":
+        from quantization import load_int8
+        return load_int8(model_name)
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return AutoModelForCausalLM.from_pretrained(
+        model_name,
+        device_map="auto" if args.parallel else device,
         torch_dtype=torch.float32 if args.dtype == "f32" else torch.bfloat16,
+        # Weights are memory-mapped from the safetensors files straight into
+        # the model, instead of initialized and then overwritten
+        low_cpu_mem_usage=True,
     )
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+
+
+def load_model(args: Namespace) -> Tuple["PreTrainedModel", "PreTrainedTokenizer"]:
+    if getattr(args, "quantize", "none") == "int8" and (args.device not in (None, "cpu") or args.parallel):
+        raise ValueError("--quantize int8 runs on CPU only")
+    model = _load_weights(args.model_name, args)
+    tokenizer = load_tokenizer(args.model_name)
+    # The draft model of --draft-model reaches every generate call through args
+    args.assistant_model = None
+    if getattr(args, "draft_model", None):
+        if load_tokenizer(args.draft_model).get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"The draft model {args.draft_model} does not share the tokenizer of {args.model_name}")
+        args.assistant_model = _load_weights(args.draft_model, args)
     return model, tokenizer  # type: ignore
 
 
+def variant_suffix(args: Namespace) -> str:
+    """Suffix of the files an evaluation writes, so runs of a quantized model keep their own."""
+    quantize = getattr(args, "quantize", "none")
+    return "" if quantize == "none" else f"_{quantize}"
+
+
+class JsonScanner:
+    """Brace and string state of a generated text, fed one token at a time."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.buffer: List[str] = []
+        self.complete = False
+
+    def feed(self, text: str):
+        self.tokens += 1
+        if self.complete:
+            return
+        for char in text:
+            if self.depth == 0:
+                # Text around the object, quotes included, is not JSON
+                if char == "{":
+                    self.depth = 1
+                    self.buffer = [char]
+                continue
+            self.buffer.append(char)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    # An invalid object is skipped, like extract_json_from_text does
+                    try:
+                        json.loads("".join(self.buffer))
+                    except ValueError:
+                        continue
+                    self.complete = True
+                    return
+
+
+# Generation lives in generation.py, imported on the first call
 def generate(
-    model: PreTrainedModel,
-    inputs: BatchEncoding,
-    tokenizer: PreTrainedTokenizer,
+    model: "PreTrainedModel",
+    inputs: "BatchEncoding",
+    tokenizer: "PreTrainedTokenizer",
     args: Namespace,
+    stop_at_json: bool = False,
+    grammar=None,
+    stage: str = "generate",
 ) -> str:
-    output = model.generate(
-        inputs.input_ids,
-        attention_mask=inputs.attention_mask,
-        max_new_tokens=args.max_new_tokens,
-        pad_token_id=tokenizer.eos_token_id,
-    )
-    return tokenizer.decode(
-        output[0][len(inputs.input_ids[0]) :], skip_special_tokens=True
-    )
+    from generation import generate
+    return generate(model, inputs, tokenizer, args, stop_at_json, grammar, stage)
+
+
+def generate_stream(
+    model: "PreTrainedModel",
+    inputs: "BatchEncoding",
+    tokenizer: "PreTrainedTokenizer",
+    args: Namespace,
+    stage: str = "generate",
+) -> Iterator[str]:
+    from generation import generate_stream
+    return generate_stream(model, inputs, tokenizer, args, stage)
+
+
+def generate_batch(
+    model: "PreTrainedModel",
+    tokenizer: "PreTrainedTokenizer",
+    texts: List[str],
+    args: Namespace,
+    stop_at_json: bool = False,
+    grammars=None,
+    stage: str = "generate",
+) -> List[str]:
+    from generation import generate_batch
+    return generate_batch(model, tokenizer, texts, args, stop_at_json, grammars, stage)